@@ -0,0 +1,178 @@
+import argparse
+import glob
+import json
+import os
+import sys
+
+from benchmarks.benchmark import SCALAR_STAGES, benchmarkSystem, compareResults, getEnvironment
+from benchmarks.synthetic import generateSystem, getSystemName
+from data.system import MAMDANI, loadSystem, saveSystem
+from engine.defuzzification import METHODS, WEIGHTED_AVERAGE
+
+SAMPLE_FILES = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "sample_files")
+
+# Each sweep varies one parameter and keeps the others at these values
+BASE = {"inputs": 3, "sets": 5, "rules": 30}
+SWEEPS = ["inputs", "sets", "rules"]
+
+# What run measures unless told otherwise, --quick picks the second set
+DEFAULTS = {"inputs": [1, 2, 3, 5, 8], "sets": [3, 5, 9, 17, 33], "rules": [10, 30, 100, 300, 1000],
+            "batch_sizes": [16, 1024, 65536], "samples": 1000, "batch_rows": 65536, "repeat": 3}
+QUICK_DEFAULTS = {"inputs": [2, 4], "sets": [3, 9], "rules": [10, 100],
+                  "batch_sizes": [64, 4096], "samples": 200, "batch_rows": 8192, "repeat": 2}
+
+
+def intList(text: str) -> list[int]:
+    try:
+        values = [int(x) for x in text.split(",") if x.strip() != ""]
+    except ValueError:
+        values = []
+    if not values or any(x <= 0 for x in values):
+        raise argparse.ArgumentTypeError(f"expected a comma separated list of positive integers, got '{text}'")
+    return values
+
+
+def formatNs(value: float | None) -> str:
+    return "-" if value is None else f"{value:,.0f}"
+
+
+def printResult(result: dict):
+    print(f"{result['name']}: {result['inputs']} inputs, {result['sets']} sets, {result['rules']} rules, "
+          f"compiled in {result['compileMs']:.2f} ms, {result['firingRate']:.0%} of inputs fire")
+    header = "".join(f"{stage:>12s}" for stage in SCALAR_STAGES)
+    print(f"  {'ns/sample':<14s}{header}{'peak bytes':>14s}")
+    scalar = result["scalar"] or {}
+    print(f"  {'scalar':<14s}" + "".join(f"{formatNs(scalar.get(stage)):>12s}" for stage in SCALAR_STAGES))
+    for batch in result["batch"]:
+        row = "".join(f"{formatNs(batch.get(stage)):>12s}" for stage in SCALAR_STAGES)
+        print(f"  {'batch ' + str(batch['batchSize']):<14s}{row}{batch['peakBytes']:>14,d}")
+
+
+def printCurves(results: dict):
+    # End-to-end time against the swept parameter, with the others at BASE
+    for parameter, points in results["sweeps"].items():
+        systems = {x["name"]: x for x in results["systems"]}
+        print(f"\nScaling with {parameter} ({', '.join(f'{k}={v}' for k, v in BASE.items() if k != parameter)})")
+        sizes = [x["batchSize"] for x in systems[points[0]["system"]]["batch"]]
+        print(f"  {parameter:>8s}{'scalar':>12s}" + "".join(f"{'batch ' + str(x):>14s}" for x in sizes))
+        for point in points:
+            result = systems[point["system"]]
+            scalar = (result["scalar"] or {}).get("evaluate")
+            print(f"  {point['value']:>8d}{formatNs(scalar):>12s}"
+                  + "".join(f"{formatNs(x['evaluate']):>14s}" for x in result["batch"]))
+
+
+def run(args: argparse.Namespace) -> int:
+    for name, value in (QUICK_DEFAULTS if args.quick else DEFAULTS).items():
+        if getattr(args, name) is None:
+            setattr(args, name, value)
+
+    options = dict(batchSizes=args.batch_sizes, samples=args.samples, batchRows=args.batch_rows,
+                   simulateSamples=args.simulate_samples, repeat=args.repeat, seed=args.seed,
+                   defuzzification=args.defuzzification)
+    results = {"environment": getEnvironment(), "options": options, "systems": [], "sweeps": {}}
+
+    systems = {}
+    for parameter in SWEEPS:
+        results["sweeps"][parameter] = []
+        for value in getattr(args, parameter):
+            config = {**BASE, parameter: value}
+            name = getSystemName(**config)
+            if name not in systems:
+                systems[name] = generateSystem(**config, seed=args.seed)
+            results["sweeps"][parameter].append({"value": value, "system": name})
+    if not args.no_samples:
+        for path in sorted(glob.glob(os.path.join(SAMPLE_FILES, "*.json"))):
+            systems[os.path.basename(path)] = loadSystem(path)
+
+    for name, project in systems.items():
+        if args.defuzzification != WEIGHTED_AVERAGE and project.inference != MAMDANI:
+            # Sugeno systems only have the weighted average
+            continue
+        result = benchmarkSystem(name, project, **options)
+        results["systems"].append(result)
+        if not args.quiet:
+            printResult(result)
+
+    if not args.quiet:
+        printCurves(results)
+
+    if args.output:
+        with open(args.output, "w") as file:
+            json.dump(results, file, indent=1)
+    return 0
+
+
+def compare(args: argparse.Namespace) -> int:
+    with open(args.old, "r") as file:
+        old = json.load(file)
+    with open(args.new, "r") as file:
+        new = json.load(file)
+
+    print(f"{'system':<36s}{'metric':<28s}{'old':>14s}{'new':>14s}{'ratio':>8s}")
+    for system, metric, before, after, ratio in compareResults(old, new):
+        if args.metric and not any(x in metric for x in args.metric):
+            continue
+        print(f"{system:<36s}{metric:<28s}{before:>14,.0f}{after:>14,.0f}{ratio:>8.2f}")
+    return 0
+
+
+def generate(args: argparse.Namespace) -> int:
+    saveSystem(generateSystem(args.inputs, args.sets, args.rules, args.outputs, args.conditions, args.seed), args.output)
+    return 0
+
+
+def main(argv: list[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(prog="python -m benchmarks", description="Fuzzy engine benchmarks")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    runParser = commands.add_parser("run", help="time every stage on synthetic systems and the sample files")
+    runParser.add_argument("-o", "--output", help="JSON file to save the results to")
+    runParser.add_argument("--inputs", type=intList, help="input counts to sweep")
+    runParser.add_argument("--sets", type=intList, help="sets per variable to sweep")
+    runParser.add_argument("--rules", type=intList, help="rule counts to sweep")
+    runParser.add_argument("-b", "--batch-sizes", type=intList, help="batch sizes to time")
+    runParser.add_argument("--samples", type=int, help="inputs timed one at a time")
+    runParser.add_argument("--batch-rows", type=int, help="rows timed per batch size")
+    runParser.add_argument("--simulate-samples", type=int, default=100,
+                           help="inputs timed through simulate(), which reuses the system compiled by its first call")
+    runParser.add_argument("-r", "--repeat", type=int, help="runs per measurement, the best one counts")
+    runParser.add_argument("--seed", type=int, default=0, help="seed of the synthetic systems and inputs")
+    runParser.add_argument("-d", "--defuzzification", choices=METHODS, default=WEIGHTED_AVERAGE,
+                           help="how crisp outputs are computed")
+    runParser.add_argument("--no-samples", action="store_true", help="skip the bundled sample files")
+    runParser.add_argument("--quick", action="store_true", help="a smaller sweep with fewer samples by default")
+    runParser.add_argument("-q", "--quiet", action="store_true", help="only write the JSON results")
+    runParser.set_defaults(run=run)
+
+    compareParser = commands.add_parser("compare", help="compare two saved runs")
+    compareParser.add_argument("old", help="results of the earlier run")
+    compareParser.add_argument("new", help="results of the later run")
+    compareParser.add_argument("-m", "--metric", action="append",
+                               help="only show metrics containing this text, can be repeated")
+    compareParser.set_defaults(run=compare)
+
+    generateParser = commands.add_parser("generate", help="write a synthetic system as a project file")
+    generateParser.add_argument("inputs", type=int)
+    generateParser.add_argument("sets", type=int)
+    generateParser.add_argument("rules", type=int)
+    generateParser.add_argument("-o", "--output", required=True, help="project file to write")
+    generateParser.add_argument("--outputs", type=int, default=1, help="output variables")
+    generateParser.add_argument("--conditions", type=int, default=2, help="conditions per rule")
+    generateParser.add_argument("--seed", type=int, default=0)
+    generateParser.set_defaults(run=generate)
+
+    args = parser.parse_args(argv)
+    for name in ("samples", "batch_rows", "simulate_samples", "repeat"):
+        if getattr(args, name, None) is not None and getattr(args, name) <= 0:
+            parser.error(f"{name.replace('_', '-')} must be positive")
+
+    try:
+        return args.run(args)
+    except Exception as e:
+        print(f"Error: {e}", file=sys.stderr)
+        return 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,154 @@
+import gc
+import math
+import os
+import platform
+import sys
+import time
+import tracemalloc
+from datetime import datetime, timezone
+from typing import Callable
+
+import numpy as np
+
+from data.system import System
+from engine.defuzzification import WEIGHTED_AVERAGE
+from engine.engine import CompiledSystem, simulate
+
+SCALAR_STAGES = ["fuzzify", "infer", "defuzzify", "evaluate", "simulate"]
+
+
+def measure(run: Callable[[], object], samples: int, repeat: int) -> float:
+    # Best of `repeat` runs in ns per sample, with the garbage collector off like timeit does
+    enabled = gc.isenabled()
+    gc.disable()
+    try:
+        best = math.inf
+        for _ in range(repeat):
+            start = time.perf_counter_ns()
+            run()
+            best = min(best, time.perf_counter_ns() - start)
+    finally:
+        if enabled:
+            gc.enable()
+    return best / samples
+
+
+def measurePeakBytes(run: Callable[[], object]) -> int:
+    # NumPy reports its buffers to tracemalloc, so this covers arrays as well as Python objects
+    tracemalloc.start()
+    try:
+        run()
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+def makeInputs(system: CompiledSystem, rows: int, seed: int) -> tuple[np.ndarray, np.ndarray]:
+    # Uniform rows within every input's limits. Rows where no rule fires have no scalar output,
+    # so the scalar stages only get rows that fire, and batches get all of them.
+    rng = np.random.default_rng(seed)
+    low = [variable.limits[0] for variable in system.inVariables]
+    high = [variable.limits[1] for variable in system.inVariables]
+    inputs = rng.uniform(low, high, (rows, len(low)))
+
+    crisp, _ = system.evaluateBatch(inputs)
+    return inputs, inputs[~np.isnan(crisp).any(axis=1)]
+
+
+def benchmarkSystem(name: str, project: System, batchSizes: list[int], samples: int = 1000,
+                    batchRows: int = 65536, simulateSamples: int = 100, repeat: int = 3, seed: int = 0,
+                    defuzzification: str = WEIGHTED_AVERAGE) -> dict:
+    variables = project.variables
+    rules = project.getRules()
+
+    start = time.perf_counter_ns()
+    system = CompiledSystem(variables, rules, defuzzification=defuzzification, inference=project.inference)
+    compileMs = (time.perf_counter_ns() - start) / 1e6
+    compileBytes = measurePeakBytes(lambda: CompiledSystem(variables, rules, defuzzification=defuzzification,
+                                                           inference=project.inference))
+
+    batchInputs, firing = makeInputs(system, max(batchRows, *batchSizes), seed)
+    result = {
+        "name": name,
+        "inference": project.inference,
+        "defuzzification": defuzzification,
+        "inputs": len(system.inVariables),
+        "sets": max((len(x.fuzzySets) for x in system.inVariables), default=0),
+        "rules": system.ruleCount,
+        "outputs": len(system.outVariables),
+        "compileMs": compileMs,
+        "compileBytes": compileBytes,
+        "firingRate": len(firing) / len(batchInputs),
+        "scalar": None,
+        "batch": [],
+    }
+
+    if len(firing):
+        inputs = np.resize(firing, (samples, firing.shape[1])).tolist()
+        fuzzified = [system.fuzzify(x) for x in inputs]
+        inferred = [system.infer(x) for x in fuzzified]
+        simulated = inputs[:simulateSamples]
+        runs = {
+            "fuzzify": (lambda: [system.fuzzify(x) for x in inputs], len(inputs)),
+            "infer": (lambda: [system.infer(x) for x in fuzzified], len(inputs)),
+            "defuzzify": (lambda: [system.defuzzify(x, y) for x, y in zip(inferred, inputs)], len(inputs)),
+            "evaluate": (lambda: [system.evaluate(x) for x in inputs], len(inputs)),
+            # Like the GUI, where only the first call compiles the system (compileMs covers that)
+            "simulate": (lambda: [simulate(variables, x, rules, project.inference) for x in simulated], len(simulated)),
+        }
+        result["scalar"] = {stage: measure(run, count, repeat) for stage, (run, count) in runs.items()}
+
+    for size in batchSizes:
+        chunks = [batchInputs[i:i + size] for i in range(0, len(batchInputs) - size + 1, size)]
+        fuzzified = [system.fuzzifyBatch(x) for x in chunks]
+        inferred = [system.inferBatch(x) for x in fuzzified]
+        count = len(chunks) * size
+        runs = {
+            "fuzzify": lambda: [system.fuzzifyBatch(x) for x in chunks],
+            "infer": lambda: [system.inferBatch(x) for x in fuzzified],
+            "defuzzify": lambda: [system.defuzzifyBatch(x, y) for x, y in zip(inferred, chunks)],
+            "evaluate": lambda: [system.evaluateBatch(x) for x in chunks],
+        }
+        timings = {stage: measure(run, count, repeat) for stage, run in runs.items()}
+        peakBytes = measurePeakBytes(lambda: system.evaluateBatch(chunks[0]))
+        result["batch"].append({"batchSize": size, **timings, "peakBytes": peakBytes, "bytesPerSample": peakBytes / size})
+
+    return result
+
+
+def getEnvironment() -> dict:
+    return {
+        "time": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "python": sys.version.split()[0],
+        "numpy": np.__version__,
+        "platform": platform.platform(),
+        "processor": platform.processor() or platform.machine(),
+        "cpus": os.cpu_count(),
+    }
+
+
+def flattenResult(result: dict) -> dict[str, float]:
+    # Every number of one system's result under a dotted name, for comparing runs
+    metrics = {"compileMs": result["compileMs"], "compileBytes": result["compileBytes"]}
+    for stage, value in (result["scalar"] or {}).items():
+        metrics[f"scalar.{stage}"] = value
+    for batch in result["batch"]:
+        for key, value in batch.items():
+            if key != "batchSize":
+                metrics[f"batch{batch['batchSize']}.{key}"] = value
+    return metrics
+
+
+def compareResults(old: dict, new: dict) -> list[tuple[str, str, float, float, float]]:
+    # (system, metric, old, new, new / old) for every metric both runs measured
+    rows = []
+    oldSystems = {x["name"]: x for x in old["systems"]}
+    for result in new["systems"]:
+        if result["name"] not in oldSystems:
+            continue
+        before = flattenResult(oldSystems[result["name"]])
+        for metric, value in flattenResult(result).items():
+            if metric in before:
+                rows.append((result["name"], metric, before[metric], value,
+                             value / before[metric] if before[metric] else math.nan))
+    return rows
@@ -0,0 +1,51 @@
+import random
+
+from data.fuzzy_set import TRAP, TRI, FuzzySet
+from data.system import System
+from data.variable import IN, OUT, Variable
+
+LIMITS = (0, 100)
+
+
+def _partition(variable: Variable, sets: int):
+    # Evenly spaced triangles whose neighbours cross at 0.5, with shoulders at both ends
+    step = (LIMITS[1] - LIMITS[0]) / max(sets - 1, 1)
+    for i in range(sets):
+        center = LIMITS[0] + i * step
+        if i == 0:
+            values = [LIMITS[0], LIMITS[0], center, center + step]
+        elif i == sets - 1:
+            values = [center - step, center, LIMITS[1], LIMITS[1]]
+        else:
+            values = [center - step, center, center + step]
+        variable.addFuzzySet(FuzzySet(TRAP if len(values) == 4 else TRI, values, f"s{i}"))
+
+
+def generateSystem(inputs: int, sets: int, rules: int, outputs: int = 1, conditions: int = 2,
+                   seed: int = 0) -> System:
+    # A Mamdani system of random rules, each joining `conditions` distinct inputs with and.
+    # The same arguments always give the same system.
+    rng = random.Random(seed)
+    variables = []
+    for i in range(inputs):
+        variable = Variable(IN, LIMITS, f"in{i}")
+        _partition(variable, sets)
+        variables.append(variable)
+    for i in range(outputs):
+        variable = Variable(OUT, LIMITS, f"out{i}")
+        _partition(variable, sets)
+        variables.append(variable)
+
+    lines = []
+    for _ in range(rules):
+        chosen = rng.sample(range(inputs), min(conditions, inputs))
+        antecedent = " and ".join(f"in{i} s{rng.randrange(sets)}" for i in chosen)
+        lines.append(f"{antecedent} => out{rng.randrange(outputs)} s{rng.randrange(sets)}")
+
+    return System(title=getSystemName(inputs, sets, rules, outputs, conditions),
+                  description=f"Synthetic benchmark system, seed {seed}", variables=variables,
+                  rules="\n".join(lines) + "\n")
+
+
+def getSystemName(inputs: int, sets: int, rules: int, outputs: int = 1, conditions: int = 2) -> str:
+    return f"synthetic-i{inputs}-s{sets}-r{rules}-o{outputs}-c{conditions}"
@@ -1,14 +1,29 @@
-from typing import Literal
+from typing import Callable, Literal
+
+import numpy as np
+
+from .revision import touch
 
 TRI = "TRI"
 TRAP = "TRAP"
+# Sugeno consequents: a constant output, or a linear function of the inputs
+CONSTANT = "CONSTANT"
+LINEAR = "LINEAR"
 
 
 class FuzzySet:
-    def __init__(self, /, type: Literal["TRI", "TRAP"], values: list[int], name="") -> None:
-        self.name = name
-        self.type = type
-        self.values = values
+    __slots__ = ("name", "type", "values")
+
+    def __init__(self, /, type: Literal["TRI", "TRAP", "CONSTANT", "LINEAR"], values: list[int], name="") -> None:
+        # A new set changes nothing built so far, only edits bump the revision
+        object.__setattr__(self, "name", name)
+        object.__setattr__(self, "type", type)
+        object.__setattr__(self, "values", tuple(values))
+
+    def __setattr__(self, name, value):
+        # values is a tuple, so it can only change by assignment, which bumps the revision
+        super().__setattr__(name, tuple(value) if name == "values" else value)
+        touch()
 
     def getCentroid(self) -> float:
         if self.type == TRI:
@@ -26,3 +41,59 @@ class FuzzySet:
                 cx += (self.values[i] + self.values[i + 1]) * (self.values[i] * y[i + 1] - self.values[i + 1] * y[i])
             
             return cx / (6 * a)
+        elif self.type == CONSTANT:
+            return self.values[0]
+
+    def getOutput(self, input: list[float]) -> float:
+        # Sugeno output for the crisp inputs. A linear set holds one coefficient per input followed by the constant.
+        if self.type == CONSTANT:
+            return self.values[0]
+
+        output = 0
+        for coefficient, x in zip(self.values[:-1], input):
+            output += coefficient * x
+        return output + self.values[-1]
+
+    def getCorners(self) -> tuple[float, float, float, float]:
+        # A triangle is a trapezoid whose top is a single point
+        if self.type == TRI:
+            a, b, c = self.values
+            return a, b, b, c
+        return tuple(self.values)
+
+    def getMembershipFunction(self) -> Callable[[float], float]:
+        # Closed form of the piecewise-linear shape with the corners bound once.
+        # The x <= a and x >= d checks come first, so a degenerate shoulder
+        # (a == b or c == d) never reaches a division by zero.
+        a, b, c, d = self.getCorners()
+
+        def membership(x: float) -> float:
+            if x <= a or x >= d:
+                return 0
+            if x <= b:
+                return (x - a) / (b - a)
+            if x <= c:
+                return 1.0
+            return 1 - (x - c) / (d - c)
+
+        return membership
+
+    def getMembership(self, x: float) -> float:
+        # The same steps as getMembershipFunction(), without building a closure for a single input
+        a, b, c, d = self.getCorners()
+        if x <= a or x >= d:
+            return 0
+        if x <= b:
+            return (x - a) / (b - a)
+        if x <= c:
+            return 1.0
+        return 1 - (x - c) / (d - c)
+
+    def getMembershipBatch(self, x: np.ndarray) -> np.ndarray:
+        a, b, c, d = self.getCorners()
+
+        # The unused branch may divide by zero for degenerate shoulders, np.where discards it
+        with np.errstate(divide="ignore", invalid="ignore"):
+            result = np.where(x <= b, (x - a) / (b - a), np.where(x <= c, 1.0, 1 - (x - c) / (d - c)))
+
+        return np.where((x <= a) | (x >= d), 0.0, result)
@@ -0,0 +1,11 @@
+# Bumped on every change to a Variable or FuzzySet, so anything built from them can tell it is stale
+_revision = 0
+
+
+def touch():
+    global _revision
+    _revision += 1
+
+
+def getRevision() -> int:
+    return _revision
@@ -1,13 +1,126 @@
+import re
+from functools import lru_cache
+
+IS = "is"
+AND = "and"
+OR = "or"
+NOT = "not"
+# The operators of the original two-condition format, read as "and not" and "or not"
+AND_NOT = "and_not"
+OR_NOT = "or_not"
+
+KEYWORDS = {AND, OR, NOT, "=>", "(", ")", ","}
+
+
+class _RuleParser:
+    # Recursive descent over the tokens of one rule. not binds tighter than and, which binds tighter than or.
+
+    def __init__(self, rule: str) -> None:
+        self.text = rule
+        self.tokens = []
+        for token in re.findall(r"=>|[(),]|[^\s(),]+", rule):
+            self.tokens += [AND, NOT] if token == AND_NOT else [OR, NOT] if token == OR_NOT else [token]
+        # Reading past the end gives None instead of an IndexError
+        self.tokens.append(None)
+        self.position = 0
+
+    def fail(self, reason: str):
+        raise Exception(f"Invalid rule '{self.text}': {reason}")
+
+    def next(self, expected: str) -> str:
+        token = self.tokens[self.position]
+        if token is None:
+            self.fail(f"expected {expected} at the end")
+        self.position += 1
+        return token
+
+    def expect(self, token: str):
+        found = self.next(f"'{token}'")
+        if found != token:
+            self.fail(f"expected '{token}' but found '{found}'")
+
+    def parse(self) -> tuple[tuple, tuple[tuple[str, str], ...], float]:
+        antecedent = self.parseOr()
+        self.expect("=>")
+
+        consequents = [self.parseSet()]
+        while self.tokens[self.position] == ",":
+            self.position += 1
+            consequents.append(self.parseSet())
+
+        weight = 1.0
+        if self.tokens[self.position] == "(":
+            self.position += 1
+            try:
+                weight = float(self.next("a weight"))
+            except ValueError:
+                self.fail("the weight must be a number")
+            if not 0 <= weight <= 1:
+                self.fail("the weight must be between 0 and 1")
+            self.expect(")")
+
+        if self.tokens[self.position] is not None:
+            self.fail(f"unexpected '{self.tokens[self.position]}'")
+
+        return antecedent, tuple(consequents), weight
+
+    def parseOr(self) -> tuple:
+        node = self.parseAnd()
+        while self.tokens[self.position] == OR:
+            self.position += 1
+            node = (OR, node, self.parseAnd())
+        return node
+
+    def parseAnd(self) -> tuple:
+        node = self.parseNot()
+        while self.tokens[self.position] == AND:
+            self.position += 1
+            node = (AND, node, self.parseNot())
+        return node
+
+    def parseNot(self) -> tuple:
+        token = self.tokens[self.position]
+        if token == NOT:
+            self.position += 1
+            return (NOT, self.parseNot())
+        if token == "(":
+            self.position += 1
+            node = self.parseOr()
+            self.expect(")")
+            return node
+        return (IS, *self.parseSet())
+
+    def parseSet(self) -> tuple[str, str]:
+        variable = self.next("a variable")
+        set = self.next(f"a fuzzy set of '{variable}'")
+        for token in (variable, set):
+            if token in KEYWORDS:
+                self.fail(f"expected a variable and a fuzzy set but found '{token}'")
+        return variable, set
+
+
+@lru_cache(maxsize=4096)
+def _parseRule(rule: str) -> tuple[tuple, tuple[tuple[str, str], ...], float]:
+    # Rules are recompiled with every simulate() call, parsing each text once keeps that cheap
+    return _RuleParser(rule).parse()
+
+
 class Rule:
+    # A condition tree and the output sets it fires. The tree is made of tuples:
+    # (IS, variable, set), (NOT, node), (AND, left, right) and (OR, left, right).
+    __slots__ = ("antecedent", "consequents", "weight")
+    consequents: list[tuple[str, str]]
+
     def __init__(self, rule: str) -> None:
-        # IN_variable set operator IN_variable set => OUT_variable set
-        words = rule.split()
+        # condition => OUT_variable set[, OUT_variable set...] [(weight)]
+        # where a condition is "IN_variable set" or conditions joined by and, or, not and parentheses,
+        # e.g. "a low and not (b high or c high) => x small, y large (0.5)"
+        self.antecedent, consequents, self.weight = _parseRule(rule)
+        self.consequents = list(consequents)
 
-        if len(words) != 8:
-            raise Exception("Invalid rule")
 
-        self.inVariables = (words[0], words[3])
-        self.inSets = (words[1], words[4])
-        self.operator = words[2]
-        self.outVariable = words[6]
-        self.outSet = words[7]
+def parseRules(text: str) -> list[str]:
+    # One rule per line, "#" starts a comment and blank lines are skipped
+    rules = [re.sub(r'#.*', '', x) for x in text.strip().split("\n")]
+    rules = [x.strip() for x in rules]
+    return [x for x in rules if x != ""]
@@ -0,0 +1,160 @@
+import numpy as np
+
+from .fuzzy_set import CONSTANT, LINEAR, TRAP, TRI, FuzzySet
+from .rule import AND, IS, NOT, OR, Rule
+from .system import System
+from .variable import IN, OUT, Variable
+
+# Codes of the variable and set types in the snapshot arrays
+VARIABLE_TYPES = [IN, OUT]
+SET_TYPES = [TRI, TRAP, CONSTANT, LINEAR]
+
+# Operator tokens of the rule code. Any other token is a set index, which is never negative.
+NOT_TOKEN = -1
+AND_TOKEN = -2
+OR_TOKEN = -3
+OPERATOR_TOKENS = {NOT: NOT_TOKEN, AND: AND_TOKEN, OR: OR_TOKEN}
+
+
+def _readOnly(values: list, dtype: type) -> np.ndarray:
+    array = np.array(values, dtype=dtype)
+    array.flags.writeable = False
+    return array
+
+
+class SystemSnapshot:
+    # An immutable copy of a system as a few flat arrays, much smaller than the model objects
+    # and cheap to pickle. Sets are numbered across all variables, the sets of variable v are
+    # setOffsets[v]:setOffsets[v + 1] and the values of set s are values[valueOffsets[s]:valueOffsets[s + 1]].
+    # Each rule is its condition in postfix order followed by nothing else: set indices, with
+    # NOT_TOKEN, AND_TOKEN and OR_TOKEN applied to the conditions before them.
+    __slots__ = ("title", "description", "inference", "inputs", "outputs",
+                 "variableNames", "variableTypes", "limits", "lookupResolutions", "lookupInterpolates",
+                 "setOffsets", "setNames", "setTypes", "valueOffsets", "values",
+                 "ruleCode", "ruleOffsets", "consequents", "consequentOffsets", "weights")
+
+    def __init__(self, system: System) -> None:
+        variables = system.variables
+        state = {
+            "title": system.title,
+            "description": system.description,
+            "inference": system.inference,
+            "inputs": tuple(system.inputs),
+            "outputs": tuple(system.outputs),
+            "variableNames": tuple(x.name for x in variables),
+            "variableTypes": _readOnly([VARIABLE_TYPES.index(x.type) for x in variables], np.int8),
+            "limits": _readOnly([x.limits for x in variables], np.float64).reshape(-1, 2),
+            # NaN where a variable has no lookup table
+            "lookupResolutions": _readOnly([np.nan if x.lookupResolution is None else x.lookupResolution
+                                            for x in variables], np.float64),
+            "lookupInterpolates": _readOnly([x.lookupInterpolate for x in variables], np.bool_),
+            "setOffsets": _readOnly(np.cumsum([0] + [len(x.fuzzySets) for x in variables]), np.int32),
+            "setNames": tuple(set.name for x in variables for set in x.fuzzySets),
+            "setTypes": _readOnly([SET_TYPES.index(set.type) for x in variables for set in x.fuzzySets], np.int8),
+            "valueOffsets": _readOnly(np.cumsum([0] + [len(set.values) for x in variables for set in x.fuzzySets]),
+                                      np.int32),
+            "values": _readOnly([value for x in variables for set in x.fuzzySets for value in set.values], np.float64),
+        }
+
+        # Names resolve to the first match, like the engine does
+        setIndices = {}
+        for v, variable in enumerate(variables):
+            for s, set in enumerate(variable.fuzzySets):
+                setIndices.setdefault((variable.type, variable.name, set.name), int(state["setOffsets"][v]) + s)
+
+        ruleCode = []
+        ruleOffsets = [0]
+        consequents = []
+        consequentOffsets = [0]
+        weights = []
+        for text in system.getRules():
+            rule = Rule(text)
+            self._encode(rule.antecedent, setIndices, ruleCode)
+            ruleOffsets.append(len(ruleCode))
+            for variableName, setName in rule.consequents:
+                if (OUT, variableName, setName) not in setIndices:
+                    raise Exception(f"Unknown output variable '{variableName}' or fuzzy set '{setName}'")
+                consequents.append(setIndices[(OUT, variableName, setName)])
+            consequentOffsets.append(len(consequents))
+            weights.append(rule.weight)
+
+        state["ruleCode"] = _readOnly(ruleCode, np.int32)
+        state["ruleOffsets"] = _readOnly(ruleOffsets, np.int32)
+        state["consequents"] = _readOnly(consequents, np.int32)
+        state["consequentOffsets"] = _readOnly(consequentOffsets, np.int32)
+        state["weights"] = _readOnly(weights, np.float64)
+        self.__setstate__(state)
+
+    def _encode(self, node: tuple, setIndices: dict, code: list[int]):
+        if node[0] == IS:
+            if (IN, node[1], node[2]) not in setIndices:
+                raise Exception(f"Unknown input variable '{node[1]}' or fuzzy set '{node[2]}'")
+            code.append(setIndices[(IN, node[1], node[2])])
+            return
+
+        for child in node[1:]:
+            self._encode(child, setIndices, code)
+        code.append(OPERATOR_TOKENS[node[0]])
+
+    def __setattr__(self, name, value):
+        raise Exception("A system snapshot can't be changed")
+
+    def __getstate__(self) -> dict:
+        return {name: getattr(self, name) for name in self.__slots__}
+
+    def __setstate__(self, state: dict):
+        for name, value in state.items():
+            if isinstance(value, np.ndarray):
+                # Unpickled arrays come back writeable
+                value.flags.writeable = False
+            object.__setattr__(self, name, value)
+
+    @property
+    def nbytes(self) -> int:
+        # Size of the arrays, the names and texts aside
+        return sum(getattr(self, name).nbytes for name in self.__slots__ if isinstance(getattr(self, name), np.ndarray))
+
+    def getVariables(self) -> list[Variable]:
+        # Fresh model objects, changing them leaves the snapshot as it is
+        variables = []
+        for v, name in enumerate(self.variableNames):
+            variable = Variable(VARIABLE_TYPES[self.variableTypes[v]], tuple(self.limits[v].tolist()), name)
+            if not np.isnan(self.lookupResolutions[v]):
+                variable.setLookupTable(float(self.lookupResolutions[v]), bool(self.lookupInterpolates[v]))
+            for s in range(self.setOffsets[v], self.setOffsets[v + 1]):
+                values = self.values[self.valueOffsets[s]:self.valueOffsets[s + 1]].tolist()
+                variable.addFuzzySet(FuzzySet(SET_TYPES[self.setTypes[s]], values, self.setNames[s]))
+            variables.append(variable)
+        return variables
+
+    def _describeSet(self, index: int) -> str:
+        variable = int(np.searchsorted(self.setOffsets, index, side="right")) - 1
+        return f"{self.variableNames[variable]} {self.setNames[index]}"
+
+    def getRules(self) -> list[str]:
+        # The rules as text again. Comments are gone, and every nested and/or is in parentheses.
+        rules = []
+        for r in range(len(self.weights)):
+            stack = []
+            for token in self.ruleCode[self.ruleOffsets[r]:self.ruleOffsets[r + 1]].tolist():
+                if token >= 0:
+                    stack.append((self._describeSet(token), True))
+                elif token == NOT_TOKEN:
+                    text, simple = stack.pop()
+                    stack.append((f"not {text}" if simple else f"not ({text})", True))
+                else:
+                    right, rightSimple = stack.pop()
+                    left, leftSimple = stack.pop()
+                    operator = AND if token == AND_TOKEN else OR
+                    stack.append((f"{left if leftSimple else f'({left})'} {operator} "
+                                  f"{right if rightSimple else f'({right})'}", False))
+
+            consequents = self.consequents[self.consequentOffsets[r]:self.consequentOffsets[r + 1]].tolist()
+            text = f"{stack[0][0]} => {', '.join(self._describeSet(x) for x in consequents)}"
+            weight = float(self.weights[r])
+            rules.append(text if weight == 1 else f"{text} ({weight!r})")
+        return rules
+
+    def toSystem(self) -> System:
+        return System(self.title, self.description, self.getVariables(), "\n".join(self.getRules()) + "\n",
+                      list(self.inputs), list(self.outputs), self.inference)
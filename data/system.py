@@ -0,0 +1,87 @@
+import json
+from typing import Literal
+
+from .fuzzy_set import FuzzySet
+from .rule import parseRules
+from .variable import Variable
+
+MAMDANI = "MAMDANI"
+SUGENO = "SUGENO"
+
+
+class System:
+    # Everything a project file holds. The rules are kept as the raw editor text, comments included.
+    variables: list[Variable]
+
+    def __init__(self, title="", description="", variables: list[Variable] = None, rules="",
+                 inputs: list[str] = None, outputs: list[str] = None,
+                 inference: Literal["MAMDANI", "SUGENO"] = MAMDANI) -> None:
+        self.title = title
+        self.description = description
+        self.variables = variables if variables is not None else []
+        self.rules = rules
+        self.inputs = inputs if inputs is not None else []
+        self.outputs = outputs if outputs is not None else []
+        self.inference = inference
+
+    def getRules(self) -> list[str]:
+        return parseRules(self.rules)
+
+
+def loadSystem(filename: str) -> System:
+    with open(filename, "r") as file:
+        data = json.load(file)
+
+    variables = []
+    for variableData in data["variables"]:
+        variable = Variable(name=variableData["name"], limits=tuple(variableData["limits"]), type=variableData["type"])
+        for fuzzySetData in variableData["fuzzySets"]:
+            variable.addFuzzySet(
+                FuzzySet(
+                    type=fuzzySetData["type"],
+                    values=fuzzySetData["values"],
+                    name=fuzzySetData["name"],
+                )
+            )
+        variables.append(variable)
+
+    return System(
+        title=data.get("title", ""),
+        description=data.get("description", ""),
+        variables=variables,
+        rules=data.get("rules", ""),
+        inputs=data.get("inputs", []),
+        outputs=data.get("outputs", []),
+        # Files saved before Sugeno support are all Mamdani systems
+        inference=data.get("inference", MAMDANI),
+    )
+
+
+def saveSystem(system: System, filename: str):
+    data = {
+        "title": system.title,
+        "description": system.description,
+        "variables": [
+            {
+                "name": variable.name,
+                "limits": variable.limits,
+                "type": variable.type,
+                "fuzzySets": [
+                    {
+                        "name": fuzzySet.name,
+                        "type": fuzzySet.type,
+                        "values": fuzzySet.values,
+                    }
+                    for fuzzySet in variable.fuzzySets
+                ],
+            }
+            for variable in system.variables
+        ],
+        "rules": system.rules,
+        "inputs": system.inputs,
+        "outputs": system.outputs,
+        "inference": system.inference,
+    }
+
+    with open(filename, "w") as file:
+        json.dump(data, file)
@@ -1,4 +1,5 @@
 from .fuzzy_set import FuzzySet
+from .revision import touch
 from typing import Literal
 
 IN = "IN"
@@ -6,13 +7,31 @@ OUT = "OUT"
 
 
 class Variable:
+    __slots__ = ("name", "fuzzySets", "type", "limits", "lookupResolution", "lookupInterpolate")
     fuzzySets: list[FuzzySet]
 
     def __init__(self, type: Literal["IN", "OUT"], limits: tuple[int, int], name="") -> None:
-        self.name = name
-        self.fuzzySets = []
-        self.type = type
-        self.limits = limits
+        # A new variable changes nothing built so far, only edits bump the revision
+        object.__setattr__(self, "name", name)
+        object.__setattr__(self, "fuzzySets", [])
+        object.__setattr__(self, "type", type)
+        object.__setattr__(self, "limits", limits)
+        object.__setattr__(self, "lookupResolution", None)
+        object.__setattr__(self, "lookupInterpolate", False)
+
+    def __setattr__(self, name, value):
+        super().__setattr__(name, value)
+        touch()
     
     def addFuzzySet(self, fuzzySet: FuzzySet):
-        self.fuzzySets.append(fuzzySet)
\ No newline at end of file
+        self.fuzzySets.append(fuzzySet)
+        touch()
+
+    def removeFuzzySet(self, index: int):
+        self.fuzzySets.pop(index)
+        touch()
+
+    def setLookupTable(self, resolution: float | None = 1, interpolate: bool = False):
+        # Fuzzify this input from a precomputed table instead of evaluating each set, None turns it off
+        self.lookupResolution = resolution
+        self.lookupInterpolate = interpolate
\ No newline at end of file
@@ -0,0 +1,240 @@
+import argparse
+import asyncio
+import csv
+import json
+import math
+import signal
+import sys
+import time
+from contextlib import nullcontext
+from typing import Iterator
+
+import numpy as np
+
+from data.system import loadSystem
+from engine.codegen import generateSource
+from engine.defuzzification import METHODS, WEIGHTED_AVERAGE
+from engine.engine import CompiledSystem
+from engine.instrumentation import COMPILE, Instrumentation
+from engine.operators import IMPLICATIONS, MAXIMUM, MINIMUM, S_NORMS, T_NORMS
+from engine.server import ScoringServer
+from engine.streaming import streamBatches
+
+CSV = "csv"
+NDJSON = "ndjson"
+
+
+def readCsv(file, names: list[str]) -> Iterator[list[str]]:
+    # The input columns of every row as text, streaming converts them
+    reader = csv.reader(file)
+    columns = None
+
+    for row in reader:
+        if not row or all(x.strip() == "" for x in row):
+            continue
+
+        if columns is None:
+            # A header naming every input picks the columns by name, otherwise columns are positional
+            header = [x.strip() for x in row]
+            if all(name in header for name in names):
+                columns = [header.index(name) for name in names]
+                continue
+            columns = list(range(len(names)))
+
+        yield [row[i] for i in columns]
+
+
+def readNdjson(file) -> Iterator[list | dict]:
+    # Each line is either a list of inputs in order or an object keyed by input name, streaming
+    # picks the inputs out of either
+    for line in file:
+        if line.strip() == "":
+            continue
+        yield json.loads(line)
+
+
+def writeResults(file, format: str, system: CompiledSystem, crisp: np.ndarray, dominant: np.ndarray):
+    names = [x.name for x in system.outVariables]
+
+    if format == CSV:
+        writer = csv.writer(file, lineterminator="\n")
+        for values, sets in zip(crisp.tolist(), dominant.tolist()):
+            row = []
+            for j, (value, set) in enumerate(zip(values, sets)):
+                row += [value, system.outSetNames[j][set] if not math.isnan(value) else ""]
+            writer.writerow(row)
+    else:
+        for values, sets in zip(crisp.tolist(), dominant.tolist()):
+            row = {}
+            for j, (name, value, set) in enumerate(zip(names, values, sets)):
+                # JSON has no NaN, rows where no rule fired get nulls
+                isNan = math.isnan(value)
+                row[name] = None if isNan else value
+                row[f"{name}_set"] = None if isNan else system.outSetNames[j][set]
+            file.write(json.dumps(row) + "\n")
+
+
+def compileSystem(args: argparse.Namespace, instrumentation: Instrumentation | None = None) -> CompiledSystem:
+    project = loadSystem(args.system)
+    with instrumentation.measure(COMPILE) if instrumentation else nullcontext():
+        return CompiledSystem(project.variables, project.getRules(), defuzzification=args.defuzzification,
+                              inference=project.inference, andMethod=args.and_method, orMethod=args.or_method,
+                              implication=args.implication, ruleAggregation=args.rule_aggregation,
+                              instrumentation=instrumentation)
+
+
+def score(args: argparse.Namespace) -> int:
+    instrumentation = Instrumentation() if args.metrics else None
+    system = compileSystem(args, instrumentation)
+    names = [x.name for x in system.inVariables]
+
+    format = args.format
+    if format is None:
+        format = NDJSON if args.input.endswith((".ndjson", ".jsonl")) else CSV
+
+    input = sys.stdin if args.input == "-" else open(args.input, "r", newline="")
+    output = sys.stdout if args.output in (None, "-") else open(args.output, "w", newline="")
+
+    start = time.perf_counter()
+    count = 0
+    try:
+        if format == CSV:
+            rows = readCsv(input, names)
+            header = []
+            for variable in system.outVariables:
+                header += [variable.name, f"{variable.name}_set"]
+            csv.writer(output, lineterminator="\n").writerow(header)
+        else:
+            rows = readNdjson(input)
+
+        for crisp, dominant in streamBatches(system, rows, args.batch_size):
+            writeResults(output, format, system, crisp, dominant)
+            count += len(crisp)
+    finally:
+        if input is not sys.stdin:
+            input.close()
+        if output is not sys.stdout:
+            output.close()
+        else:
+            output.flush()
+
+    elapsed = time.perf_counter() - start
+    if not args.quiet:
+        rate = count / elapsed if elapsed > 0 else 0
+        stats = system.getRuleStats()
+        print(f"Scored {count} rows in {elapsed:.3f} s ({rate:.0f} rows/s, {stats['skipRate']:.0%} of rule evaluations "
+              "skipped)", file=sys.stderr)
+
+    if instrumentation is not None:
+        with open(args.metrics, "w") as file:
+            file.write(instrumentation.toPrometheus())
+
+    return 0
+
+
+def serve(args: argparse.Namespace) -> int:
+    server = ScoringServer(compileSystem(args), batchWindow=args.batch_window / 1e3, maxBatchRows=args.max_batch_rows)
+
+    async def run():
+        port = await server.start(args.host, args.port)
+        print(f"Serving {args.system} on http://{args.host}:{port}", file=sys.stderr)
+
+        stop = asyncio.Event()
+        loop = asyncio.get_running_loop()
+        for signalNumber in (signal.SIGINT, signal.SIGTERM):
+            try:
+                loop.add_signal_handler(signalNumber, stop.set)
+            except NotImplementedError:
+                # Windows, where Ctrl+C still ends asyncio.run() with KeyboardInterrupt
+                pass
+        try:
+            await stop.wait()
+        finally:
+            await server.close()
+
+    try:
+        asyncio.run(run())
+    except KeyboardInterrupt:
+        pass
+
+    stats = server.getStats()
+    latency = stats["latencyMs"]
+    print(f"Served {stats['requests']} requests ({stats['rows']} rows, {stats['errors']} errors), "
+          f"p50 {latency['p50']:.2f} ms, p99 {latency['p99']:.2f} ms, "
+          f"{stats['meanMicroBatchRows']:.1f} rows per micro-batch", file=sys.stderr)
+    return 0
+
+
+def codegen(args: argparse.Namespace) -> int:
+    project = loadSystem(args.system)
+    source = generateSource(project.variables, project.getRules(), project.inference)
+    if args.output in (None, "-"):
+        sys.stdout.write(source)
+    else:
+        with open(args.output, "w") as file:
+            file.write(source)
+    return 0
+
+
+def addCompileArguments(parser: argparse.ArgumentParser):
+    parser.add_argument("-d", "--defuzzification", choices=METHODS, default=WEIGHTED_AVERAGE,
+                        help="how crisp outputs are computed")
+    parser.add_argument("--and", dest="and_method", choices=list(T_NORMS), default=MINIMUM,
+                        help="t-norm used for and")
+    parser.add_argument("--or", dest="or_method", choices=list(S_NORMS), default=MAXIMUM,
+                        help="s-norm used for or")
+    parser.add_argument("--implication", choices=IMPLICATIONS, default=MINIMUM,
+                        help="clip (MINIMUM) or scale (PRODUCT) the output sets, only used by the exact methods")
+    parser.add_argument("--rule-aggregation", choices=list(S_NORMS), default=MAXIMUM,
+                        help="s-norm combining the rules that fire the same output set, only MAXIMUM with the exact methods")
+
+
+def main(argv: list[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(prog="python -m engine", description="Fuzzy logic engine")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    scoreParser = commands.add_parser("score", help="score CSV or NDJSON input rows against a project file")
+    scoreParser.add_argument("system", help="project file saved from the GUI")
+    scoreParser.add_argument("input", help="CSV or NDJSON file of input rows, - for stdin")
+    scoreParser.add_argument("-o", "--output", help="where to write the results, stdout by default")
+    scoreParser.add_argument("-f", "--format", choices=[CSV, NDJSON],
+                             help="input and output format, guessed from the input file extension by default")
+    scoreParser.add_argument("-b", "--batch-size", type=int, default=10000, help="rows evaluated at once")
+    addCompileArguments(scoreParser)
+    scoreParser.add_argument("--metrics", help="write per-stage timings and rules fired in Prometheus text format to this file")
+    scoreParser.add_argument("-q", "--quiet", action="store_true", help="don't print throughput stats")
+    scoreParser.set_defaults(run=score)
+
+    serveParser = commands.add_parser("serve", help="score JSON requests over HTTP against a project file")
+    serveParser.add_argument("system", help="project file saved from the GUI")
+    serveParser.add_argument("--host", default="127.0.0.1", help="address to listen on")
+    serveParser.add_argument("-p", "--port", type=int, default=8080, help="port to listen on, 0 picks a free one")
+    serveParser.add_argument("-w", "--batch-window", type=float, default=2.0,
+                             help="milliseconds single-row requests wait to be evaluated together")
+    serveParser.add_argument("--max-batch-rows", type=int, default=1024,
+                             help="rows that are evaluated together without waiting for the window")
+    addCompileArguments(serveParser)
+    serveParser.set_defaults(run=serve)
+
+    codegenParser = commands.add_parser("codegen", help="write a standalone Python module that evaluates a project file")
+    codegenParser.add_argument("system", help="project file saved from the GUI")
+    codegenParser.add_argument("-o", "--output", help="where to write the module, stdout by default")
+    codegenParser.set_defaults(run=codegen)
+
+    args = parser.parse_args(argv)
+    if getattr(args, "batch_size", 1) <= 0:
+        parser.error("batch size must be positive")
+    if getattr(args, "max_batch_rows", 1) <= 0:
+        parser.error("max batch rows must be positive")
+    if getattr(args, "batch_window", 0) < 0:
+        parser.error("batch window can't be negative")
+
+    try:
+        return args.run(args)
+    except Exception as e:
+        print(f"Error: {e}", file=sys.stderr)
+        return 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,121 @@
+import hashlib
+import json
+from collections import OrderedDict
+
+from data.revision import getRevision
+from data.system import MAMDANI
+from data.variable import Variable
+from engine.engine import CompiledSystem
+from engine.instrumentation import COMPILE, Instrumentation
+
+
+def hashSystem(variables: list[Variable], rules: list[str]) -> str:
+    definition = {
+        "variables": [
+            {
+                "name": variable.name,
+                "limits": list(variable.limits),
+                "type": variable.type,
+                "lookup": [variable.lookupResolution, variable.lookupInterpolate],
+                "fuzzySets": [
+                    {"name": fuzzySet.name, "type": fuzzySet.type, "values": list(fuzzySet.values)}
+                    for fuzzySet in variable.fuzzySets
+                ],
+            }
+            for variable in variables
+        ],
+        "rules": list(rules),
+    }
+    return hashlib.sha256(json.dumps(definition, sort_keys=True).encode()).hexdigest()
+
+
+class MemoizedSystem:
+    # Remembers the outputs of recent inputs, recompiling and forgetting them whenever the
+    # variables, their fuzzy sets or the rules change
+
+    def __init__(self, variables: list[Variable], rules: list[str], maxSize: int = 4096,
+                 decimals: int | None = None, inference: str = MAMDANI,
+                 instrumentation: Instrumentation | None = None) -> None:
+        if maxSize <= 0:
+            raise Exception("Cache size must be positive")
+
+        self.variables = variables
+        self.rules = rules
+        self.maxSize = maxSize
+        # When set, inputs are rounded to this many decimals and the rounded input is evaluated,
+        # so nearby inputs share one entry
+        self.decimals = decimals
+        self.inference = inference
+        # Counts hits and misses, and times the stages of the inputs that miss
+        self.instrumentation = instrumentation
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+        self.systemHash = None
+        self._results = OrderedDict()
+        self._compile()
+
+    def _isStale(self) -> bool:
+        return (self._revision != getRevision() or self._variables != tuple(self.variables)
+                or self._rules != tuple(self.rules))
+
+    def _compile(self):
+        self._revision = getRevision()
+        self._variables = tuple(self.variables)
+        self._rules = tuple(self.rules)
+
+        systemHash = hashSystem(self.variables, self.rules)
+        if systemHash != self.systemHash:
+            if self.systemHash is not None:
+                self.invalidations += 1
+            self._results.clear()
+            if self.instrumentation is None:
+                self.system = CompiledSystem(self.variables, self.rules, inference=self.inference)
+            else:
+                with self.instrumentation.measure(COMPILE):
+                    self.system = CompiledSystem(self.variables, self.rules, inference=self.inference,
+                                                 instrumentation=self.instrumentation)
+            self.systemHash = systemHash
+
+    def evaluate(self, input: list[float]) -> list[tuple[float, str]]:
+        if self._isStale():
+            self._compile()
+
+        if self.decimals is not None:
+            input = [round(x, self.decimals) for x in input]
+        key = (self.systemHash, tuple(input))
+
+        result = self._results.get(key)
+        if self.instrumentation is not None:
+            self.instrumentation.recordCache(result is not None)
+        if result is not None:
+            self.hits += 1
+            self._results.move_to_end(key)
+            return list(result)
+
+        self.misses += 1
+        result = self.system.evaluate(input)
+        self._results[key] = result
+        if len(self._results) > self.maxSize:
+            self._results.popitem(last=False)
+            self.evictions += 1
+
+        return list(result)
+
+    def clear(self):
+        self._results.clear()
+
+    def getStats(self) -> dict[str, int | float]:
+        lookups = self.hits + self.misses
+        return {
+            "size": len(self._results),
+            "maxSize": self.maxSize,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "invalidations": self.invalidations,
+            "hitRate": self.hits / lookups if lookups else 0.0,
+        }
@@ -0,0 +1,281 @@
+import hashlib
+import importlib.util
+import json
+import math
+import os
+from types import ModuleType
+
+from data.fuzzy_set import TRI, FuzzySet
+from data.system import MAMDANI, SUGENO
+from data.variable import Variable
+from engine.cache import hashSystem
+from engine.engine import AND, AND_NOT, FIRE, INFER_BLOCK_ROWS, NOT, OR, OR_NOT, WEIGHT, CompiledSystem
+from engine.lookup import MembershipTable
+
+# Part of every module's hash, so changing what gets generated never loads an older module
+CODEGEN_VERSION = 1
+CACHE_DIRECTORY = os.path.join(os.path.expanduser("~"), ".cache", "fuzzy_engine", "codegen")
+
+# Instructions as Python and as NumPy, the same operations in the same order as CompiledSystem
+SCALAR_OPERATIONS = {
+    AND: "min({a}, {b})",
+    OR: "max({a}, {b})",
+    AND_NOT: "min({a}, 1 - {b})",
+    OR_NOT: "max({a}, 1 - {b})",
+    NOT: "1 - {a}",
+    WEIGHT: "{a} * {b}",
+}
+BATCH_OPERATIONS = {
+    AND: "np.minimum({a}, {b})",
+    OR: "np.maximum({a}, {b})",
+    AND_NOT: "np.minimum({a}, 1 - {b})",
+    OR_NOT: "np.maximum({a}, 1 - {b})",
+    NOT: "1 - {a}",
+    WEIGHT: "{a} * {b}",
+}
+
+# Generated modules already imported by this process, by hash
+_modules: dict[str, ModuleType] = {}
+
+
+def _literal(value: float) -> str:
+    # repr gives back the exact float, and keeps ints as ints like the values they stand for
+    if isinstance(value, float) and not math.isfinite(value):
+        return f"float('{value}')"
+    return repr(value)
+
+
+def hashDefinition(variables: list[Variable], rules: list[str], inference: str = MAMDANI) -> str:
+    # hashSystem() covers the lookup tables too
+    definition = [hashSystem(variables, rules), inference, CODEGEN_VERSION]
+    return hashlib.sha256(json.dumps(definition).encode()).hexdigest()
+
+
+def _membership(set: FuzzySet, x: str, batch: bool) -> str:
+    # FuzzySet.getMembershipFunction() and getMembershipBatch() with the corners inlined. A triangle
+    # never reaches the flat top branch, which only holds x == b.
+    corners = set.getCorners()
+    a, b, c, d = (_literal(x) for x in corners)
+    left = f"({x} - {a}) / {_literal(corners[1] - corners[0])}"
+    right = f"1 - ({x} - {c}) / {_literal(corners[3] - corners[2])}"
+    if batch:
+        if all(math.isfinite(x) for x in corners) and corners[0] < corners[1] and corners[2] < corners[3]:
+            # Without degenerate shoulders the rising side is at most 1 up to b and the falling side at
+            # least 1 down to c, and both are at most 0 outside the support, so clamping the smaller
+            # one to [0, 1] gives the same values with half the operations
+            return f"np.minimum(np.maximum(np.minimum({left}, {right}), 0.0), 1.0)"
+        inner = right if set.type == TRI else f"np.where({x} <= {c}, 1.0, {right})"
+        return f"np.where(({x} <= {a}) | ({x} >= {d}), 0.0, np.where({x} <= {b}, {left}, {inner}))"
+    inner = right if set.type == TRI else f"1.0 if {x} <= {c} else {right}"
+    return f"0 if {x} <= {a} or {x} >= {d} else {left} if {x} <= {b} else {inner}"
+
+
+def _lookupFunctions(i: int, table: MembershipTable) -> list[str]:
+    # MembershipTable.lookup() and lookupBatch() over the tables of input i
+    last = table.size - 1
+    position = f"(x - {_literal(table.start)}) * {_literal(table._scale)}"
+    width = len(table._rows[0]) if table._rows else 0
+    lines = [f"_ROWS{i} = {tuple(tuple(row) for row in table._rows)!r}",
+             f"_TABLE{i} = np.array(_ROWS{i}, dtype=float).reshape(-1, {width})"]
+    if table.interpolate:
+        lines += [f"_LOW_ROWS{i} = {tuple(tuple(row) for row in table._lowRows)!r}",
+                  f"_HIGH_ROWS{i} = {tuple(tuple(row) for row in table._highRows)!r}",
+                  f"_LOW_TABLE{i} = np.array(_LOW_ROWS{i}, dtype=float).reshape(-1, {width})",
+                  f"_HIGH_TABLE{i} = np.array(_HIGH_ROWS{i}, dtype=float).reshape(-1, {width})"]
+
+    lines += ["", "", f"def _lookup{i}(x):", f"    position = {position}"]
+    if not table.interpolate:
+        lines.append(f"    return _ROWS{i}[min(max(int(position + 0.5), 0), {last})]")
+    else:
+        lines += ["    if position <= 0:", f"        return _ROWS{i}[0]",
+                  f"    if position >= {last}:", f"        return _ROWS{i}[{last}]",
+                  "    i = int(position)", "    t = position - i", "    if t == 0:", f"        return _ROWS{i}[i]",
+                  f"    return [low + (high - low) * t for low, high in zip(_LOW_ROWS{i}[i], _HIGH_ROWS{i}[i])]"]
+
+    lines += ["", "", f"def _lookupBatch{i}(x):", f"    position = np.clip({position}, 0, {last})"]
+    if not table.interpolate or table.size == 1:
+        lines.append(f"    return _TABLE{i}[np.floor(position + 0.5).astype(np.intp)]")
+    else:
+        lines += [f"    i = np.minimum(position.astype(np.intp), {last - 1})", "    t = position - i",
+                  f"    result = _LOW_TABLE{i}[i] + (_HIGH_TABLE{i}[i] - _LOW_TABLE{i}[i]) * t[:, None]",
+                  "    onGrid = t == 0", f"    result[onGrid] = _TABLE{i}[i[onGrid]]",
+                  f"    result[position == {last}] = _TABLE{i}[-1]", "    return result"]
+    return lines + ["", ""]
+
+
+def _fuzzifyLines(system: CompiledSystem, batch: bool) -> list[str]:
+    lines = []
+    for i, (sets, table, offset) in enumerate(zip(system._inSets, system.lookupTables, system._setSlots)):
+        lines.append(f"x{i} = inputs[:, {i}]" if batch else f"x{i} = input[{i}]")
+        if not sets:
+            continue
+        if table is not None:
+            names = ", ".join(f"s{offset + j}" for j in range(len(sets)))
+            lines.append(f"{names}, = _lookupBatch{i}(x{i}).T" if batch else f"{names}, = _lookup{i}(x{i})")
+            continue
+        for j, set in enumerate(sets):
+            lines.append(f"s{offset + j} = {_membership(set, f'x{i}', batch)}")
+    return lines
+
+
+def _programLines(program: tuple, operations: dict[int, str], aggregate: str) -> list[str]:
+    # Each value used once is written into the expression that uses it, so most rules become a
+    # single line. Values used more than once, like shared sub-expressions, get a name.
+    uses = {}
+    for opcode, a, b, target, targets in program:
+        if opcode != FIRE:
+            uses[a] = uses.get(a, 0) + 1
+            if opcode != NOT and opcode != WEIGHT:
+                uses[b] = uses.get(b, 0) + 1
+        uses[target] = uses.get(target, 0) + len(targets)
+
+    lines = []
+    inlined = {}
+
+    def operand(slot: int) -> str:
+        return inlined.pop(slot, f"s{slot}")
+
+    for opcode, a, b, target, targets in program:
+        if opcode == FIRE:
+            value = operand(target)
+        else:
+            value = operations[opcode].format(a=operand(a), b=_literal(b) if opcode == WEIGHT else
+                                              operand(b) if opcode != NOT else None)
+            if opcode == NOT or opcode == WEIGHT:
+                value = f"({value})"
+            if uses[target] == 1 and not targets:
+                inlined[target] = value
+                continue
+            if uses[target] > 1:
+                lines.append(f"s{target} = {value}")
+                value = f"s{target}"
+
+        for outIndex, outSet in targets:
+            output = f"o{outIndex}_{outSet}"
+            lines.append(f"{output} = {aggregate.format(o=output, v=value)}")
+    return lines
+
+
+def _inferLines(system: CompiledSystem, batch: bool) -> list[str]:
+    operations = BATCH_OPERATIONS if batch else SCALAR_OPERATIONS
+    if system.inference == SUGENO:
+        aggregate = "{o} + {v}"
+    else:
+        aggregate = "np.maximum({o}, {v})" if batch else "max({o}, {v})"
+
+    lines = [f"o{i}_{j} = {'zeros' if batch else '0'}"
+             for i, names in enumerate(system.outSetNames) for j in range(len(names))]
+    if not system.sparse:
+        return lines + _programLines(system.program, operations, aggregate)
+
+    # Like CompiledSystem's sparse evaluation, each rule only runs when all of its required memberships
+    # are active: non-zero for one input, or anywhere in the block for a batch. Rules run alone, so the
+    # instructions they share are repeated in each of them.
+    if batch:
+        required = sorted(set().union(*system._ruleRequired))
+        lines += [f"a{slot} = s{slot}.any()" for slot in required]
+    flag = "a" if batch else "s"
+    system._compileRuleIndex()
+    for required, closure in zip(system._ruleRequired, system._ruleClosures):
+        body = _programLines(closure, operations, aggregate)
+        if required:
+            lines.append(f"if {' and '.join(f'{flag}{slot}' for slot in sorted(required))}:")
+            body = [f"    {x}" for x in body]
+        lines += body
+    return lines
+
+
+def _defuzzifyLines(system: CompiledSystem, batch: bool) -> list[str]:
+    # The weighted averages of CompiledSystem.defuzzify() and defuzzifyBatch(), accumulated set by set
+    lines = []
+    start = "zeros" if batch else "0"
+    for i, names in enumerate(system.outSetNames):
+        outputs = [f"o{i}_{j}" for j in range(len(names))]
+        if system.inference == SUGENO:
+            terms = []
+            for (coefficients, constant), output in zip(system._consequents[i], outputs):
+                z = "".join(f" + {_literal(coefficient)} * x{k}" for k, coefficient in enumerate(coefficients))
+                terms.append(f"({start}{z} + {_literal(constant)}) * {output}")
+        else:
+            terms = [f"{_literal(centroid)} * {output}" for centroid, output in zip(system._centroids[i], outputs)]
+        weighted = start + "".join(f" + {x}" for x in terms)
+
+        if batch:
+            lines += [f"outputs = np.stack([{', '.join(outputs)}], axis=1)",
+                      f"dominant[:, {i}] = outputs.argmax(axis=1)",
+                      f"total = zeros{''.join(f' + {x}' for x in outputs)}",
+                      "with np.errstate(divide=\"ignore\", invalid=\"ignore\"):",
+                      f"    crisp[:, {i}] = ({weighted}) / total"]
+        else:
+            lines += [f"outputs = [{', '.join(outputs)}]",
+                      f"crisp{i} = {weighted}",
+                      f"crisp{i} /= sum(outputs)",
+                      f"result.append((crisp{i}, OUTPUT_SET_NAMES[{i}][outputs.index(max(outputs))]))"]
+    return lines
+
+
+def generateSource(variables: list[Variable], rules: list[str], inference: str = MAMDANI) -> str:
+    # A module evaluating the system with the same results as simulate() and simulateBatch(), as
+    # straight-line code with every breakpoint, centroid and weight written in as a constant
+    system = CompiledSystem(variables, rules, inference=inference)
+    inputs = len(system.inVariables)
+
+    lines = ["# Generated by engine.codegen, don't edit", "import numpy as np", "",
+             f"HASH = {hashDefinition(variables, rules, inference)!r}",
+             f"INFERENCE = {inference!r}",
+             f"INPUTS = {[x.name for x in system.inVariables]!r}",
+             f"OUTPUTS = {[x.name for x in system.outVariables]!r}",
+             f"OUTPUT_SET_NAMES = {system.outSetNames!r}",
+             "", ""]
+    for i, table in enumerate(system.lookupTables):
+        if table is not None:
+            lines += _lookupFunctions(i, table)
+
+    body = _fuzzifyLines(system, False) + _inferLines(system, False) + ["result = []"] + \
+        _defuzzifyLines(system, False) + ["return result"]
+    lines += ["def evaluate(input):"] + [f"    {x}" for x in body] + ["", ""]
+
+    # Blocks of the same rows as CompiledSystem.inferBatch(), which decide what sparse evaluation skips
+    body = ["zeros = np.zeros(len(inputs))", "with np.errstate(divide=\"ignore\", invalid=\"ignore\"):"]
+    body += [f"    {x}" for x in _fuzzifyLines(system, True)]
+    body += _inferLines(system, True) + _defuzzifyLines(system, True)
+    lines += ["def _evaluateBlock(inputs, crisp, dominant):"] + [f"    {x}" for x in body] + ["", ""]
+
+    outputs = len(system.outVariables)
+    lines += ["def evaluateBatch(inputs):",
+              "    inputs = np.asarray(inputs, dtype=float)",
+              f"    if inputs.ndim != 2 or inputs.shape[1] < {inputs}:",
+              f"        raise Exception(\"Expected an (N, {inputs}) array of inputs\")",
+              f"    crisp = np.empty((len(inputs), {outputs}))",
+              f"    dominant = np.empty((len(inputs), {outputs}), dtype=np.intp)",
+              f"    for start in range(0, len(inputs), {INFER_BLOCK_ROWS}):",
+              f"        end = start + {INFER_BLOCK_ROWS}",
+              "        _evaluateBlock(inputs[start:end], crisp[start:end], dominant[start:end])",
+              "    return crisp, dominant"]
+    return "\n".join(lines) + "\n"
+
+
+def loadModule(variables: list[Variable], rules: list[str], inference: str = MAMDANI,
+               directory: str = CACHE_DIRECTORY) -> ModuleType:
+    # The generated module of a system, written to directory under its hash the first time. Later
+    # loads import the file, whose bytecode Python caches next to it, and this process keeps the module.
+    key = hashDefinition(variables, rules, inference)
+    if key in _modules:
+        return _modules[key]
+
+    name = f"fuzzy_system_{key[:32]}"
+    path = os.path.join(directory, f"{name}.py")
+    if not os.path.exists(path):
+        source = generateSource(variables, rules, inference)
+        os.makedirs(directory, exist_ok=True)
+        # Written aside and renamed, so a concurrent load never imports half a module
+        temporary = f"{path}.{os.getpid()}.tmp"
+        with open(temporary, "w") as file:
+            file.write(source)
+        os.replace(temporary, path)
+
+    spec = importlib.util.spec_from_file_location(name, path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    _modules[key] = module
+    return module
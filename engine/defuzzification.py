@@ -0,0 +1,437 @@
+import numpy as np
+
+from data.fuzzy_set import FuzzySet
+from engine.operators import IMPLICATIONS, MINIMUM, PRODUCT
+
+WEIGHTED_AVERAGE = "WEIGHTED_AVERAGE"
+CENTROID = "CENTROID"
+BISECTOR = "BISECTOR"
+MEAN_OF_MAXIMUM = "MEAN_OF_MAXIMUM"
+SMALLEST_OF_MAXIMUM = "SMALLEST_OF_MAXIMUM"
+LARGEST_OF_MAXIMUM = "LARGEST_OF_MAXIMUM"
+
+METHODS = [WEIGHTED_AVERAGE, CENTROID, BISECTOR, MEAN_OF_MAXIMUM, SMALLEST_OF_MAXIMUM, LARGEST_OF_MAXIMUM]
+
+# 3-point Gauss-Legendre nodes and weights on [-1, 1], exact for polynomials up to degree 5
+_GAUSS_NODES = np.array([-np.sqrt(0.6), 0, np.sqrt(0.6)])
+_GAUSS_WEIGHTS = np.array([5 / 9, 8 / 9, 5 / 9])
+
+
+def _lineIntersection(p1, p2, q1, q2) -> tuple[float, float] | None:
+    # Where segments p1-p2 and q1-q2 cross, if they cross at a single point
+    (x1, y1), (x2, y2), (x3, y3), (x4, y4) = p1, p2, q1, q2
+    denominator = (x1 - x2) * (y3 - y4) - (y1 - y2) * (x3 - x4)
+    if denominator == 0:
+        return None
+
+    t = ((x1 - x3) * (y3 - y4) - (y1 - y3) * (x3 - x4)) / denominator
+    u = ((x1 - x3) * (y1 - y2) - (y1 - y3) * (x1 - x2)) / denominator
+    if 0 <= t <= 1 and 0 <= u <= 1:
+        return x1 + t * (x2 - x1), y1 + t * (y2 - y1)
+    return None
+
+
+def _clippedMoments(a, b, c, d, peak, level) -> tuple[np.ndarray, np.ndarray]:
+    # Area and first moment of the trapezoid with corners a, b, c, d and height `peak` (1 if None),
+    # cut at `level`
+    if peak is None:
+        top = fraction = level
+    else:
+        top = np.minimum(level, peak)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            fraction = np.where(peak > 0, top / peak, 0)
+
+    rising = fraction * (b - a)
+    falling = fraction * (d - c)
+    left = a + rising
+    right = d - falling
+
+    area = top * ((d - a) + (right - left)) / 2
+    moment = top * (rising * (a + 2 * left) + 3 * (right - left) * (right + left) + falling * (2 * right + d)) / 6
+    return area, moment
+
+
+def _inverseClippedCdf(a, left, right, d, top, area) -> np.ndarray:
+    # The x where the area of the cut trapezoid a, left, right, d (height `top`) lying left of x
+    # reaches `area`
+    risingArea = top * (left - a) / 2
+    flatArea = risingArea + top * (right - left)
+    totalArea = flatArea + top * (d - right) / 2
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        rising = a + np.sqrt(np.maximum(2 * area * (left - a) / top, 0))
+        flat = left + (area - risingArea) / top
+        falling = d - np.sqrt(np.maximum(2 * (totalArea - area) * (d - right) / top, 0))
+
+    return np.where(area <= risingArea, rising, np.where(area <= flatArea, flat, falling))
+
+
+def _sumRows(x: np.ndarray) -> np.ndarray:
+    # The sum over the first axis, row after row, so one row of strengths sums in the same order as many
+    total = x[0].copy()
+    for row in x[1:]:
+        total += row
+    return total
+
+
+class OutputShape:
+    # The sets of one output variable, each clipped at its firing strength (or scaled by it, with
+    # PRODUCT implication) and aggregated with max.
+    #
+    # Usual layouts, where each set only overlaps its neighbours with the falling side of one
+    # against the rising side of the next, have closed forms: max(f, g) = f + g - min(f, g), and
+    # the min of two neighbours is a triangle. Any other layout splits the aggregate at every
+    # corner it can have and integrates it piece by piece.
+
+    def __init__(self, sets: list[FuzzySet], chunkSize: int = 8192, implication: str = MINIMUM) -> None:
+        if implication not in IMPLICATIONS:
+            raise Exception(f"Unknown implication '{implication}'")
+        self.sets = sets
+        self.chunkSize = chunkSize
+        self.implication = implication
+
+        corners = np.array([set.getCorners() for set in sets], dtype=float).reshape(-1, 4)
+        self._a, self._b, self._c, self._d = corners.T
+
+        # Corners of the aggregate that don't depend on the firing strengths: the set corners and
+        # the points where the sloped sides of two different sets cross
+        edges = []
+        for a, b, c, d in corners:
+            edges += [((a, 0), (b, 1)), ((c, 1), (d, 0))]
+
+        points = corners.ravel().tolist()
+        for i in range(len(edges)):
+            for j in range(i + 1, len(edges)):
+                crossing = _lineIntersection(*edges[i], *edges[j])
+                if crossing is not None:
+                    points.append(crossing[0])
+        self._static = np.unique(points)
+
+        self._pairs = self._findNeighbours(corners)
+
+    def _findNeighbours(self, corners: np.ndarray) -> tuple[np.ndarray, ...] | None:
+        # The overlapping neighbours and the triangle under both of them, or None if the layout
+        # has no closed form
+        order = sorted(range(len(corners)), key=lambda i: (corners[i][0], corners[i][3]))
+        pairs = []
+
+        for k, i in enumerate(order):
+            ai, bi, ci, di = corners[i]
+            for m, j in enumerate(order[k + 1:]):
+                aj, bj, cj, dj = corners[j]
+                if aj >= di:
+                    continue
+                if m > 0 or ci > aj or di > bj:
+                    return None
+
+                x, y = _lineIntersection((ci, 1), (di, 0), (aj, 0), (bj, 1))
+                pairs.append((i, j, aj, x, di, y))
+
+        self._order = np.array(order, dtype=np.intp)
+        if not pairs:
+            return np.zeros(0, dtype=np.intp), np.zeros(0, dtype=np.intp), *np.zeros((4, 0, 1))
+
+        # The constants are columns, the closed forms work on (sets, rows) strengths
+        i, j, a, x, d, peak = zip(*pairs)
+        return np.array(i), np.array(j), *(np.array(x)[:, None] for x in (a, x, d, peak))
+
+    def _membership(self, strengths: np.ndarray, x: np.ndarray) -> np.ndarray:
+        result = np.zeros(x.shape)
+        for j, set in enumerate(self.sets):
+            if self.implication == PRODUCT:
+                result = np.maximum(result, strengths[:, j, None] * set.getMembershipBatch(x))
+            else:
+                result = np.maximum(result, np.minimum(strengths[:, j, None], set.getMembershipBatch(x)))
+        return result
+
+    def _scaledCrossings(self, strengths: np.ndarray) -> np.ndarray:
+        # Scaled sets keep their corners but their sides and tops cross at points that move with
+        # the strengths. Every side and top is a line y = slope * x + offset, and each pair of
+        # lines crosses once unless parallel.
+        with np.errstate(divide="ignore", invalid="ignore"):
+            risingSlope = np.where(self._b > self._a, strengths / (self._b - self._a), np.nan)
+            fallingSlope = np.where(self._d > self._c, -strengths / (self._d - self._c), np.nan)
+            slopes = np.concatenate([risingSlope, fallingSlope, np.zeros(strengths.shape)], axis=1)
+            offsets = np.concatenate([-risingSlope * self._a, -fallingSlope * self._d, strengths], axis=1)
+
+            i, j = np.triu_indices(slopes.shape[1], 1)
+            crossings = (offsets[:, j] - offsets[:, i]) / (slopes[:, i] - slopes[:, j])
+
+        # Lines that never cross, and crossings outside the shape, are moved onto an existing corner
+        return np.where(np.isfinite(crossings), np.clip(crossings, self._static[0], self._static[-1]), self._static[0])
+
+    def _partition(self, strengths: np.ndarray) -> tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+        # Sorted corners for every row: the static ones plus those that depend on the strengths,
+        # where each sloped side reaches each clipping level or where scaled sets cross. Returns
+        # the interval starts and widths, the Gauss nodes inside every interval and the membership
+        # at those nodes.
+        n = len(strengths)
+        if self.implication == PRODUCT:
+            moving = [self._scaledCrossings(strengths)]
+        else:
+            levels = strengths[:, None, :]
+            rising = self._a[None, :, None] + levels * (self._b - self._a)[None, :, None]
+            falling = self._d[None, :, None] - levels * (self._d - self._c)[None, :, None]
+            moving = [rising.reshape(n, -1), falling.reshape(n, -1)]
+
+        points = np.concatenate([np.broadcast_to(self._static, (n, len(self._static))), *moving], axis=1)
+        points.sort(axis=1)
+
+        start = points[:, :-1]
+        width = np.diff(points, axis=1)
+        nodes = (start + width / 2)[:, :, None] + (width / 2)[:, :, None] * _GAUSS_NODES
+        membership = self._membership(strengths, nodes.reshape(n, -1)).reshape(nodes.shape)
+        return start, width, nodes, membership
+
+    def _chunked(self, function, strengths: np.ndarray) -> np.ndarray:
+        # The closed forms take a chunk of strengths as (sets, rows), where every set is one row of
+        # memory and sums over the sets add whole rows. Batch strengths come transposed from
+        # CompiledSystem.inferBatch(), so this is a view.
+        strengths = np.asarray(strengths, dtype=float)
+        result = np.empty(len(strengths))
+        for start in range(0, len(strengths), self.chunkSize):
+            result[start:start + self.chunkSize] = function(strengths[start:start + self.chunkSize].T)
+        return result
+
+    def centroid(self, strengths: np.ndarray) -> np.ndarray:
+        if self._pairs is None:
+            return self._chunked(self._centroid, strengths)
+        return self._chunked(self._closedFormCentroid, strengths)
+
+    def _columns(self) -> tuple[np.ndarray, ...]:
+        # The corners a, b, c, d as columns, to go with (sets, rows) strengths
+        return tuple(x[:, None] for x in (self._a, self._b, self._c, self._d))
+
+    def _scaledPairPeaks(self, strengths: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+        # Where the scaled falling side of each neighbour pair's first set meets the scaled rising
+        # side of the second, and how high. A pair with both strengths 0 gets its unscaled crossing.
+        i, j, pairA, pairX, pairD, _ = self._pairs
+        hi, hj = strengths[i], strengths[j]
+        falling = (self._d[i] - self._c[i])[:, None]
+        rising = (self._b[j] - self._a[j])[:, None]
+
+        denominator = hi * rising + hj * falling
+        with np.errstate(divide="ignore", invalid="ignore"):
+            x = np.where(denominator > 0, (hi * pairD * rising + hj * pairA * falling) / denominator, pairX)
+        return x, hj * (x - pairA) / rising
+
+    def _pairShares(self, strengths: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+        # How the area under both sets of every neighbour pair splits at the handover: the part left
+        # of it is hidden under the second set, the part right of it under the first
+        i, j, pairA, _, pairD, pairPeak = self._pairs
+        hi, hj = strengths[i], strengths[j]
+        span = pairD - pairA
+        rising = (self._b[j] - self._a[j])[:, None]
+        falling = (self._d[i] - self._c[i])[:, None]
+        if self.implication == PRODUCT:
+            # Scaled sides cross at height hi * hj * span / (hi * rising + hj * falling). A pair with
+            # both strengths 0 has nothing to split.
+            denominator = hi * rising + hj * falling
+            denominator += denominator == 0
+            scale = hi * hj * (span / denominator) ** 2 / 2
+            return scale * hi * rising, scale * hj * falling
+
+        # The triangle under both sets cut at the weaker one, or at its peak. Cut below the peak,
+        # the weaker set's whole side is hidden and the other side splits off the rest. Both
+        # agree at the peak, where the sides cross.
+        top = np.minimum(np.minimum(hi, hj), pairPeak)
+        squared = top * top
+        sides = squared * (rising + falling) / 2
+        overlap = top * span - sides
+        hidden = squared * rising / 2 + (hj < hi) * (overlap - sides)
+        return hidden, overlap - hidden
+
+    def _closedFormCentroid(self, strengths: np.ndarray) -> np.ndarray:
+        i, j, pairA, pairX, pairD, pairPeak = self._pairs
+        if self.implication == PRODUCT:
+            area, moment = _clippedMoments(self._a, self._b, self._c, self._d, None, 1)
+            area, moment = _sumRows(area[:, None] * strengths), _sumRows(moment[:, None] * strengths)
+
+            # The overlap of scaled neighbours is a triangle on [a, d] with its top where the sides cross
+            x, y = self._scaledPairPeaks(strengths)
+            overlapArea = (pairD - pairA) * y / 2
+            overlapMoment = overlapArea * (pairA + x + pairD) / 3
+        else:
+            area, moment = _clippedMoments(*self._columns(), None, strengths)
+            area, moment = _sumRows(area), _sumRows(moment)
+            overlapArea, overlapMoment = _clippedMoments(pairA, pairX, pairX, pairD, pairPeak,
+                                                         np.minimum(strengths[i], strengths[j]))
+        if len(i):
+            area = area - _sumRows(overlapArea)
+            moment = moment - _sumRows(overlapMoment)
+
+        with np.errstate(divide="ignore", invalid="ignore"):
+            return np.where(area > 0, moment / area, np.nan)
+
+    def _centroid(self, strengths: np.ndarray) -> np.ndarray:
+        _, width, nodes, membership = self._partition(strengths.T)
+        # Summed interval after interval, so one row adds up in the same order as many
+        weighted = (width / 2)[:, :, None] * _GAUSS_WEIGHTS * membership
+        area = _sumRows(weighted.sum(axis=2).T)
+        moment = _sumRows((weighted * nodes).sum(axis=2).T)
+
+        with np.errstate(divide="ignore", invalid="ignore"):
+            return np.where(area > 0, moment / area, np.nan)
+
+    def bisector(self, strengths: np.ndarray) -> np.ndarray:
+        if self._pairs is None:
+            return self._chunked(self._bisector, strengths)
+        return self._chunked(self._closedFormBisector, strengths)
+
+    def _closedFormBisector(self, strengths: np.ndarray) -> np.ndarray:
+        # Each set is the top of the aggregate on one interval, between the points where it
+        # takes over from the previous neighbour and hands over to the next. The area of that
+        # interval is the set's own area less the overlap with each neighbour on the neighbour's
+        # side of the handover. Walk the intervals in order, then invert the area of the one
+        # holding the half-way point. Rows are walked one set at a time, as whole-chunk selects
+        # and scans across the sets are slow.
+        order = self._order
+        i = self._pairs[0]
+        a, b, c, d = (x[order] for x in (self._a, self._b, self._c, self._d))
+        top = strengths[order]
+        if self.implication == PRODUCT:
+            areas = top * ((d - a) + (c - b))[:, None] / 2
+        else:
+            areas = top * (d - a)[:, None] - top * top * ((b - a) + (d - c))[:, None] / 2
+
+        # The positions of the pair's sets in order, the second always right after the first
+        first = np.argsort(order)[i]
+        before = [None] * len(order)
+        if len(i):
+            hidden, remainder = self._pairShares(strengths)
+            for p, k in enumerate(first):
+                areas[k] -= remainder[p]
+                areas[k + 1] -= hidden[p]
+                before[k + 1] = hidden[p]
+
+        # The area before each interval, less the part of its set hidden before it starts
+        cumulative = np.empty_like(areas)
+        offsets = np.empty_like(areas)
+        total = np.zeros(strengths.shape[1])
+        for k, row in enumerate(areas):
+            offsets[k] = total if before[k] is None else total - before[k]
+            total += row
+            cumulative[k] = total
+        half = total / 2
+
+        picked = np.zeros(len(total), dtype=np.intp)
+        for row in cumulative[:-1]:
+            picked += row < half
+        flat = picked * len(total) + np.arange(len(total))
+
+        topK = top.ravel()[flat]
+        aK, bK, cK, dK = a[picked], b[picked], c[picked], d[picked]
+        if self.implication == PRODUCT:
+            leftK, rightK = bK, cK
+        else:
+            leftK = aK + topK * (bK - aK)
+            rightK = dK - topK * (dK - cK)
+        x = _inverseClippedCdf(aK, leftK, rightK, dK, topK, half - offsets.ravel()[flat])
+        return np.where(half > 0, np.clip(x, aK, dK), np.nan)
+
+    def _bisector(self, strengths: np.ndarray) -> np.ndarray:
+        start, width, _, membership = self._partition(strengths.T)
+        areas = ((width / 2)[:, :, None] * _GAUSS_WEIGHTS * membership).sum(axis=2)
+        cumulative = np.cumsum(areas, axis=1)
+        half = cumulative[:, -1] / 2
+
+        # The interval holding the half-way point, and how much area is still missing at its start
+        k = np.argmax(cumulative >= half[:, None], axis=1)[:, None]
+        missing = (half - (np.take_along_axis(cumulative, k, 1) - np.take_along_axis(areas, k, 1))[:, 0])
+        x0 = np.take_along_axis(start, k, 1)[:, 0]
+        w = np.take_along_axis(width, k, 1)[:, 0]
+        nodes = np.take_along_axis(membership, k[:, :, None], 1)[:, 0]
+
+        # The membership is linear on the interval: solve m0 * t + slope * t^2 / 2 = missing for t
+        with np.errstate(divide="ignore", invalid="ignore"):
+            slope = np.where(w > 0, (nodes[:, 2] - nodes[:, 0]) / (w * _GAUSS_NODES[2]), 0)
+            m0 = nodes[:, 1] - slope * w / 2
+            root = np.sqrt(np.maximum(m0 * m0 + 2 * slope * missing, 0))
+            t = np.where(m0 + root > 0, 2 * missing / (m0 + root), 0)
+
+        return np.where(half > 0, x0 + np.clip(t, 0, w), np.nan)
+
+    def _plateaus(self, strengths: np.ndarray) -> tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+        # The aggregate peaks where the strongest sets are cut, on [a + h(b - a), d - h(d - c)],
+        # or on their own tops [b, c] when scaled
+        height = np.maximum.reduce(strengths, axis=0, initial=0)
+        isMaximum = (strengths == height) & (height > 0)
+        a, b, c, d = self._columns()
+        if self.implication == PRODUCT:
+            left = np.broadcast_to(b, strengths.shape)
+            right = np.broadcast_to(c, strengths.shape)
+        else:
+            left = a + height * (b - a)
+            right = d - height * (d - c)
+        return height, isMaximum, left, right
+
+    def smallestOfMaximum(self, strengths: np.ndarray) -> np.ndarray:
+        return self._chunked(self._smallestOfMaximum, strengths)
+
+    def _smallestOfMaximum(self, strengths: np.ndarray) -> np.ndarray:
+        height, isMaximum, left, _ = self._plateaus(strengths)
+        return np.where(height > 0, np.where(isMaximum, left, np.inf).min(axis=0, initial=np.inf), np.nan)
+
+    def largestOfMaximum(self, strengths: np.ndarray) -> np.ndarray:
+        return self._chunked(self._largestOfMaximum, strengths)
+
+    def _largestOfMaximum(self, strengths: np.ndarray) -> np.ndarray:
+        height, isMaximum, _, right = self._plateaus(strengths)
+        return np.where(height > 0, np.where(isMaximum, right, -np.inf).max(axis=0, initial=-np.inf), np.nan)
+
+    def meanOfMaximum(self, strengths: np.ndarray) -> np.ndarray:
+        if self._pairs is None:
+            return self._chunked(self._meanOfMaximum, strengths)
+        return self._chunked(self._closedFormMeanOfMaximum, strengths)
+
+    def _closedFormMeanOfMaximum(self, strengths: np.ndarray) -> np.ndarray:
+        height, isMaximum, left, right = self._plateaus(strengths)
+        length = np.where(isMaximum, right - left, 0)
+        moment = length * (left + right) / 2
+
+        # Neighbours both cut at the peak height share part of their plateaus
+        i, j = self._pairs[:2]
+        overlapLeft = np.maximum(left[i], left[j])
+        overlapRight = np.minimum(right[i], right[j])
+        overlap = np.where(isMaximum[i] & isMaximum[j], np.maximum(overlapRight - overlapLeft, 0), 0)
+
+        length = _sumRows(length)
+        moment = _sumRows(moment)
+        if len(i):
+            length = length - _sumRows(overlap)
+            moment = moment - _sumRows(overlap * (overlapLeft + overlapRight) / 2)
+
+        count = isMaximum.sum(axis=0)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            peaks = _sumRows(np.where(isMaximum, (left + right) / 2, 0)) / count
+            return np.where(height > 0, np.where(length > 0, moment / length, peaks), np.nan)
+
+    def _meanOfMaximum(self, strengths: np.ndarray) -> np.ndarray:
+        height, isMaximum, left, right = self._plateaus(strengths)
+        start, width, _, membership = self._partition(strengths.T)
+
+        # Intervals lying entirely at the peak height, averaged by their length. Corners that only
+        # differ by rounding leave slivers, which would pass for plateaus wherever the peak is.
+        minimumWidth = 1e-9 * (self._static[-1] - self._static[0])
+        flat = (np.abs(membership - height[:, None, None]) <= 1e-12).all(axis=2) & (width > minimumWidth)
+        length = np.where(flat, width, 0).sum(axis=1)
+        moment = np.where(flat, width * (start + width / 2), 0).sum(axis=1)
+
+        # Triangles cut at 1 peak at a single point, then the peaks are averaged instead
+        count = isMaximum.sum(axis=0)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            peaks = _sumRows(np.where(isMaximum, (left + right) / 2, 0)) / count
+            return np.where(height > 0, np.where(length > 0, moment / length, peaks), np.nan)
+
+    def defuzzify(self, method: str, strengths: np.ndarray) -> np.ndarray:
+        if method == CENTROID:
+            return self.centroid(strengths)
+        elif method == BISECTOR:
+            return self.bisector(strengths)
+        elif method == MEAN_OF_MAXIMUM:
+            return self.meanOfMaximum(strengths)
+        elif method == SMALLEST_OF_MAXIMUM:
+            return self.smallestOfMaximum(strengths)
+        elif method == LARGEST_OF_MAXIMUM:
+            return self.largestOfMaximum(strengths)
+        raise Exception(f"Unknown defuzzification method '{method}'")
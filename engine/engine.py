@@ -1,6 +1,21 @@
-from data.fuzzy_set import TRI
-from data.rule import Rule
+import operator
+import threading
+import time
+from collections import OrderedDict
+from itertools import compress
+
+import numpy as np
+
+from data.fuzzy_set import CONSTANT, LINEAR, TRAP, TRI, FuzzySet
+from data.revision import getRevision
+from data.rule import IS, Rule
+from data.system import MAMDANI, SUGENO
 from data.variable import IN, OUT, Variable
+from engine.defuzzification import METHODS, WEIGHTED_AVERAGE, OutputShape
+from engine.lookup import MAX_LOOKUP_TABLE_BYTES, MembershipTable
+from engine.instrumentation import COMPILE, DEFUZZIFY, FUZZIFY, INFER, Instrumentation
+from engine.operators import IMPLICATIONS, MAXIMUM, MINIMUM, Operator, getSNorm, getTNorm
+from engine.supports import SupportIndex
 
 def getIntercept(shape: list[float], values: list[float], x: float) -> float:
     if x <= shape[0]:
@@ -19,38 +34,40 @@ def fuzzify(variables: list[Variable], input: list[float]) -> list[list[float]]:
     for i, variable in enumerate(variables):
         membership = []
         for set in variable.fuzzySets:
-            membership.append(getIntercept(set.values, [0, 1, 0] if set.type == TRI else [0, 1, 1, 0], input[i]))
+            membership.append(set.getMembership(input[i]))
 
         result.append(membership)
 
     return result
 
+def _evaluateCondition(node: tuple, fuzzyInputs: list[list[float]], inVariables: list[Variable]) -> float:
+    if node[0] == IS:
+        variableIndex = [i for i, x in enumerate(inVariables) if x.name == node[1]][0]
+        setIndex = [i for i, x in enumerate(inVariables[variableIndex].fuzzySets) if x.name == node[2]][0]
+        return fuzzyInputs[variableIndex][setIndex]
+
+    if node[0] == "not":
+        return 1 - _evaluateCondition(node[1], fuzzyInputs, inVariables)
+
+    a = _evaluateCondition(node[1], fuzzyInputs, inVariables)
+    b = _evaluateCondition(node[2], fuzzyInputs, inVariables)
+    return min(a, b) if node[0] == "and" else max(a, b)
+
 def inference(rules: list[Rule], fuzzyInputs: list[list[float]], inVariables: list[Variable], outVariables: list[Variable]) -> list[list[float]]:
     result = []
     for variable in outVariables:
         result.append([0] * len(variable.fuzzySets))
 
     for rule in rules:
-        # Get the index of the input and output variables by checking the name of the variable
-        inIndex1 = [i for i, x in enumerate(inVariables) if x.name == rule.inVariables[0]][0]
-        inIndex2 = [i for i, x in enumerate(inVariables) if x.name == rule.inVariables[1]][0]
-        outIndex = [i for i, x in enumerate(outVariables) if x.name == rule.outVariable][0]
-
-        inSetIndices = [i for i, x in enumerate(inVariables[inIndex1].fuzzySets)
-                         if x.name == rule.inSets[0]] + [i for i, x in enumerate(inVariables[inIndex2].fuzzySets) 
-                         if x.name == rule.inSets[1]]
-        outSetIndex = [i for i, x in enumerate(outVariables[outIndex].fuzzySets) if x.name == rule.outSet][0]
-
-        if rule.operator == "and":
-            output = min(fuzzyInputs[inIndex1][inSetIndices[0]], fuzzyInputs[inIndex2][inSetIndices[1]])
-        elif rule.operator == "or":
-            output = max(fuzzyInputs[inIndex1][inSetIndices[0]], fuzzyInputs[inIndex2][inSetIndices[1]])
-        elif rule.operator == "and_not":
-            output = min(fuzzyInputs[inIndex1][inSetIndices[0]], 1 - fuzzyInputs[inIndex2][inSetIndices[1]])
-        elif rule.operator == "or_not":
-            output = max(fuzzyInputs[inIndex1][inSetIndices[0]], 1 - fuzzyInputs[inIndex2][inSetIndices[1]])
-
-        result[outIndex][outSetIndex] = max(result[outIndex][outSetIndex], output)
+        output = _evaluateCondition(rule.antecedent, fuzzyInputs, inVariables)
+        if rule.weight != 1:
+            output *= rule.weight
+
+        for variableName, setName in rule.consequents:
+            # Get the index of the output variable and set by checking their names
+            outIndex = [i for i, x in enumerate(outVariables) if x.name == variableName][0]
+            outSetIndex = [i for i, x in enumerate(outVariables[outIndex].fuzzySets) if x.name == setName][0]
+            result[outIndex][outSetIndex] = max(result[outIndex][outSetIndex], output)
 
     return result
 
@@ -67,13 +84,606 @@ def defuzzify(variables: list[Variable], fuzzyOutputs: list[list[float]]) -> lis
 
     return list(zip(result, dominantSet))
 
-def simulate(variables: list[Variable], input: list[float], rules: list[str]) -> list[tuple[float, str]]:
-    inVariables = [x for x in variables if x.type == IN]
-    outVariables = [x for x in variables if x.type == OUT]
-    rules = [Rule(x) for x in rules]
+# Rows of a batch run through the rule program at a time
+INFER_BLOCK_ROWS = 4096
+# Rule bases from this size on only evaluate the rules that can fire, unless told otherwise
+SPARSE_MIN_RULES = 16
+# Input variables with this many sets or more are fuzzified through a SupportIndex
+SUPPORT_INDEX_MIN_SETS = 8
+
+# Opcodes of the compiled rule program
+NOT = 0
+AND = 1
+OR = 2
+WEIGHT = 3
+# "a and not b" and "a or not b" in one instruction, the way the original and_not and or_not worked
+AND_NOT = 4
+OR_NOT = 5
+# Fires a rule's outputs from a slot that is already computed, like a single membership
+FIRE = 6
+
+OPERATORS = {
+    "not": NOT,
+    "and": AND,
+    "or": OR,
+}
+
+def _indexByName(items: list) -> dict[str, int]:
+    # First match wins, like the list comprehensions this replaces
+    indices = {}
+    for i, item in enumerate(items):
+        indices.setdefault(item.name, i)
+    return indices
+
+class CompiledSystem:
+    # A rule base with every name resolved to an index, ready to be evaluated many times.
+    # The operators are looked up once here, so evaluation never checks which ones were chosen.
+
+    def __init__(self, variables: list[Variable], rules: list[str], maxLookupBytes: int = MAX_LOOKUP_TABLE_BYTES,
+                 defuzzification: str = WEIGHTED_AVERAGE, inference: str = MAMDANI, andMethod: str = MINIMUM,
+                 orMethod: str = MAXIMUM, implication: str = MINIMUM, ruleAggregation: str = MAXIMUM,
+                 sparse: bool | None = None, instrumentation: Instrumentation | None = None) -> None:
+        if defuzzification not in METHODS:
+            raise Exception(f"Unknown defuzzification method '{defuzzification}'")
+        if inference not in (MAMDANI, SUGENO):
+            raise Exception(f"Unknown inference method '{inference}'")
+        if inference == SUGENO and defuzzification != WEIGHTED_AVERAGE:
+            raise Exception("Sugeno systems are always defuzzified by weighted average")
+        if implication not in IMPLICATIONS:
+            raise Exception(f"Unknown implication '{implication}'")
+        if inference == SUGENO and ruleAggregation != MAXIMUM:
+            raise Exception("Sugeno systems always add up their rules")
+        # The s-norm only combines the rules firing the same output set. The exact methods always
+        # aggregate the clipped or scaled sets with max, which any other choice would contradict.
+        if defuzzification != WEIGHTED_AVERAGE and ruleAggregation != MAXIMUM:
+            raise Exception("The exact defuzzification methods need the MAXIMUM rule aggregation")
+        self.defuzzification = defuzzification
+        self.inference = inference
+        self.andMethod = andMethod
+        self.orMethod = orMethod
+        self.implication = implication
+        self.ruleAggregation = ruleAggregation
+
+        self._and = getTNorm(andMethod)
+        self._or = getSNorm(orMethod)
+        # Mamdani combines the rules of each output set with an s-norm. Sugeno adds them up,
+        # which makes the set-wise weighted average equal to the weighted average over rules.
+        self._aggregate = Operator("SUM", operator.add, np.add) if inference == SUGENO else getSNorm(ruleAggregation)
+
+        self.inVariables = [x for x in variables if x.type == IN]
+        self.outVariables = [x for x in variables if x.type == OUT]
+        self._checkSetTypes()
+
+        # Snapshot the set geometry so later edits don't leak into a compiled system
+        self._inSets = [[FuzzySet(set.type, tuple(set.values), set.name) for set in variable.fuzzySets]
+                        for variable in self.inVariables]
+        self._memberships = [[set.getMembershipFunction() for set in sets] for sets in self._inSets]
+        self._compileLookupTables(maxLookupBytes)
+        # A lookup table wins over the index when a variable has both
+        self.supportIndices = [SupportIndex(sets) if table is None and len(sets) >= SUPPORT_INDEX_MIN_SETS else None
+                               for sets, table in zip(self._inSets, self.lookupTables)]
+        self._lookups = [table or index for table, index in zip(self.lookupTables, self.supportIndices)]
+        if inference == SUGENO:
+            # (coefficients, constant) of each output set, a constant set has no coefficients
+            self._consequents = [[((), set.values[0]) if set.type == CONSTANT else (tuple(set.values[:-1]), set.values[-1])
+                                  for set in variable.fuzzySets] for variable in self.outVariables]
+        else:
+            self._centroids = [[set.getCentroid() for set in variable.fuzzySets] for variable in self.outVariables]
+            # The aggregated shapes are only needed by the exact methods, and building them costs more than the rest
+            # of the compilation, which simulate() repeats after every edit
+            self._outShapes = [OutputShape([FuzzySet(set.type, tuple(set.values), set.name) for set in variable.fuzzySets],
+                                           implication=implication)
+                               if defuzzification != WEIGHTED_AVERAGE else None for variable in self.outVariables]
+        self.outSetNames = [[set.name for set in variable.fuzzySets] for variable in self.outVariables]
+
+        self._inIndices = _indexByName(self.inVariables)
+        self._outIndices = _indexByName(self.outVariables)
+        self._inSetIndices = [_indexByName(x.fuzzySets) for x in self.inVariables]
+        self._outSetIndices = [_indexByName(x.fuzzySets) for x in self.outVariables]
+        self._compileRules(rules)
+
+        self.sparse = self.ruleCount >= SPARSE_MIN_RULES if sparse is None else sparse
+        # Records the time of every stage of evaluate() and evaluateBatch() when set
+        self.instrumentation = instrumentation
+        # Counted per input row
+        self.rulesEvaluated = 0
+        self.rulesSkipped = 0
+
+    def getRuleStats(self) -> dict[str, int | float]:
+        total = self.rulesEvaluated + self.rulesSkipped
+        return {
+            "rules": self.ruleCount,
+            "sparse": self.sparse,
+            "evaluated": self.rulesEvaluated,
+            "skipped": self.rulesSkipped,
+            "skipRate": self.rulesSkipped / total if total else 0.0,
+        }
+
+    def _checkSetTypes(self):
+        for variable in self.inVariables:
+            for set in variable.fuzzySets:
+                if set.type not in (TRI, TRAP):
+                    raise Exception(f"Fuzzy set '{set.name}' of input variable '{variable.name}' must be a triangle or a trapezoid")
+
+        for variable in self.outVariables:
+            for set in variable.fuzzySets:
+                if self.inference == MAMDANI and set.type not in (TRI, TRAP):
+                    raise Exception(f"Fuzzy set '{set.name}' of variable '{variable.name}' needs Sugeno inference")
+                if self.inference == SUGENO:
+                    if set.type not in (CONSTANT, LINEAR):
+                        raise Exception(f"Fuzzy set '{set.name}' of variable '{variable.name}' must be constant or linear "
+                                        "in a Sugeno system")
+                    if set.type == CONSTANT and len(set.values) != 1:
+                        raise Exception(f"Constant set '{set.name}' of variable '{variable.name}' needs exactly 1 value")
+                    if set.type == LINEAR and len(set.values) != len(self.inVariables) + 1:
+                        raise Exception(f"Linear set '{set.name}' of variable '{variable.name}' needs "
+                                        f"{len(self.inVariables) + 1} values, a coefficient per input and a constant")
+
+    def _compileLookupTables(self, maxBytes: int):
+        self.lookupTables: list[MembershipTable | None] = []
+        self.lookupTableBytes = 0
+
+        for variable, sets in zip(self.inVariables, self._inSets):
+            if variable.lookupResolution is None:
+                self.lookupTables.append(None)
+                continue
+
+            # The cap applies to all tables of the system together
+            table = MembershipTable(sets, variable.limits, variable.lookupResolution,
+                                    variable.lookupInterpolate, maxBytes - self.lookupTableBytes)
+            self.lookupTableBytes += table.nbytes
+            self.lookupTables.append(table)
+
+    def _compileRules(self, rules: list[str]):
+        # All rules become one flat program of (opcode, a, b, target, targets) instructions. The memberships
+        # of every (input variable, set) pair take the first slots, and each instruction writes one more
+        # slot computed from earlier ones, so a rule costs one instruction per operator. Identical
+        # sub-expressions, like the same negated condition in several rules, are only computed once.
+        # targets lists the (output variable, set) pairs the rule ending in that instruction fires.
+        self._setSlots = []
+        self.slotCount = 0
+        for sets in self._inSets:
+            self._setSlots.append(self.slotCount)
+            self.slotCount += len(sets)
+        self.membershipSlots = self.slotCount
+
+        program = []
+        instructions = {}
+        # The memberships that make a slot 0 when any of them is 0
+        self._required = [frozenset([slot]) for slot in range(self.membershipSlots)]
+        self._ruleSlots = []
+        rulePrograms = []
+        ruleOutputs = []
+        for text in rules:
+            rule = Rule(text)
+            first = len(program)
+            slot = self._compileNode(rule.antecedent, program, instructions)
+            if rule.weight != 1:
+                slot = self._emit(WEIGHT, slot, rule.weight, program, instructions)
+
+            targets = []
+            for variableName, setName in rule.consequents:
+                if variableName not in self._outIndices:
+                    raise Exception(f"Unknown output variable '{variableName}'")
+                outIndex = self._outIndices[variableName]
+                if setName not in self._outSetIndices[outIndex]:
+                    raise Exception(f"Unknown fuzzy set '{setName}' of variable '{variableName}'")
+                targets.append((outIndex, self._outSetIndices[outIndex][setName]))
+                ruleOutputs.append((slot, *targets[-1]))
+            self._ruleSlots.append(slot)
+            rulePrograms.append(self._ruleProgram(program[first:], slot, tuple(targets)))
+
+        # Rules fire in order, so every way of running them aggregates the outputs in the same order
+        self.program = tuple(instruction for x in rulePrograms for instruction in x)
+        self.ruleOutputs = tuple(ruleOutputs)
+        self.ruleCount = len(rules)
+        self._padding = [0.0] * (self.slotCount - self.membershipSlots)
+        self._ruleRequired = [self._required[slot] for slot in self._ruleSlots]
+        self._ruleTargets = [x[-1][4] for x in rulePrograms]
+        # Built by _compileRuleIndex() the first time sparse evaluation needs it
+        self._ruleIndex = None
+
+    def _ruleProgram(self, instructions: list[tuple], slot: int, targets: tuple) -> tuple:
+        # A rule fires from its last instruction, or from a FIRE of a slot that was already computed
+        program = [(*x, ()) for x in instructions]
+        if program and program[-1][3] == slot:
+            program[-1] = (*instructions[-1], targets)
+        else:
+            program.append((FIRE, slot, 0, slot, targets))
+        return tuple(program)
+
+    def _compileRuleIndex(self):
+        # A rule whose strength is 0 aggregates to nothing, so a rule only needs evaluating when all of
+        # its required memberships are active. Each rule is indexed by the required membership of
+        # the input with the most sets, which is the least likely to be active. Rules that require
+        # nothing, like "not a low => ...", are always evaluated. Only sparse evaluation needs this,
+        # so it is left out of the compilation simulate() repeats.
+        if self._ruleIndex is not None:
+            return
+        setCounts = [len(sets) for sets in self._inSets for _ in sets]
+        ruleIndex = [[] for _ in range(self.membershipSlots)]
+        unindexedRules = []
+        for i, required in enumerate(self._ruleRequired):
+            if required:
+                ruleIndex[max(sorted(required), key=setCounts.__getitem__)].append(i)
+            else:
+                unindexedRules.append(i)
+        self._unindexedRules = tuple(unindexedRules)
+
+        # Evaluated alone, a rule also needs the instructions it shares with earlier rules
+        bySlot = {instruction[3]: instruction[:4] for instruction in self.program if instruction[0] != FIRE}
+        self._ruleClosures = []
+        for slot, targets in zip(self._ruleSlots, self._ruleTargets):
+            closure = {}
+            self._collectInstructions(slot, bySlot, closure)
+            self._ruleClosures.append(self._ruleProgram(sorted(closure.values(), key=lambda x: x[3]), slot, targets))
+        self._ruleIndex = [tuple(x) for x in ruleIndex]
+
+    @property
+    def rulesBySet(self) -> dict[tuple[str, str], tuple[int, ...]]:
+        # Every rule that needs a given (input variable, set) active, by rule number
+        names = [(variable.name, set.name) for variable, sets in zip(self.inVariables, self._inSets) for set in sets]
+        return {name: tuple(i for i, required in enumerate(self._ruleRequired) if slot in required)
+                for slot, name in enumerate(names)}
+
+    def _collectInstructions(self, slot: int, bySlot: dict[int, tuple], closure: dict[int, tuple]):
+        if slot < self.membershipSlots or slot in closure:
+            return
+        instruction = bySlot[slot]
+        opcode, a, b, _ = instruction
+        self._collectInstructions(a, bySlot, closure)
+        if opcode != WEIGHT and opcode != NOT:
+            self._collectInstructions(b, bySlot, closure)
+        closure[slot] = instruction
+
+    def _emit(self, opcode: int, a: int, b: int | float, program: list, instructions: dict) -> int:
+        key = (opcode, a, b)
+        if key not in instructions:
+            program.append((*key, self.slotCount))
+            instructions[key] = self.slotCount
+            # Every t-norm is 0 when either side is 0 and every s-norm only when both sides are
+            if opcode == AND:
+                required = self._required[a] | self._required[b]
+            elif opcode == OR:
+                required = self._required[a] & self._required[b]
+            elif opcode == AND_NOT or opcode == WEIGHT:
+                required = self._required[a]
+            else:
+                required = frozenset()
+            self._required.append(required)
+            self.slotCount += 1
+        return instructions[key]
+
+    def _compileNode(self, node: tuple, program: list, instructions: dict) -> int:
+        if node[0] == IS:
+            _, variableName, setName = node
+            if variableName not in self._inIndices:
+                raise Exception(f"Unknown input variable '{variableName}'")
+            variableIndex = self._inIndices[variableName]
+            if setName not in self._inSetIndices[variableIndex]:
+                raise Exception(f"Unknown fuzzy set '{setName}' of variable '{variableName}'")
+            return self._setSlots[variableIndex] + self._inSetIndices[variableIndex][setName]
+
+        if node[0] == "not":
+            return self._emit(NOT, self._compileNode(node[1], program, instructions), 0, program, instructions)
+
+        opcode = OPERATORS[node[0]]
+        left, right = node[1:]
+        if right[0] == "not":
+            opcode = AND_NOT if opcode == AND else OR_NOT
+            right = right[1]
+        return self._emit(opcode, self._compileNode(left, program, instructions),
+                          self._compileNode(right, program, instructions), program, instructions)
+
+    def fuzzify(self, input: list[float]) -> list[list[float]]:
+        return [[membership(input[i]) for membership in memberships] if lookup is None else lookup.lookup(input[i])
+                for i, (memberships, lookup) in enumerate(zip(self._memberships, self._lookups))]
+
+    def fuzzifyInput(self, index: int, x: float) -> list[float]:
+        # The memberships of one input variable, the same as fuzzify() gives
+        lookup = self._lookups[index]
+        return [membership(x) for membership in self._memberships[index]] if lookup is None else lookup.lookup(x)
+
+    def fuzzifySparse(self, input: list[float]) -> list[list[tuple[int, float]]]:
+        # (set, membership) of only the sets each input is in
+        result = []
+        for i, (memberships, lookup, index) in enumerate(zip(self._memberships, self._lookups, self.supportIndices)):
+            if index is not None:
+                result.append(index.lookupSparse(input[i]))
+            else:
+                dense = [membership(input[i]) for membership in memberships] if lookup is None else lookup.lookup(input[i])
+                result.append([(j, x) for j, x in enumerate(dense) if x])
+        return result
+
+    def _activeProgram(self, active: list, rows: int = 1) -> list[tuple]:
+        # The rules indexed by an active membership whose other required memberships are active too,
+        # run in rule order
+        self._compileRuleIndex()
+        activeSlots = set(compress(range(self.membershipSlots), active))
+        candidates = list(self._unindexedRules)
+        ruleIndex = self._ruleIndex
+        for slot in activeSlots:
+            candidates += ruleIndex[slot]
+        required = self._ruleRequired
+        rules = [i for i in candidates if required[i] <= activeSlots]
+        rules.sort()
+
+        self.rulesEvaluated += len(rules) * rows
+        self.rulesSkipped += (self.ruleCount - len(rules)) * rows
+        closures = self._ruleClosures
+        return [instruction for i in rules for instruction in closures[i]]
+
+    def infer(self, fuzzyInputs: list[list[float]], strengths: list[float] | None = None) -> list[list[float]]:
+        # strengths, when given, receives the strength of every rule in rule order
+        result = [[0] * len(names) for names in self.outSetNames]
+        tNorm = self._and.scalar
+        sNorm = self._or.scalar
+        aggregate = self._aggregate.scalar
+
+        values = [x for memberships in fuzzyInputs for x in memberships]
+        if self.sparse:
+            program = self._activeProgram(values)
+        else:
+            program = self.program
+            self.rulesEvaluated += self.ruleCount
+
+        values += self._padding
+        for opcode, a, b, target, targets in program:
+            if opcode == AND:
+                value = tNorm(values[a], values[b])
+            elif opcode == OR:
+                value = sNorm(values[a], values[b])
+            elif opcode == AND_NOT:
+                value = tNorm(values[a], 1 - values[b])
+            elif opcode == OR_NOT:
+                value = sNorm(values[a], 1 - values[b])
+            elif opcode == NOT:
+                value = 1 - values[a]
+            elif opcode == WEIGHT:
+                value = values[a] * b
+            else:
+                value = values[a]
+            values[target] = value
+
+            for outIndex, outSet in targets:
+                outputs = result[outIndex]
+                outputs[outSet] = aggregate(outputs[outSet], value)
+
+        if strengths is not None:
+            # Rules skipped by sparse evaluation kept the 0 of their padding slot
+            strengths += [values[slot] for slot in self._ruleSlots]
+        return result
+
+    def defuzzify(self, fuzzyOutputs: list[list[float]], input: list[float] | None = None) -> list[tuple[float, str]]:
+        if self.inference == SUGENO:
+            return self._defuzzifySugeno(fuzzyOutputs, input)
+
+        result = []
+
+        for variable, shape, centroids, names, outputs in zip(self.outVariables, self._outShapes, self._centroids,
+                                                               self.outSetNames, fuzzyOutputs):
+            if self.defuzzification == WEIGHTED_AVERAGE:
+                crisp = 0
+                for centroid, output in zip(centroids, outputs):
+                    crisp += centroid * output
+                crisp /= sum(outputs)
+            else:
+                crisp = float(shape.defuzzify(self.defuzzification, np.array([outputs], dtype=float))[0])
+                if crisp != crisp:
+                    raise ZeroDivisionError(f"No rule fired for output '{variable.name}'")
+            result.append((crisp, names[outputs.index(max(outputs))]))
+
+        return result
+
+    def _defuzzifySugeno(self, fuzzyOutputs: list[list[float]], input: list[float]) -> list[tuple[float, str]]:
+        result = []
+
+        for consequents, names, outputs in zip(self._consequents, self.outSetNames, fuzzyOutputs):
+            crisp = 0
+            for (coefficients, constant), output in zip(consequents, outputs):
+                z = 0
+                for coefficient, x in zip(coefficients, input):
+                    z += coefficient * x
+                crisp += (z + constant) * output
+            crisp /= sum(outputs)
+            result.append((crisp, names[outputs.index(max(outputs))]))
+
+        return result
+
+    def evaluate(self, input: list[float]) -> list[tuple[float, str]]:
+        if self.instrumentation is not None:
+            return self._evaluateInstrumented(input)
+        return self.defuzzify(self.infer(self.fuzzify(input)), input)
+
+    def _evaluateInstrumented(self, input: list[float]) -> list[tuple[float, str]]:
+        instrumentation = self.instrumentation
+        start = time.perf_counter_ns()
+        fuzzyInputs = self.fuzzify(input)
+        instrumentation.record(FUZZIFY, time.perf_counter_ns() - start)
+
+        strengths = []
+        start = time.perf_counter_ns()
+        fuzzyOutputs = self.infer(fuzzyInputs, strengths)
+        instrumentation.record(INFER, time.perf_counter_ns() - start)
+        instrumentation.recordRules(sum(1 for x in strengths if x))
+
+        start = time.perf_counter_ns()
+        result = self.defuzzify(fuzzyOutputs, input)
+        instrumentation.record(DEFUZZIFY, time.perf_counter_ns() - start)
+        return result
+
+    def fuzzifyBatch(self, inputs: np.ndarray) -> list[np.ndarray]:
+        # One (N, sets) membership array per input variable
+        return [np.stack([set.getMembershipBatch(inputs[:, i]) for set in sets], axis=1) if lookup is None
+                else lookup.lookupBatch(inputs[:, i])
+                for i, (sets, lookup) in enumerate(zip(self._inSets, self._lookups))]
+
+    def inferBatch(self, fuzzyInputs: list[np.ndarray], firedRules: np.ndarray | None = None) -> list[np.ndarray]:
+        # firedRules, when given, is an (N,) integer array the number of rules fired in each row is added to
+        n = len(fuzzyInputs[0]) if fuzzyInputs else 0
+        tNorm = self._and.batch
+        sNorm = self._or.batch
+        aggregate = self._aggregate.batch
+
+        # Strengths are built as (sets, N) so every set is contiguous, and returned transposed
+        result = [np.zeros((len(names), n)) for names in self.outSetNames]
+
+        # The program runs over blocks of rows in one preallocated array of slots, so no
+        # instruction allocates and a block's slots stay in cache
+        registers = np.empty((self.slotCount, min(n, INFER_BLOCK_ROWS)))
+        for start in range(0, n, INFER_BLOCK_ROWS):
+            end = min(start + INFER_BLOCK_ROWS, n)
+            slots = registers[:, :end - start]
+
+            offset = 0
+            for memberships in fuzzyInputs:
+                slots[offset:offset + memberships.shape[1]] = memberships[start:end].T
+                offset += memberships.shape[1]
+
+            if self.sparse:
+                # A rule is only skipped when it can't fire in any row of the block, which pays off
+                # when neighbouring rows are alike, like the samples of a time series
+                program = self._activeProgram(slots[:self.membershipSlots].any(axis=1).tolist(), end - start)
+            else:
+                program = self.program
+                self.rulesEvaluated += self.ruleCount * (end - start)
+
+            # Rules run alone share instructions, which only need computing once
+            computed = set()
+            for opcode, a, b, target, targets in program:
+                value = slots[target]
+                if opcode == FIRE or target in computed:
+                    pass
+                elif opcode == AND:
+                    tNorm(slots[a], slots[b], out=value)
+                elif opcode == OR:
+                    sNorm(slots[a], slots[b], out=value)
+                elif opcode == AND_NOT:
+                    tNorm(slots[a], np.subtract(1, slots[b], out=value), out=value)
+                elif opcode == OR_NOT:
+                    sNorm(slots[a], np.subtract(1, slots[b], out=value), out=value)
+                elif opcode == NOT:
+                    np.subtract(1, slots[a], out=value)
+                else:
+                    np.multiply(slots[a], b, out=value)
+                computed.add(target)
+
+                for outIndex, outSet in targets:
+                    outputs = result[outIndex][outSet, start:end]
+                    aggregate(outputs, value, out=outputs)
+
+            if firedRules is not None:
+                # The slots of skipped rules still hold an earlier block
+                fired = firedRules[start:end]
+                for slot in self._ruleSlots:
+                    if slot < self.membershipSlots or slot in computed:
+                        fired += slots[slot] != 0
+
+        return [x.T for x in result]
+
+    def defuzzifyBatch(self, fuzzyOutputs: list[np.ndarray],
+                       inputs: np.ndarray | None = None) -> tuple[np.ndarray, np.ndarray]:
+        n = len(fuzzyOutputs[0]) if fuzzyOutputs else 0
+        crisp = np.empty((n, len(self.outVariables)))
+        dominant = np.empty((n, len(self.outVariables)), dtype=np.intp)
+
+        if self.inference == SUGENO:
+            for i, (consequents, outputs) in enumerate(zip(self._consequents, fuzzyOutputs)):
+                dominant[:, i] = outputs.argmax(axis=1)
+
+                # Same order of operations as _defuzzifySugeno()
+                weighted = np.zeros(n)
+                total = np.zeros(n)
+                for j, (coefficients, constant) in enumerate(consequents):
+                    z = np.zeros(n)
+                    for k, coefficient in enumerate(coefficients):
+                        z += coefficient * inputs[:, k]
+                    weighted += (z + constant) * outputs[:, j]
+                    total += outputs[:, j]
+
+                with np.errstate(divide="ignore", invalid="ignore"):
+                    crisp[:, i] = weighted / total
+            return crisp, dominant
+
+        for i, (shape, centroids, outputs) in enumerate(zip(self._outShapes, self._centroids, fuzzyOutputs)):
+            dominant[:, i] = outputs.argmax(axis=1)
+            if self.defuzzification != WEIGHTED_AVERAGE:
+                crisp[:, i] = shape.defuzzify(self.defuzzification, outputs)
+                continue
+
+            # Accumulate set by set, in the same order as defuzzify(), to get identical rounding
+            weighted = np.zeros(n)
+            total = np.zeros(n)
+            for j, centroid in enumerate(centroids):
+                weighted += centroid * outputs[:, j]
+                total += outputs[:, j]
+
+            # Rows where no rule fired have no defined output and become NaN
+            with np.errstate(divide="ignore", invalid="ignore"):
+                crisp[:, i] = weighted / total
+
+        return crisp, dominant
+
+    def evaluateBatch(self, inputs: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+        inputs = np.asarray(inputs, dtype=float)
+        if inputs.ndim != 2 or inputs.shape[1] < len(self.inVariables):
+            raise Exception(f"Expected an (N, {len(self.inVariables)}) array of inputs")
+
+        if self.instrumentation is not None:
+            return self._evaluateBatchInstrumented(inputs)
+        return self.defuzzifyBatch(self.inferBatch(self.fuzzifyBatch(inputs)), inputs)
+
+    def _evaluateBatchInstrumented(self, inputs: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+        instrumentation = self.instrumentation
+        n = len(inputs)
+        start = time.perf_counter_ns()
+        fuzzyInputs = self.fuzzifyBatch(inputs)
+        instrumentation.record(FUZZIFY, time.perf_counter_ns() - start, n)
+
+        firedRules = np.zeros(n, dtype=np.intp)
+        start = time.perf_counter_ns()
+        fuzzyOutputs = self.inferBatch(fuzzyInputs, firedRules)
+        instrumentation.record(INFER, time.perf_counter_ns() - start, n)
+        instrumentation.recordRules(int(firedRules.sum()), n)
+
+        start = time.perf_counter_ns()
+        result = self.defuzzifyBatch(fuzzyOutputs, inputs)
+        instrumentation.record(DEFUZZIFY, time.perf_counter_ns() - start, n)
+        return result
+
+# Compiled systems simulate() and simulateBatch() reuse, most recently used last
+SIMULATE_CACHE_SIZE = 8
+_compiled: OrderedDict[tuple, CompiledSystem] = OrderedDict()
+_compiledLock = threading.Lock()
+
+def _compile(variables: list[Variable], rules: list[str], inference: str,
+             instrumentation: Instrumentation | None) -> CompiledSystem:
+    if instrumentation is not None:
+        # Measuring the compilation needs one
+        with instrumentation.measure(COMPILE):
+            return CompiledSystem(variables, rules, inference=inference, instrumentation=instrumentation)
+
+    # Any edit to a variable or set bumps the revision, and the variables are compared by identity
+    key = (getRevision(), tuple(variables), tuple(rules), inference)
+    with _compiledLock:
+        system = _compiled.get(key)
+        if system is not None:
+            _compiled.move_to_end(key)
+            return system
+
+    system = CompiledSystem(variables, rules, inference=inference)
+    with _compiledLock:
+        _compiled[key] = system
+        if len(_compiled) > SIMULATE_CACHE_SIZE:
+            _compiled.popitem(last=False)
+    return system
 
-    fuzzyInputs = fuzzify(inVariables, input)
-    fuzzyOutputs = inference(rules, fuzzyInputs, inVariables, outVariables)
-    crispOutputs = defuzzify(outVariables, fuzzyOutputs)
+def simulate(variables: list[Variable], input: list[float], rules: list[str],
+             inference: str = MAMDANI, instrumentation: Instrumentation | None = None) -> list[tuple[float, str]]:
+    # The same variables and rules are only compiled once, until one of them is edited
+    return _compile(variables, rules, inference, instrumentation).evaluate(input)
 
-    return crispOutputs
+def simulateBatch(variables: list[Variable], inputs: np.ndarray, rules: list[str],
+                  inference: str = MAMDANI, instrumentation: Instrumentation | None = None) -> tuple[np.ndarray, np.ndarray]:
+    # Crisp outputs and dominant set indices, both shaped (N, output variables)
+    return _compile(variables, rules, inference, instrumentation).evaluateBatch(inputs)
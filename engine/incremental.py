@@ -0,0 +1,264 @@
+from data.system import MAMDANI, SUGENO
+from data.variable import Variable
+from engine.engine import AND, AND_NOT, FIRE, NOT, OR, OR_NOT, WEIGHT, CompiledSystem
+
+# Cached plans, one per set of membership slots that changed together, before they are all dropped
+MAX_PLANS = 4096
+
+
+class IncrementalEvaluator:
+    # Evaluates a stream of inputs that mostly repeat the previous one, like a controller's readings
+    # from one tick to the next. The memberships, rule strengths and aggregated outputs of the last
+    # input are kept, and only what depends on the inputs that changed is computed again: their
+    # memberships, the rule instructions reading a membership that moved, and the output sets of the
+    # rules whose strength moved. Results are the same as simulate() gives for each input.
+
+    def __init__(self, variables: list[Variable], rules: list[str], inference: str = MAMDANI, **options) -> None:
+        # options are passed to CompiledSystem, like defuzzification or andMethod
+        self.system = CompiledSystem(variables, rules, inference=inference, **options)
+        system = self.system
+        self._inputIndices = {}
+        for i, variable in enumerate(system.inVariables):
+            self._inputIndices.setdefault(variable.name, i)
+
+        # The instruction computing each slot, and the instructions reading each slot. Instructions
+        # only read earlier slots, so computing them in slot order respects every dependency.
+        self._instructions = {}
+        self._program = []
+        self._dependents = [[] for _ in range(system.slotCount)]
+        for opcode, a, b, target, _ in system.program:
+            if opcode == FIRE:
+                continue
+            self._instructions[target] = (opcode, a, b)
+            self._program.append((opcode, a, b, target))
+            self._dependents[a].append(target)
+            if opcode != NOT and opcode != WEIGHT and b != a:
+                self._dependents[b].append(target)
+
+        # Identical conditions share a slot, so one slot can be the strength of several rules
+        self._rulesBySlot = {}
+        for i, slot in enumerate(system._ruleSlots):
+            self._rulesBySlot.setdefault(slot, []).append(i)
+        self._ruleTargets = system._ruleTargets
+        # The rules firing each output set, in the order CompiledSystem.infer() aggregates them
+        self._contributors = {(i, j): [] for i, names in enumerate(system.outSetNames) for j in range(len(names))}
+        for i, targets in enumerate(self._ruleTargets):
+            for target in targets:
+                self._contributors[target].append(i)
+
+        # Sparse evaluation leaves out the rules missing a required membership altogether, so a
+        # membership becoming zero or non-zero changes what those rules aggregate
+        self._rulesRequiring = [[] for _ in range(system.membershipSlots)]
+        if system.sparse:
+            for i, required in enumerate(system._ruleRequired):
+                for slot in required:
+                    self._rulesRequiring[slot].append(i)
+
+        self._plans = {}
+
+        self.evaluations = 0
+        self.inputsFuzzified = 0
+        self.inputsSkipped = 0
+        self.instructionsEvaluated = 0
+        self.instructionsSkipped = 0
+        self.rulesRefired = 0
+        self.rulesSkipped = 0
+        self.outputsAggregated = 0
+        self.outputsSkipped = 0
+        self.defuzzifications = 0
+        self.defuzzificationsSkipped = 0
+        self.reset()
+
+    def reset(self):
+        # Forgets the last input, the next evaluation computes everything
+        self._input = None
+        self._values = None
+        self._strengths = None
+        self._outputs = None
+        self._result = None
+
+    def _run(self, program: list[tuple[int, int, int, int]]):
+        # The instructions of program in order, the way CompiledSystem.infer() runs them
+        values = self._values
+        tNorm = self.system._and.scalar
+        sNorm = self.system._or.scalar
+        for opcode, a, b, target in program:
+            if opcode == AND:
+                value = tNorm(values[a], values[b])
+            elif opcode == OR:
+                value = sNorm(values[a], values[b])
+            elif opcode == AND_NOT:
+                value = tNorm(values[a], 1 - values[b])
+            elif opcode == OR_NOT:
+                value = sNorm(values[a], 1 - values[b])
+            elif opcode == NOT:
+                value = 1 - values[a]
+            else:
+                value = values[a] * b
+            values[target] = value
+
+    def _aggregate(self, target: tuple[int, int]) -> float:
+        strengths = self._strengths
+        aggregate = self.system._aggregate.scalar
+        output = 0
+        for rule in self._contributors[target]:
+            strength = strengths[rule]
+            if strength is not None:
+                output = aggregate(output, strength)
+        return output
+
+    def _getPlan(self, slots: tuple[int, ...]) -> tuple[list, list]:
+        # The instructions reading any of the changed membership slots, directly or not, in slot order,
+        # and the rules whose strength they may change. Controllers move the same few memberships tick
+        # after tick, so plans are cached.
+        plan = self._plans.get(slots)
+        if plan is not None:
+            return plan
+
+        affected = set()
+        stack = list(slots)
+        while stack:
+            for dependent in self._dependents[stack.pop()]:
+                if dependent not in affected:
+                    affected.add(dependent)
+                    stack.append(dependent)
+        program = [(*self._instructions[slot], slot) for slot in sorted(affected)]
+        sparse = self.system.sparse
+
+        rules = set()
+        for slot in slots:
+            rules.update(self._rulesBySlot.get(slot, ()))
+            rules.update(self._rulesRequiring[slot])
+        for slot in affected:
+            rules.update(self._rulesBySlot.get(slot, ()))
+
+        if len(self._plans) >= MAX_PLANS:
+            self._plans.clear()
+        # Each rule with its strength slot, the memberships it requires when sparse and its output sets
+        rules = [(rule, self.system._ruleSlots[rule], self.system._ruleRequired[rule] if sparse else (),
+                  self._ruleTargets[rule]) for rule in sorted(rules)]
+        plan = self._plans[slots] = (program, rules)
+        return plan
+
+    def _evaluateAll(self, input: list[float]):
+        system = self.system
+        self._values = [x for i in range(len(system.inVariables)) for x in system.fuzzifyInput(i, input[i])]
+        self._values += [0.0] * (system.slotCount - system.membershipSlots)
+        self._run(self._program)
+        # None for the rules sparse evaluation leaves out, because a membership they require is zero
+        values = self._values
+        self._strengths = [None if system.sparse and not all(values[x] for x in required) else values[slot]
+                           for slot, required in zip(system._ruleSlots, system._ruleRequired)]
+        self._outputs = [[self._aggregate((i, j)) for j in range(len(names))]
+                         for i, names in enumerate(system.outSetNames)]
+
+        self.inputsFuzzified += len(system.inVariables)
+        self.instructionsEvaluated += len(self._program)
+        self.rulesRefired += system.ruleCount
+        self.outputsAggregated += len(self._contributors)
+
+    def _evaluateChanges(self, input: list[float]) -> bool:
+        # Returns whether any output set may have changed
+        system = self.system
+        values = self._values
+        changed = [i for i, (x, last) in enumerate(zip(input, self._input)) if x != last]
+        self.inputsFuzzified += len(changed)
+        self.inputsSkipped += len(system.inVariables) - len(changed)
+
+        slots = []
+        for i in changed:
+            offset = system._setSlots[i]
+            for j, value in enumerate(system.fuzzifyInput(i, input[i])):
+                # NaN never equals itself, so it always counts as a change
+                if value != values[offset + j]:
+                    values[offset + j] = value
+                    slots.append(offset + j)
+
+        program, rules = self._getPlan(tuple(slots)) if slots else ((), ())
+        self._run(program)
+
+        # Only the output sets of rules whose strength moved are aggregated again. NaN never equals
+        # itself, and None only equals None.
+        strengths = self._strengths
+        targets = set()
+        for rule, slot, required, ruleTargets in rules:
+            strength = values[slot]
+            for x in required:
+                if not values[x]:
+                    strength = None
+                    break
+            if strength != strengths[rule] or strength != strength:
+                strengths[rule] = strength
+                targets.update(ruleTargets)
+        for outIndex, outSet in targets:
+            self._outputs[outIndex][outSet] = self._aggregate((outIndex, outSet))
+
+        self.instructionsEvaluated += len(program)
+        self.instructionsSkipped += len(self._program) - len(program)
+        self.rulesRefired += len(rules)
+        self.rulesSkipped += system.ruleCount - len(rules)
+        self.outputsAggregated += len(targets)
+        self.outputsSkipped += len(self._contributors) - len(targets)
+        return bool(targets) or (system.inference == SUGENO and bool(changed))
+
+    def evaluate(self, input: list[float]) -> list[tuple[float, str]]:
+        self.evaluations += 1
+        try:
+            if self._input is None:
+                self._evaluateAll(input)
+                outputsChanged = True
+            else:
+                outputsChanged = self._evaluateChanges(input)
+        except Exception:
+            # Fuzzifying can raise halfway through (NaN on a degenerate shoulder), so nothing kept is trusted
+            self.reset()
+            raise
+        self._input = list(input)
+
+        if not outputsChanged and self._result is not None:
+            self.defuzzificationsSkipped += 1
+            return list(self._result)
+
+        # Forgotten first, so an input where no rule fires leaves nothing stale behind
+        self._result = None
+        self.defuzzifications += 1
+        self._result = self.system.defuzzify(self._outputs, self._input)
+        return list(self._result)
+
+    def update(self, changes: dict[str | int, float]) -> list[tuple[float, str]]:
+        # Evaluates the last input with some inputs replaced, given by name or position
+        if self._input is None:
+            raise Exception("Evaluate a complete input before updating it")
+
+        input = list(self._input)
+        for key, value in changes.items():
+            if isinstance(key, str):
+                if key not in self._inputIndices:
+                    raise Exception(f"Unknown input variable '{key}'")
+                key = self._inputIndices[key]
+            input[key] = value
+        return self.evaluate(input)
+
+    def getStats(self) -> dict[str, int | float]:
+        def rate(skipped: int, done: int) -> float:
+            return skipped / (skipped + done) if skipped + done else 0.0
+
+        return {
+            "evaluations": self.evaluations,
+            "inputsFuzzified": self.inputsFuzzified,
+            "inputsSkipped": self.inputsSkipped,
+            "instructionsEvaluated": self.instructionsEvaluated,
+            "instructionsSkipped": self.instructionsSkipped,
+            "rulesRefired": self.rulesRefired,
+            "rulesSkipped": self.rulesSkipped,
+            "outputsAggregated": self.outputsAggregated,
+            "outputsSkipped": self.outputsSkipped,
+            "defuzzifications": self.defuzzifications,
+            "defuzzificationsSkipped": self.defuzzificationsSkipped,
+            # The share of each stage's work that was reused from the last input
+            "fuzzifyHitRate": rate(self.inputsSkipped, self.inputsFuzzified),
+            "instructionHitRate": rate(self.instructionsSkipped, self.instructionsEvaluated),
+            "ruleHitRate": rate(self.rulesSkipped, self.rulesRefired),
+            "aggregateHitRate": rate(self.outputsSkipped, self.outputsAggregated),
+            "defuzzifyHitRate": rate(self.defuzzificationsSkipped, self.defuzzifications),
+        }
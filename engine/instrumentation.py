@@ -0,0 +1,102 @@
+import time
+from contextlib import contextmanager
+from typing import Callable, Iterator
+
+COMPILE = "compile"
+FUZZIFY = "fuzzify"
+INFER = "infer"
+DEFUZZIFY = "defuzzify"
+STAGES = [COMPILE, FUZZIFY, INFER, DEFUZZIFY]
+
+
+class Instrumentation:
+    # Cumulative time, calls and samples of each stage of the engine, plus the rules fired per sample
+    # and the cache lookups. Systems only record into one when it is passed to them, so an engine
+    # without instrumentation skips all of this.
+
+    def __init__(self) -> None:
+        # Each one is called as callback(stage, nanoseconds, samples) after every recorded stage
+        self.callbacks: list[Callable[[str, int, int], None]] = []
+        self.reset()
+
+    def reset(self):
+        self.calls = dict.fromkeys(STAGES, 0)
+        self.nanoseconds = dict.fromkeys(STAGES, 0)
+        self.samples = dict.fromkeys(STAGES, 0)
+        self.rulesFired = 0
+        self.ruleSamples = 0
+        self.cacheHits = 0
+        self.cacheMisses = 0
+
+    def addCallback(self, callback: Callable[[str, int, int], None]):
+        self.callbacks.append(callback)
+
+    def removeCallback(self, callback: Callable[[str, int, int], None]):
+        self.callbacks.remove(callback)
+
+    def record(self, stage: str, nanoseconds: int, samples: int = 1):
+        self.calls[stage] = self.calls.get(stage, 0) + 1
+        self.nanoseconds[stage] = self.nanoseconds.get(stage, 0) + nanoseconds
+        self.samples[stage] = self.samples.get(stage, 0) + samples
+        for callback in self.callbacks:
+            callback(stage, nanoseconds, samples)
+
+    @contextmanager
+    def measure(self, stage: str, samples: int = 1) -> Iterator[None]:
+        # Times the body as one call of the stage, any name can be used for stages of your own
+        start = time.perf_counter_ns()
+        try:
+            yield
+        finally:
+            self.record(stage, time.perf_counter_ns() - start, samples)
+
+    def recordRules(self, fired: int, samples: int = 1):
+        self.rulesFired += fired
+        self.ruleSamples += samples
+
+    def recordCache(self, hit: bool):
+        if hit:
+            self.cacheHits += 1
+        else:
+            self.cacheMisses += 1
+
+    def toDict(self) -> dict:
+        lookups = self.cacheHits + self.cacheMisses
+        return {
+            "stages": {
+                stage: {
+                    "calls": self.calls[stage],
+                    "samples": self.samples[stage],
+                    "seconds": self.nanoseconds[stage] / 1e9,
+                    "nsPerSample": self.nanoseconds[stage] / self.samples[stage] if self.samples[stage] else 0.0,
+                }
+                for stage in self.calls
+            },
+            "rulesFired": self.rulesFired,
+            "rulesFiredPerSample": self.rulesFired / self.ruleSamples if self.ruleSamples else 0.0,
+            "cacheHits": self.cacheHits,
+            "cacheMisses": self.cacheMisses,
+            "cacheHitRate": self.cacheHits / lookups if lookups else 0.0,
+        }
+
+    def toPrometheus(self, prefix: str = "fuzzy_engine") -> str:
+        # The Prometheus text exposition format
+        lines = []
+
+        def metric(name: str, type: str, help: str, values: list[tuple[str, float]]):
+            lines.append(f"# HELP {prefix}_{name} {help}")
+            lines.append(f"# TYPE {prefix}_{name} {type}")
+            for labels, value in values:
+                lines.append(f"{prefix}_{name}{labels} {value!r}")
+
+        metric("stage_seconds_total", "counter", "Time spent in each stage.",
+               [(f'{{stage="{stage}"}}', self.nanoseconds[stage] / 1e9) for stage in self.calls])
+        metric("stage_calls_total", "counter", "Calls of each stage.",
+               [(f'{{stage="{stage}"}}', self.calls[stage]) for stage in self.calls])
+        metric("stage_samples_total", "counter", "Inputs that went through each stage.",
+               [(f'{{stage="{stage}"}}', self.samples[stage]) for stage in self.calls])
+        metric("rules_fired_total", "counter", "Rules that fired with a non-zero strength.", [("", self.rulesFired)])
+        metric("rule_samples_total", "counter", "Inputs whose fired rules were counted.", [("", self.ruleSamples)])
+        metric("cache_hits_total", "counter", "Inputs answered from the cache.", [("", self.cacheHits)])
+        metric("cache_misses_total", "counter", "Inputs that had to be evaluated.", [("", self.cacheMisses)])
+        return "\n".join(lines) + "\n"
@@ -0,0 +1,89 @@
+import sys
+
+import numpy as np
+
+from data.fuzzy_set import FuzzySet
+
+# Default upper bound on the memory all lookup tables of one system may use
+MAX_LOOKUP_TABLE_BYTES = 64 * 1024 * 1024
+
+
+def getLookupTableBytes(sets: list[FuzzySet], limits: tuple[float, float], resolution: float,
+                        interpolate: bool = False) -> int:
+    # Each table is a float64 array plus the row lists the scalar path reads from,
+    # interpolation keeps two more tables with the one-sided limits of every cell
+    size = int(round((limits[1] - limits[0]) / resolution)) + 1
+    tables = 3 if interpolate else 1
+    return tables * size * (len(sets) * 8 + sys.getsizeof([0.0] * len(sets)) + 24 * len(sets))
+
+
+class MembershipTable:
+    # Membership degrees of a variable's sets sampled every `resolution` units across its limits
+
+    def __init__(self, sets: list[FuzzySet], limits: tuple[float, float], resolution: float = 1,
+                 interpolate: bool = False, maxBytes: int = MAX_LOOKUP_TABLE_BYTES) -> None:
+        if resolution <= 0:
+            raise Exception("Lookup table resolution must be positive")
+
+        self.nbytes = getLookupTableBytes(sets, limits, resolution, interpolate)
+        if self.nbytes > maxBytes:
+            raise Exception(f"Lookup table needs {self.nbytes} bytes, more than the {maxBytes} allowed")
+
+        self.start = limits[0]
+        self.resolution = resolution
+        self.interpolate = interpolate
+        self.size = int(round((limits[1] - limits[0]) / resolution)) + 1
+        self._scale = 1 / resolution
+
+        points = np.minimum(self.start + np.arange(self.size) * resolution, limits[1])
+        self.table = self._sample(sets, points)
+        self._rows = self.table.tolist()
+
+        if interpolate:
+            # Memberships jump at shoulders (x <= a is 0 even when a == b), so every cell
+            # interpolates between the limits taken from inside it, not the grid values
+            self._low = self._sample(sets, np.nextafter(points[:-1], points[1:]))
+            self._high = self._sample(sets, np.nextafter(points[1:], points[:-1]))
+            self._lowRows = self._low.tolist()
+            self._highRows = self._high.tolist()
+
+    def _sample(self, sets: list[FuzzySet], points: np.ndarray) -> np.ndarray:
+        if not sets:
+            return np.zeros((len(points), 0))
+        return np.stack([set.getMembershipBatch(points) for set in sets], axis=1)
+
+    def lookup(self, x: float) -> list[float]:
+        # Inputs outside the limits read the nearest edge of the table
+        position = (x - self.start) * self._scale
+        last = self.size - 1
+
+        if not self.interpolate:
+            return self._rows[min(max(int(position + 0.5), 0), last)]
+
+        if position <= 0:
+            return self._rows[0]
+        if position >= last:
+            return self._rows[last]
+
+        i = int(position)
+        t = position - i
+        if t == 0:
+            return self._rows[i]
+        return [low + (high - low) * t for low, high in zip(self._lowRows[i], self._highRows[i])]
+
+    def lookupBatch(self, x: np.ndarray) -> np.ndarray:
+        position = np.clip((x - self.start) * self._scale, 0, self.size - 1)
+
+        if not self.interpolate or self.size == 1:
+            return self.table[np.floor(position + 0.5).astype(np.intp)]
+
+        i = np.minimum(position.astype(np.intp), self.size - 2)
+        t = position - i
+        result = self._low[i] + (self._high[i] - self._low[i]) * t[:, None]
+
+        # Inputs exactly on a grid point (including both limits) read the table itself
+        onGrid = t == 0
+        result[onGrid] = self.table[i[onGrid]]
+        last = position == self.size - 1
+        result[last] = self.table[-1]
+        return result
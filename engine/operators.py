@@ -0,0 +1,95 @@
+from typing import Callable
+
+import numpy as np
+
+MINIMUM = "MINIMUM"
+MAXIMUM = "MAXIMUM"
+PRODUCT = "PRODUCT"
+PROBABILISTIC_SUM = "PROBABILISTIC_SUM"
+# Lukasiewicz t-norm max(0, a + b - 1) and its s-norm, the bounded sum min(1, a + b)
+LUKASIEWICZ = "LUKASIEWICZ"
+DRASTIC = "DRASTIC"
+
+
+class Operator:
+    # A binary fuzzy operator as a scalar function for single inputs and a NumPy kernel for
+    # batches. The kernel is called as batch(a, b, out=out) and writes into out, which may be the
+    # same array as a or b.
+
+    def __init__(self, name: str, scalar: Callable[[float, float], float],
+                 batch: Callable[[np.ndarray, np.ndarray, np.ndarray], np.ndarray]) -> None:
+        self.name = name
+        self.scalar = scalar
+        self.batch = batch
+
+
+def _probabilisticSum(a: np.ndarray, b: np.ndarray, out: np.ndarray) -> np.ndarray:
+    # Same order of operations as the scalar version, with a + b computed before out is written
+    product = a * b
+    np.add(a, b, out=out)
+    return np.subtract(out, product, out=out)
+
+
+def _lukasiewiczTNorm(a: np.ndarray, b: np.ndarray, out: np.ndarray) -> np.ndarray:
+    np.add(a, b, out=out)
+    np.subtract(out, 1, out=out)
+    return np.maximum(out, 0, out=out)
+
+
+def _lukasiewiczSNorm(a: np.ndarray, b: np.ndarray, out: np.ndarray) -> np.ndarray:
+    np.add(a, b, out=out)
+    return np.minimum(out, 1, out=out)
+
+
+def _drasticTNorm(a: np.ndarray, b: np.ndarray, out: np.ndarray) -> np.ndarray:
+    out[...] = np.where(a == 1, b, np.where(b == 1, a, 0))
+    return out
+
+
+def _drasticSNorm(a: np.ndarray, b: np.ndarray, out: np.ndarray) -> np.ndarray:
+    out[...] = np.where(a == 0, b, np.where(b == 0, a, 1))
+    return out
+
+
+# Fuzzy "and"
+T_NORMS: dict[str, Operator] = {}
+# Fuzzy "or", also used to aggregate the rules that fire the same output set
+S_NORMS: dict[str, Operator] = {}
+
+
+def registerTNorm(name: str, scalar: Callable[[float, float], float],
+                  batch: Callable[[np.ndarray, np.ndarray, np.ndarray], np.ndarray]):
+    T_NORMS[name] = Operator(name, scalar, batch)
+
+
+def registerSNorm(name: str, scalar: Callable[[float, float], float],
+                  batch: Callable[[np.ndarray, np.ndarray, np.ndarray], np.ndarray]):
+    S_NORMS[name] = Operator(name, scalar, batch)
+
+
+def getTNorm(name: str) -> Operator:
+    if name not in T_NORMS:
+        raise Exception(f"Unknown t-norm '{name}'")
+    return T_NORMS[name]
+
+
+def getSNorm(name: str) -> Operator:
+    if name not in S_NORMS:
+        raise Exception(f"Unknown s-norm '{name}'")
+    return S_NORMS[name]
+
+
+# The builtin min and max give the same results as the original engine and are the fastest on floats
+registerTNorm(MINIMUM, min, np.minimum)
+registerTNorm(PRODUCT, lambda a, b: a * b, np.multiply)
+registerTNorm(LUKASIEWICZ, lambda a, b: max(0.0, a + b - 1), _lukasiewiczTNorm)
+registerTNorm(DRASTIC, lambda a, b: b if a == 1 else a if b == 1 else 0.0, _drasticTNorm)
+
+registerSNorm(MAXIMUM, max, np.maximum)
+registerSNorm(PROBABILISTIC_SUM, lambda a, b: a + b - a * b, _probabilisticSum)
+registerSNorm(LUKASIEWICZ, lambda a, b: min(1.0, a + b), _lukasiewiczSNorm)
+registerSNorm(DRASTIC, lambda a, b: b if a == 0 else a if b == 0 else 1.0, _drasticSNorm)
+
+# How a rule's strength shapes its output set: clipping it (Mamdani) or scaling it (Larsen).
+# This only changes the output shape, so it only matters to the exact defuzzification methods.
+IMPLICATIONS = [MINIMUM, PRODUCT]
@@ -0,0 +1,103 @@
+import multiprocessing
+import os
+from multiprocessing import resource_tracker
+from multiprocessing.shared_memory import SharedMemory
+
+import numpy as np
+
+from data.snapshot import SystemSnapshot
+from data.system import MAMDANI, System
+from data.variable import Variable
+from engine.engine import CompiledSystem
+
+# The system each worker process compiles once when it starts
+_system: CompiledSystem = None
+
+
+def _initializeWorker(snapshot: SystemSnapshot):
+    global _system
+    _system = CompiledSystem(snapshot.getVariables(), snapshot.getRules(), inference=snapshot.inference)
+
+
+def _evaluateChunk(task: tuple) -> int:
+    names, rows, inputCount, outputCount, start, end = task
+    memories = [SharedMemory(name=name) for name in names]
+    try:
+        inputs = np.ndarray((rows, inputCount), dtype=np.float64, buffer=memories[0].buf)
+        crisp = np.ndarray((rows, outputCount), dtype=np.float64, buffer=memories[1].buf)
+        dominant = np.ndarray((rows, outputCount), dtype=np.intp, buffer=memories[2].buf)
+
+        crisp[start:end], dominant[start:end] = _system.evaluateBatch(inputs[start:end])
+        del inputs, crisp, dominant
+    finally:
+        for memory in memories:
+            memory.close()
+
+    return end - start
+
+
+class ParallelEvaluator:
+    # Evaluates large input arrays across worker processes. The system is sent to each worker once,
+    # the rows go through shared memory and every chunk writes its results in place, so the output
+    # keeps the input order.
+
+    def __init__(self, variables: list[Variable], rules: list[str], workers: int | None = None,
+                 chunkSize: int = 65536, inference: str = MAMDANI) -> None:
+        if chunkSize <= 0:
+            raise Exception("Chunk size must be positive")
+
+        # Compiling here too reports errors in the rules before any worker starts
+        self.system = CompiledSystem(variables, rules, inference=inference)
+        self.chunkSize = chunkSize
+        self.workers = workers or multiprocessing.cpu_count()
+        # Workers get the system as a snapshot, a few arrays that pickle much smaller than the model objects
+        snapshot = SystemSnapshot(System(variables=variables, rules="\n".join(rules), inference=inference))
+        # The parent owns the shared blocks and unlinks them. Workers that attach register the blocks
+        # with a resource tracker too, which must be the parent's, started before them and inherited:
+        # a tracker of their own would unlink or complain about the blocks when they exit.
+        if os.name == "posix":
+            resource_tracker.ensure_running()
+        self._pool = multiprocessing.Pool(self.workers, initializer=_initializeWorker, initargs=(snapshot,))
+
+    def evaluateBatch(self, inputs: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+        inputs = np.ascontiguousarray(inputs, dtype=np.float64)
+        if inputs.ndim != 2 or inputs.shape[1] < len(self.system.inVariables):
+            raise Exception(f"Expected an (N, {len(self.system.inVariables)}) array of inputs")
+
+        rows, inputCount = inputs.shape
+        outputCount = len(self.system.outVariables)
+        if rows == 0:
+            return np.empty((0, outputCount)), np.empty((0, outputCount), dtype=np.intp)
+
+        memories = [
+            SharedMemory(create=True, size=inputs.nbytes),
+            SharedMemory(create=True, size=max(rows * outputCount * 8, 1)),
+            SharedMemory(create=True, size=max(rows * outputCount * np.dtype(np.intp).itemsize, 1)),
+        ]
+        try:
+            np.ndarray(inputs.shape, dtype=np.float64, buffer=memories[0].buf)[:] = inputs
+
+            names = [memory.name for memory in memories]
+            tasks = [(names, rows, inputCount, outputCount, start, min(start + self.chunkSize, rows))
+                     for start in range(0, rows, self.chunkSize)]
+            for _ in self._pool.imap_unordered(_evaluateChunk, tasks):
+                pass
+
+            crisp = np.ndarray((rows, outputCount), dtype=np.float64, buffer=memories[1].buf).copy()
+            dominant = np.ndarray((rows, outputCount), dtype=np.intp, buffer=memories[2].buf).copy()
+        finally:
+            for memory in memories:
+                memory.close()
+                memory.unlink()
+
+        return crisp, dominant
+
+    def close(self):
+        self._pool.close()
+        self._pool.join()
+
+    def __enter__(self) -> "ParallelEvaluator":
+        return self
+
+    def __exit__(self, *args):
+        self.close()
@@ -0,0 +1,254 @@
+import os
+import threading
+import time
+from collections import OrderedDict
+
+from data.system import loadSystem
+from engine.engine import CompiledSystem
+from engine.instrumentation import COMPILE, Instrumentation
+
+LOAD = "load"
+
+
+class _Entry:
+    __slots__ = ("systemId", "path", "signature", "system", "loadSeconds", "compileSeconds", "loadedAt",
+                 "checkedAt", "reloads", "error", "errorSignature")
+
+    def __init__(self, systemId: str, path: str) -> None:
+        self.systemId = systemId
+        self.path = path
+        self.signature = None
+        self.system = None
+        self.loadSeconds = 0.0
+        self.compileSeconds = 0.0
+        self.loadedAt = 0.0
+        self.checkedAt = 0.0
+        self.reloads = 0
+        # The last failed reload and the file it failed on, the entry keeps its previous system meanwhile
+        self.error = None
+        self.errorSignature = None
+
+
+def _getSignature(path: str) -> tuple[int, int]:
+    stat = os.stat(path)
+    return stat.st_mtime_ns, stat.st_size
+
+
+class SystemRegistry:
+    # Compiled systems by id, loaded from "<directory>/<id>.json" (or a registered path) on first use
+    # and kept in an LRU cache of at most maxSystems. A changed source file is recompiled and swapped
+    # in as a whole, so evaluations that already hold the old system finish on it undisturbed, and a
+    # file that fails to load leaves the previous system in service.
+
+    def __init__(self, directory: str = ".", maxSystems: int = 128, checkInterval: float | None = 1.0,
+                 instrumentation: Instrumentation | None = None, **compileOptions) -> None:
+        if maxSystems <= 0:
+            raise Exception("Registry size must be positive")
+
+        self.directory = directory
+        self.maxSystems = maxSystems
+        # How often get() looks at a system's file, None leaves it to the watcher or reload()
+        self.checkInterval = checkInterval
+        # Also records the load and compile stages when set, and is passed to every compiled system
+        self.instrumentation = instrumentation
+        # Passed to CompiledSystem, like defuzzification or andMethod
+        self.compileOptions = compileOptions
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.reloads = 0
+        self.reloadErrors = 0
+
+        self._paths: dict[str, str] = {}
+        self._entries: OrderedDict[str, _Entry] = OrderedDict()
+        self._lock = threading.Lock()
+        self._loadLocks: dict[str, threading.Lock] = {}
+        self._watcher: threading.Thread | None = None
+        self._stopWatching = threading.Event()
+
+    def register(self, systemId: str, path: str):
+        # Serve systemId from a file outside the directory
+        with self._lock:
+            self._paths[systemId] = path
+
+    def getPath(self, systemId: str) -> str:
+        if systemId in self._paths:
+            return self._paths[systemId]
+        if not systemId or systemId in (".", "..") or "/" in systemId or os.sep in systemId:
+            raise Exception(f"Invalid system id '{systemId}'")
+        return os.path.join(self.directory, f"{systemId}.json")
+
+    def get(self, systemId: str) -> CompiledSystem:
+        with self._lock:
+            entry = self._entries.get(systemId)
+            if entry is not None:
+                self._entries.move_to_end(systemId)
+                self.hits += 1
+            else:
+                self.misses += 1
+
+        if entry is None:
+            return self._load(systemId).system
+
+        if self.checkInterval is not None and time.monotonic() - entry.checkedAt >= self.checkInterval:
+            self._refresh(entry)
+        return entry.system
+
+    def evaluate(self, systemId: str, input: list[float]) -> list[tuple[float, str]]:
+        return self.get(systemId).evaluate(input)
+
+    def evaluateBatch(self, systemId: str, inputs):
+        return self.get(systemId).evaluateBatch(inputs)
+
+    def _getLoadLock(self, systemId: str) -> threading.Lock:
+        with self._lock:
+            return self._loadLocks.setdefault(systemId, threading.Lock())
+
+    def _compile(self, entry: _Entry):
+        # Builds everything aside and only then replaces the entry's system, readers see either one
+        signature = _getSignature(entry.path)
+
+        start = time.perf_counter_ns()
+        project = loadSystem(entry.path)
+        loaded = time.perf_counter_ns()
+        system = CompiledSystem(project.variables, project.getRules(), inference=project.inference,
+                                instrumentation=self.instrumentation, **self.compileOptions)
+        compiled = time.perf_counter_ns()
+
+        if self.instrumentation is not None:
+            self.instrumentation.record(LOAD, loaded - start)
+            self.instrumentation.record(COMPILE, compiled - loaded)
+
+        entry.system = system
+        entry.signature = signature
+        entry.loadSeconds = (loaded - start) / 1e9
+        entry.compileSeconds = (compiled - loaded) / 1e9
+        entry.loadedAt = time.time()
+        entry.checkedAt = time.monotonic()
+        entry.error = None
+
+    def _load(self, systemId: str) -> _Entry:
+        # Requests for the same system wait for one compilation, other systems go on meanwhile
+        with self._getLoadLock(systemId):
+            with self._lock:
+                entry = self._entries.get(systemId)
+            if entry is not None:
+                return entry
+
+            entry = _Entry(systemId, self.getPath(systemId))
+            self._compile(entry)
+
+            with self._lock:
+                self._entries[systemId] = entry
+                while len(self._entries) > self.maxSystems:
+                    evicted, _ = self._entries.popitem(last=False)
+                    self._loadLocks.pop(evicted, None)
+                    self.evictions += 1
+            return entry
+
+    def _refresh(self, entry: _Entry, force: bool = False) -> bool:
+        lock = self._getLoadLock(entry.systemId)
+        # Someone else is already reloading it, keep serving the current system
+        if not lock.acquire(blocking=False):
+            return False
+        try:
+            entry.checkedAt = time.monotonic()
+            signature = None
+            try:
+                signature = _getSignature(entry.path)
+                if not force and signature in (entry.signature, entry.errorSignature):
+                    return False
+                self._compile(entry)
+            except Exception as e:
+                # Typically a file caught half written. It's only tried again once it changes.
+                entry.error = str(e)
+                entry.errorSignature = signature
+                self.reloadErrors += 1
+                return False
+
+            entry.reloads += 1
+            self.reloads += 1
+            return True
+        finally:
+            lock.release()
+
+    def reload(self, systemId: str | None = None, force: bool = False) -> list[str]:
+        # Checks one or all cached systems now and returns the ids that were recompiled
+        with self._lock:
+            entries = [self._entries[systemId]] if systemId in self._entries else \
+                list(self._entries.values()) if systemId is None else []
+        return [entry.systemId for entry in entries if self._refresh(entry, force)]
+
+    def evict(self, systemId: str) -> bool:
+        with self._lock:
+            self._loadLocks.pop(systemId, None)
+            return self._entries.pop(systemId, None) is not None
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._loadLocks.clear()
+
+    def startWatching(self, interval: float = 1.0):
+        # Polls the files of cached systems from a background thread, so get() never waits for a
+        # recompilation. get() stops checking files itself while this runs.
+        if self._watcher is not None:
+            return
+        self.checkInterval = None
+        self._stopWatching.clear()
+
+        def watch():
+            while not self._stopWatching.wait(interval):
+                self.reload()
+
+        self._watcher = threading.Thread(target=watch, name="SystemRegistry watcher", daemon=True)
+        self._watcher.start()
+
+    def stopWatching(self):
+        if self._watcher is None:
+            return
+        self._stopWatching.set()
+        self._watcher.join()
+        self._watcher = None
+
+    def close(self):
+        self.stopWatching()
+
+    def __enter__(self) -> "SystemRegistry":
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def __contains__(self, systemId: str) -> bool:
+        return systemId in self._entries
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def getStats(self) -> dict:
+        lookups = self.hits + self.misses
+        with self._lock:
+            entries = list(self._entries.values())
+        return {
+            "size": len(entries),
+            "maxSystems": self.maxSystems,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "reloads": self.reloads,
+            "reloadErrors": self.reloadErrors,
+            "hitRate": self.hits / lookups if lookups else 0.0,
+            "systems": {
+                entry.systemId: {
+                    "path": entry.path,
+                    "loadMs": entry.loadSeconds * 1e3,
+                    "compileMs": entry.compileSeconds * 1e3,
+                    "loadedAt": entry.loadedAt,
+                    "reloads": entry.reloads,
+                    "error": entry.error,
+                }
+                for entry in entries
+            },
+        }
@@ -0,0 +1,277 @@
+import asyncio
+import json
+import math
+import time
+from collections import deque
+
+import numpy as np
+
+from engine.engine import CompiledSystem
+
+MAX_BODY_BYTES = 16 * 1024 * 1024
+MAX_HEADERS = 100
+# Latencies kept for the percentiles, older ones are dropped
+LATENCY_SAMPLES = 10000
+
+REASONS = {200: "OK", 400: "Bad Request", 404: "Not Found", 405: "Method Not Allowed", 411: "Length Required",
+           413: "Payload Too Large", 431: "Request Header Fields Too Large", 500: "Internal Server Error"}
+
+
+class HttpError(Exception):
+    def __init__(self, status: int, message: str) -> None:
+        super().__init__(message)
+        self.status = status
+
+
+def parseRow(row, names: list[str]) -> list[float]:
+    # Either a list of inputs in order or an object keyed by input name, like NDJSON input rows
+    try:
+        if isinstance(row, dict):
+            return [float(row[name]) for name in names]
+        if isinstance(row, list) and len(row) >= len(names):
+            return [float(x) for x in row[:len(names)]]
+    except KeyError as e:
+        raise HttpError(400, f"Missing input {e}")
+    except (TypeError, ValueError):
+        raise HttpError(400, "Inputs must be numbers")
+    raise HttpError(400, f"Expected a list of {len(names)} inputs or an object keyed by input name")
+
+
+def getRecord(system: CompiledSystem, crisp: np.ndarray, dominant: np.ndarray) -> dict:
+    # One row of results, with nulls for outputs where no rule fired
+    record = {}
+    for j, (variable, value, set) in enumerate(zip(system.outVariables, crisp.tolist(), dominant.tolist())):
+        isNan = math.isnan(value)
+        record[variable.name] = None if isNan else value
+        record[f"{variable.name}_set"] = None if isNan else system.outSetNames[j][set]
+    return record
+
+
+class MicroBatcher:
+    # Coalesces the rows submitted within `window` seconds of the first pending one into a single
+    # evaluateBatch call, or fewer seconds once maxRows are pending. Rows evaluate the same in a
+    # batch as on their own, so callers can't tell.
+
+    def __init__(self, system: CompiledSystem, window: float = 0.002, maxRows: int = 1024) -> None:
+        self.system = system
+        self.window = window
+        self.maxRows = maxRows
+        self.batches = 0
+        self.rows = 0
+        self._pending: list[tuple[list[float], asyncio.Future]] = []
+        self._timer: asyncio.TimerHandle | None = None
+
+    async def submit(self, row: list[float]) -> tuple[np.ndarray, np.ndarray]:
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._pending.append((row, future))
+        if len(self._pending) >= self.maxRows:
+            self.flush()
+        elif self._timer is None:
+            self._timer = loop.call_later(self.window, self.flush)
+        return await future
+
+    def flush(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        pending, self._pending = self._pending, []
+        if not pending:
+            return
+
+        self.batches += 1
+        self.rows += len(pending)
+        try:
+            crisp, dominant = self.system.evaluateBatch(np.array([row for row, _ in pending], dtype=float))
+        except Exception as e:
+            for _, future in pending:
+                if not future.done():
+                    future.set_exception(e)
+            return
+
+        for i, (_, future) in enumerate(pending):
+            # The client may have gone away meanwhile
+            if not future.done():
+                future.set_result((crisp[i], dominant[i]))
+
+
+class ScoringServer:
+    # A small HTTP/1.1 JSON service for one compiled system:
+    #   POST /score   one row (a list or an object) answers one record, and concurrent ones are micro-batched,
+    #                 a list of rows answers a list of records and is evaluated as a batch right away
+    #   GET /stats    request counts, batching and latency percentiles
+    #   GET /health   always {"status": "ok"}
+
+    def __init__(self, system: CompiledSystem, batchWindow: float = 0.002, maxBatchRows: int = 1024,
+                 maxBodyBytes: int = MAX_BODY_BYTES) -> None:
+        self.system = system
+        self.names = [x.name for x in system.inVariables]
+        self.batcher = MicroBatcher(system, batchWindow, maxBatchRows)
+        self.maxBodyBytes = maxBodyBytes
+
+        self.requests = 0
+        self.errors = 0
+        self.rows = 0
+        # Seconds from a request being read to its response being ready
+        self.latencies: deque[float] = deque(maxlen=LATENCY_SAMPLES)
+        self._server: asyncio.Server | None = None
+        # The writer of every open connection, by the task serving it
+        self._connections: dict[asyncio.Task, asyncio.StreamWriter] = {}
+
+    async def start(self, host: str = "127.0.0.1", port: int = 8080) -> int:
+        # Returns the port, which is picked by the system when port is 0
+        self._server = await asyncio.start_server(self._serveConnection, host, port)
+        return self._server.sockets[0].getsockname()[1]
+
+    async def serveForever(self):
+        async with self._server:
+            await self._server.serve_forever()
+
+    async def close(self):
+        if self._server is not None:
+            self._server.close()
+            # Open keep-alive connections are closed too, so their handlers finish instead of being cancelled
+            for writer in self._connections.values():
+                writer.close()
+            if self._connections:
+                await asyncio.wait(list(self._connections))
+            await self._server.wait_closed()
+            self._server = None
+        self.batcher.flush()
+
+    async def _readLine(self, reader: asyncio.StreamReader, status: int, message: str) -> bytes:
+        # A line longer than the reader's limit can't be read, and the connection is closed after the answer
+        try:
+            return await reader.readline()
+        except (ValueError, asyncio.LimitOverrunError):
+            raise HttpError(status, message)
+
+    async def _readRequest(self, reader: asyncio.StreamReader) -> tuple[str, str, dict, bytes] | None:
+        line = await self._readLine(reader, 400, "Request line too long")
+        if not line:
+            return None
+        parts = line.decode("latin-1").split()
+        if len(parts) != 3:
+            raise HttpError(400, "Malformed request line")
+        method, path, version = parts
+
+        headers = {"version": version}
+        for _ in range(MAX_HEADERS + 1):
+            line = await self._readLine(reader, 431, "Header line too long")
+            if line in (b"\r\n", b"\n", b""):
+                break
+            name, _, value = line.decode("latin-1").partition(":")
+            headers[name.strip().lower()] = value.strip()
+        else:
+            raise HttpError(431, f"At most {MAX_HEADERS} headers are allowed")
+
+        body = b""
+        if method == "POST":
+            if "content-length" not in headers:
+                raise HttpError(411, "Content-Length is required")
+            try:
+                length = int(headers["content-length"])
+            except ValueError:
+                raise HttpError(400, "Invalid Content-Length")
+            if length < 0:
+                raise HttpError(400, "Invalid Content-Length")
+            if length > self.maxBodyBytes:
+                raise HttpError(413, f"Bodies are limited to {self.maxBodyBytes} bytes")
+            body = await reader.readexactly(length)
+        return method, path.split("?")[0], headers, body
+
+    async def _serveConnection(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        task = asyncio.current_task()
+        self._connections[task] = writer
+        try:
+            while True:
+                keepAlive = False
+                try:
+                    request = await self._readRequest(reader)
+                    if request is None:
+                        break
+                    method, path, headers, body = request
+                    connection = headers.get("connection", "").lower()
+                    keepAlive = connection == "keep-alive" if headers["version"] == "HTTP/1.0" else connection != "close"
+
+                    start = time.perf_counter()
+                    status, payload = 200, await self._route(method, path, body)
+                    self.latencies.append(time.perf_counter() - start)
+                except HttpError as e:
+                    status, payload = e.status, {"error": str(e)}
+                except Exception as e:
+                    status, payload = 500, {"error": str(e)}
+                self.requests += 1
+                if status != 200:
+                    self.errors += 1
+
+                data = json.dumps(payload).encode()
+                writer.write(f"HTTP/1.1 {status} {REASONS[status]}\r\nContent-Type: application/json\r\n"
+                             f"Content-Length: {len(data)}\r\nConnection: {'keep-alive' if keepAlive else 'close'}"
+                             "\r\n\r\n".encode() + data)
+                await writer.drain()
+                if not keepAlive:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            del self._connections[task]
+            # A cancelled connection still closes, then the cancellation goes on to the caller
+            writer.close()
+            try:
+                await writer.wait_closed()
+            except ConnectionError:
+                pass
+
+    async def _route(self, method: str, path: str, body: bytes):
+        if path == "/score":
+            if method != "POST":
+                raise HttpError(405, "Use POST")
+            return await self._score(body)
+        if path in ("/stats", "/health"):
+            if method != "GET":
+                raise HttpError(405, "Use GET")
+            return self.getStats() if path == "/stats" else {"status": "ok"}
+        raise HttpError(404, f"Unknown path '{path}'")
+
+    async def _score(self, body: bytes):
+        try:
+            request = json.loads(body)
+        except ValueError as e:
+            raise HttpError(400, f"Invalid JSON: {e}")
+
+        if isinstance(request, list) and (not request or isinstance(request[0], (list, dict))):
+            # Bodies can hold millions of rows, which are scored off the event loop so other connections
+            # and the micro-batches aren't held up
+            self.rows += len(request)
+            return await asyncio.get_running_loop().run_in_executor(None, self._scoreRows, request)
+
+        row = parseRow(request, self.names)
+        self.rows += 1
+        crisp, dominant = await self.batcher.submit(row)
+        return getRecord(self.system, crisp, dominant)
+
+    def _scoreRows(self, request: list) -> list[dict]:
+        rows = [parseRow(x, self.names) for x in request]
+        if not rows:
+            return []
+        crisp, dominant = self.system.evaluateBatch(np.array(rows, dtype=float))
+        return [getRecord(self.system, crisp[i], dominant[i]) for i in range(len(rows))]
+
+    def getStats(self) -> dict:
+        latencies = np.array(self.latencies) * 1e3
+        percentiles = np.percentile(latencies, [50, 99]).tolist() if len(latencies) else [0.0, 0.0]
+        return {
+            "requests": self.requests,
+            "errors": self.errors,
+            "rows": self.rows,
+            "microBatches": self.batcher.batches,
+            "microBatchedRows": self.batcher.rows,
+            "meanMicroBatchRows": self.batcher.rows / self.batcher.batches if self.batcher.batches else 0.0,
+            "latencyMs": {
+                "samples": len(latencies),
+                "p50": percentiles[0],
+                "p99": percentiles[1],
+                "max": float(latencies.max()) if len(latencies) else 0.0,
+            },
+        }
@@ -0,0 +1,113 @@
+import asyncio
+import math
+from typing import AsyncIterable, AsyncIterator, Iterable, Iterator
+
+import numpy as np
+
+from engine.engine import CompiledSystem
+
+DEFAULT_BATCH_SIZE = 1024
+
+
+def _toRow(row, names: list[str]) -> list[float]:
+    # Either a sequence of inputs in order or a mapping keyed by input name
+    if isinstance(row, dict):
+        return [float(row[name]) for name in names]
+    return [float(x) for x in row[:len(names)]]
+
+
+def batched(rows: Iterable, size: int) -> Iterator[list]:
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) == size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def getResults(system: CompiledSystem, crisp: np.ndarray, dominant: np.ndarray) -> list[list[tuple[float, str | None]]]:
+    # Results of a batch in the form evaluate() gives them, with NaN and no set for outputs where no rule fired
+    names = system.outSetNames
+    return [[(value, names[j][set] if not math.isnan(value) else None) for j, (value, set) in enumerate(zip(values, sets))]
+            for values, sets in zip(crisp.tolist(), dominant.tolist())]
+
+
+def streamBatches(system: CompiledSystem, rows: Iterable,
+                  batchSize: int = DEFAULT_BATCH_SIZE) -> Iterator[tuple[np.ndarray, np.ndarray]]:
+    # Crisp outputs and dominant set indices of every batchSize rows, like evaluateBatch() gives them.
+    # Rows are read as results are asked for, so only one batch is held at a time.
+    if batchSize <= 0:
+        raise Exception("Batch size must be positive")
+
+    names = [x.name for x in system.inVariables]
+    for batch in batched(rows, batchSize):
+        yield system.evaluateBatch(np.array([_toRow(row, names) for row in batch], dtype=float).reshape(-1, len(names)))
+
+
+def stream(system: CompiledSystem, rows: Iterable,
+           batchSize: int = DEFAULT_BATCH_SIZE) -> Iterator[list[tuple[float, str | None]]]:
+    # The result of every row, in order, evaluated batchSize rows at a time
+    for crisp, dominant in streamBatches(system, rows, batchSize):
+        yield from getResults(system, crisp, dominant)
+
+
+async def _iterate(rows: Iterable) -> AsyncIterator:
+    for row in rows:
+        yield row
+
+
+async def streamBatchesAsync(system: CompiledSystem, rows: AsyncIterable | Iterable, batchSize: int = DEFAULT_BATCH_SIZE,
+                             maxDelay: float | None = None) -> AsyncIterator[tuple[np.ndarray, np.ndarray]]:
+    # streamBatches() for async sources. A batch is evaluated once batchSize rows are in, or maxDelay
+    # seconds after its first row came in when given, so a slow feed doesn't hold results back. The
+    # next row is only awaited when the consumer asks for more, which leaves backpressure to the source.
+    if batchSize <= 0:
+        raise Exception("Batch size must be positive")
+    if maxDelay is not None and maxDelay < 0:
+        raise Exception("Maximum delay can't be negative")
+
+    names = [x.name for x in system.inVariables]
+    iterator = aiter(rows) if isinstance(rows, AsyncIterable) else _iterate(rows)
+    loop = asyncio.get_running_loop()
+    batch = []
+    deadline = None
+    pending = None
+    try:
+        while True:
+            if pending is None:
+                pending = asyncio.ensure_future(anext(iterator))
+            timeout = None if deadline is None else max(deadline - loop.time(), 0)
+            done, _ = await asyncio.wait((pending,), timeout=timeout)
+
+            if done:
+                try:
+                    row = pending.result()
+                except StopAsyncIteration:
+                    break
+                finally:
+                    pending = None
+                if not batch and maxDelay is not None:
+                    deadline = loop.time() + maxDelay
+                batch.append(_toRow(row, names))
+                if len(batch) < batchSize:
+                    continue
+
+            # Full, or the delay ran out, the row being awaited goes in the next batch
+            full, batch, deadline = batch, [], None
+            yield system.evaluateBatch(np.array(full, dtype=float).reshape(-1, len(names)))
+
+        if batch:
+            yield system.evaluateBatch(np.array(batch, dtype=float).reshape(-1, len(names)))
+    finally:
+        if pending is not None:
+            pending.cancel()
+
+
+async def streamAsync(system: CompiledSystem, rows: AsyncIterable | Iterable, batchSize: int = DEFAULT_BATCH_SIZE,
+                      maxDelay: float | None = None) -> AsyncIterator[list[tuple[float, str | None]]]:
+    # stream() for async sources, batched like streamBatchesAsync()
+    async for crisp, dominant in streamBatchesAsync(system, rows, batchSize, maxDelay):
+        for result in getResults(system, crisp, dominant):
+            yield result
@@ -0,0 +1,76 @@
+from bisect import bisect_right
+
+import numpy as np
+
+from data.fuzzy_set import FuzzySet
+
+
+class SupportIndex:
+    # The supports (a, d) of a variable's sets cut its axis into intervals at every a and d, and an
+    # input can only have a non-zero membership in the sets covering its interval. A binary search
+    # finds the interval, so a variable with many sets only evaluates the couple that overlap there.
+
+    def __init__(self, sets: list[FuzzySet]) -> None:
+        self.size = len(sets)
+        self._memberships = [set.getMembershipFunction() for set in sets]
+        corners = [set.getCorners() for set in sets]
+
+        self.breakpoints = sorted({x for a, _, _, d in corners for x in (a, d)})
+        # Interval i lies between breakpoints i - 1 and i. Membership is 0 at x <= a and x >= d,
+        # so a set covers an interval when its open support does.
+        self._active = []
+        for i in range(len(self.breakpoints) + 1):
+            low = self.breakpoints[i - 1] if i > 0 else -np.inf
+            high = self.breakpoints[i] if i < len(self.breakpoints) else np.inf
+            self._active.append(tuple(j for j, (a, _, _, d) in enumerate(corners) if a <= low and high <= d))
+        self.depth = max((len(x) for x in self._active), default=0)
+
+        # The same as an (interval, depth) array for batches. Intervals with fewer sets are padded with
+        # an extra set whose support is empty, and its column is dropped at the end.
+        self._activeSets = np.full((len(self._active), self.depth), self.size, dtype=np.intp)
+        for i, active in enumerate(self._active):
+            self._activeSets[i, :len(active)] = active
+        self._active = [tuple((j, self._memberships[j]) for j in active) for active in self._active]
+        padded = np.vstack([np.array(corners, dtype=float).reshape(-1, 4), np.full((1, 4), np.inf)])
+        self._a, self._b, self._c, self._d = (np.ascontiguousarray(x) for x in padded.T)
+
+    def lookup(self, x: float) -> list[float]:
+        if x != x:
+            # NaN sorts nowhere, and every membership of it is NaN
+            return [membership(x) for membership in self._memberships]
+
+        result = [0] * self.size
+        for j, membership in self._active[bisect_right(self.breakpoints, x)]:
+            result[j] = membership(x)
+        return result
+
+    def lookupSparse(self, x: float) -> list[tuple[int, float]]:
+        # (set, membership) of the sets the input is in, in set order
+        if x != x:
+            return [(j, membership(x)) for j, membership in enumerate(self._memberships)]
+
+        result = []
+        for j, membership in self._active[bisect_right(self.breakpoints, x)]:
+            value = membership(x)
+            if value:
+                result.append((j, value))
+        return result
+
+    def lookupBatch(self, x: np.ndarray) -> np.ndarray:
+        width = self.size + 1
+        result = np.zeros((len(x), width))
+        intervals = np.searchsorted(self.breakpoints, x, side="right")
+        rows = np.arange(0, len(x) * width, width)
+
+        # One pass per overlapping set instead of one per set, with the corners of each row's set
+        # gathered and the same arithmetic as FuzzySet.getMembershipBatch
+        for k in range(self.depth):
+            sets = self._activeSets[intervals, k]
+            a, b, c, d = self._a[sets], self._b[sets], self._c[sets], self._d[sets]
+            with np.errstate(divide="ignore", invalid="ignore"):
+                values = np.where(x <= b, (x - a) / (b - a), np.where(x <= c, 1.0, 1 - (x - c) / (d - c)))
+            result.ravel()[rows + sets] = np.where((x <= a) | (x >= d), 0.0, values)
+
+        result = result[:, :self.size]
+        result[np.isnan(x)] = np.nan
+        return result
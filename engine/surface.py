@@ -0,0 +1,143 @@
+import itertools
+
+import numpy as np
+
+from engine.engine import CompiledSystem
+
+# Default upper bound on the memory of one precomputed surface
+MAX_SURFACE_BYTES = 256 * 1024 * 1024
+
+
+class ControlSurface:
+    # Crisp outputs of a system sampled on a regular grid over its input limits,
+    # answered by multilinear interpolation between the grid points.
+    # estimatedMaxError is the largest interpolation error found at sampled points, per output. It is
+    # an estimate, not a bound: other inputs can be further off.
+
+    def __init__(self, starts: np.ndarray, steps: np.ndarray, values: np.ndarray, outputNames: list[str],
+                 estimatedMaxError: np.ndarray) -> None:
+        self.starts = np.asarray(starts, dtype=float)
+        self.steps = np.asarray(steps, dtype=float)
+        self.values = np.asarray(values, dtype=float)
+        self.outputNames = list(outputNames)
+        self.estimatedMaxError = np.asarray(estimatedMaxError, dtype=float)
+
+        self.points = self.values.shape[:-1]
+        self._flat = self.values.reshape(-1, self.values.shape[-1])
+        self._rows = self._flat.tolist()
+        self._axes = list(zip(self.starts.tolist(), self.steps.tolist(), self.points))
+        self._strides = [int(np.prod(self.points[i + 1:])) for i in range(len(self.points))]
+        self._corners = list(itertools.product((0, 1), repeat=len(self.points)))
+        self._cornerOffsets = [sum(bit * stride for bit, stride in zip(corner, self._strides)) for corner in self._corners]
+
+    @staticmethod
+    def build(system: CompiledSystem, points: int | list[int] = 101, errorSamples: int = 10000,
+              maxBytes: int = MAX_SURFACE_BYTES) -> "ControlSurface":
+        variables = system.inVariables
+        if isinstance(points, int):
+            points = [points] * len(variables)
+        if len(points) != len(variables):
+            raise Exception(f"Expected grid points for {len(variables)} input variables")
+        if any(x < 2 for x in points):
+            raise Exception("Every input needs at least 2 grid points")
+
+        nbytes = int(np.prod(points)) * len(system.outVariables) * 8
+        if nbytes > maxBytes:
+            raise Exception(f"Surface needs {nbytes} bytes, more than the {maxBytes} allowed")
+
+        starts = np.array([x.limits[0] for x in variables], dtype=float)
+        ends = np.array([x.limits[1] for x in variables], dtype=float)
+        steps = (ends - starts) / (np.array(points) - 1)
+
+        # Memberships drop to 0 exactly on a set's outer corners, which often sit on the limits,
+        # so the outermost grid points are taken from just inside the range
+        axes = [np.minimum(start + np.arange(n) * step, end) for start, step, end, n in zip(starts, steps, ends, points)]
+        for axis in axes:
+            axis[0] = np.nextafter(axis[0], axis[1])
+            axis[-1] = np.nextafter(axis[-1], axis[-2])
+        grid = np.stack(np.meshgrid(*axes, indexing="ij"), axis=-1).reshape(-1, len(variables))
+        crisp, _ = system.evaluateBatch(grid)
+
+        values = crisp.reshape(*points, len(system.outVariables))
+        surface = ControlSurface(starts, steps, values, [x.name for x in system.outVariables],
+                                 np.zeros(len(system.outVariables)))
+        surface.estimatedMaxError = surface.estimateError(system, errorSamples)
+        return surface
+
+    def estimateError(self, system: CompiledSystem, samples: int = 0, seed: int = 0) -> np.ndarray:
+        # The largest interpolation error per output at the centre of every cell, where it tends to be
+        # largest, plus optional random points. Only these points are checked, so the error elsewhere
+        # can be larger.
+        centres = [self.starts[i] + (np.arange(n - 1) + 0.5) * self.steps[i] for i, n in enumerate(self.points)]
+        inputs = np.stack(np.meshgrid(*centres, indexing="ij"), axis=-1).reshape(-1, len(self.points))
+
+        if samples:
+            ends = self.starts + self.steps * (np.array(self.points) - 1)
+            random = np.random.default_rng(seed).uniform(self.starts, ends, (samples, len(self.points)))
+            inputs = np.concatenate([inputs, random])
+
+        exact, _ = system.evaluateBatch(inputs)
+        error = np.abs(self.queryBatch(inputs) - exact)
+
+        # Points where no rule fires have no exact answer to compare with
+        error[np.isnan(exact)] = 0
+        return np.nan_to_num(error, nan=np.inf).max(axis=0, initial=0)
+
+    def save(self, path: str):
+        np.savez(path, starts=self.starts, steps=self.steps, values=self.values,
+                 outputNames=np.array(self.outputNames), estimatedMaxError=self.estimatedMaxError)
+
+    @staticmethod
+    def load(path: str) -> "ControlSurface":
+        with np.load(path, allow_pickle=False) as data:
+            return ControlSurface(data["starts"], data["steps"], data["values"], data["outputNames"].tolist(),
+                                  data["estimatedMaxError"])
+
+    def query(self, input: list[float]) -> list[float]:
+        # Plain Python for single queries, NumPy call overhead would dominate here
+        base = 0
+        fractions = []
+        for x, (start, step, n), stride in zip(input, self._axes, self._strides):
+            position = min(max((x - start) / step, 0), n - 1)
+            i = min(int(position), n - 2)
+            base += i * stride
+            fractions.append(position - i)
+
+        result = [0.0] * len(self.outputNames)
+        totals = [0.0] * len(self.outputNames)
+        for corner, offset in zip(self._corners, self._cornerOffsets):
+            weight = 1.0
+            for bit, t in zip(corner, fractions):
+                weight *= t if bit else 1 - t
+            if weight:
+                for j, value in enumerate(self._rows[base + offset]):
+                    # value == value skips NaN corners, where no rule fires
+                    if value == value:
+                        result[j] += weight * value
+                        totals[j] += weight
+
+        return [x / total if total else float("nan") for x, total in zip(result, totals)]
+
+    def queryBatch(self, inputs: np.ndarray) -> np.ndarray:
+        inputs = np.asarray(inputs, dtype=float)
+        upper = np.array(self.points) - 1
+
+        position = np.clip((inputs[:, :len(self.points)] - self.starts) / self.steps, 0, upper)
+        i = np.minimum(position.astype(np.intp), upper - 1)
+        t = position - i
+        base = i @ np.array(self._strides)
+
+        result = np.zeros((len(inputs), len(self.outputNames)))
+        totals = np.zeros((len(inputs), len(self.outputNames)))
+        for corner, offset in zip(self._corners, self._cornerOffsets):
+            bits = np.array(corner)
+            weight = np.prod(np.where(bits, t, 1 - t), axis=1)[:, None]
+            values = self._flat[base + offset]
+
+            # Corners where no rule fires are left out and the others reweighted
+            weight = np.where(np.isnan(values), 0, weight)
+            result += np.where(weight == 0, 0, weight * values)
+            totals += weight
+
+        with np.errstate(divide="ignore", invalid="ignore"):
+            return np.where(totals == 0, np.nan, result / totals)
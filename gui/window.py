@@ -1,13 +1,13 @@
-import re
 import tkinter as tk
 from tkinter import messagebox
 import tkinter.ttk as ttk
 from tkinter import filedialog
 from typing import Literal
-import json
 
 from data.variable import *
 from data.fuzzy_set import *
+from data.rule import parseRules
+from data.system import MAMDANI, SUGENO, System, loadSystem, saveSystem
 from engine.engine import simulate
 from gui.visualizer import Visualizer
 
@@ -72,11 +72,16 @@ class Window:
 
         self._rulesEditor.delete("1.0", tk.END)
         self._rulesEditor.insert("1.0", "# Enter the rules in this format:\n" +
-                                        "# IN_variable set operator IN_variable set => OUT_variable set\n\n" +
+                                        "# IN_variable set operator IN_variable set => OUT_variable set\n" +
+                                        "# Conditions can be combined with and, or, not and parentheses,\n" +
+                                        "# several consequents are separated by commas and an optional\n" +
+                                        "# (weight) between 0 and 1 goes at the end:\n" +
+                                        "# a low and not (b high or c high) => x small, y large (0.5)\n\n" +
                                         "# Comments start with #\n")
 
         self._projectTitleEntry.delete(0, tk.END)
         self._projectDescriptionText.delete("1.0", tk.END)
+        self._inferenceCombobox.set(MAMDANI)
 
         self.selectVariable(None)
         self.selectFuzzySet(None, -1)
@@ -89,47 +94,36 @@ class Window:
         )
 
         if filename:
-            with open(filename, "r") as file:
-                data = json.load(file)
+            system = loadSystem(filename)
 
-                self._projectTitleEntry.delete(0, tk.END)
-                self._projectTitleEntry.insert(0, data["title"])
+            self._projectTitleEntry.delete(0, tk.END)
+            self._projectTitleEntry.insert(0, system.title)
 
-                self._projectDescriptionText.delete("1.0", tk.END)
-                self._projectDescriptionText.insert("1.0", data["description"])
+            self._projectDescriptionText.delete("1.0", tk.END)
+            self._projectDescriptionText.insert("1.0", system.description)
 
-                self._variables = []
-                for variableData in data["variables"]:
-                    variable = Variable(name=variableData["name"], limits=tuple(
-                        variableData["limits"]), type=variableData["type"])
-                    for fuzzySetData in variableData["fuzzySets"]:
-                        variable.addFuzzySet(
-                            FuzzySet(
-                                type=fuzzySetData["type"],
-                                values=fuzzySetData["values"],
-                                name=fuzzySetData["name"],
-                            )
-                        )
-                    self._variables.append(variable)
+            self._inferenceCombobox.set(system.inference)
 
-                self._rulesEditor.delete("1.0", tk.END)
-                self._rulesEditor.insert("1.0", data["rules"])
+            self._variables = system.variables
 
-                self._variablesList.delete(0, tk.END)
-                for variable in self._variables:
-                    self.addNewVariable(None, variable)
+            self._rulesEditor.delete("1.0", tk.END)
+            self._rulesEditor.insert("1.0", system.rules)
 
-                self._variablesList.selection_clear(0, tk.END)
-                self.selectVariable(None)
+            self._variablesList.delete(0, tk.END)
+            for variable in self._variables:
+                self.addNewVariable(None, variable)
 
-                for i, entry in enumerate(self._crispInputs):
-                    entry.insert(0, data["inputs"][i])
+            self._variablesList.selection_clear(0, tk.END)
+            self.selectVariable(None)
 
-                for i, label in enumerate(self._crispOutputs):
-                    label.config(text=data["outputs"][i])
+            for i, entry in enumerate(self._crispInputs):
+                entry.insert(0, system.inputs[i])
 
-                self.filename = filename
-                self._window.title(f"Fuzzy logic toolbox - {self.filename}")
+            for i, label in enumerate(self._crispOutputs):
+                label.config(text=system.outputs[i])
+
+            self.filename = filename
+            self._window.title(f"Fuzzy logic toolbox - {self.filename}")
 
     def saveFile(self):
         if self.filename == "Untitled":
@@ -148,34 +142,19 @@ class Window:
             self.saveToFile(filename)
 
     def saveToFile(self, filename):
-        data = {
-            "title": self._projectTitleEntry.get(),
-            "description": self._projectDescriptionText.get("1.0", tk.END),
-            "variables": [
-                {
-                    "name": variable.name,
-                    "limits": variable.limits,
-                    "type": variable.type,
-                    "fuzzySets": [
-                        {
-                            "name": fuzzySet.name,
-                            "type": fuzzySet.type,
-                            "values": fuzzySet.values,
-                        }
-                        for fuzzySet in variable.fuzzySets
-                    ],
-                }
-                for variable in self._variables
-            ],
-            "rules": self._rulesEditor.get("1.0", tk.END),
-            "inputs": [x.get() for x in self._crispInputs],
-            "outputs": [x.cget('text') for x in self._crispOutputs],
-        }
+        system = System(
+            title=self._projectTitleEntry.get(),
+            description=self._projectDescriptionText.get("1.0", tk.END),
+            variables=self._variables,
+            rules=self._rulesEditor.get("1.0", tk.END),
+            inputs=[x.get() for x in self._crispInputs],
+            outputs=[x.cget('text') for x in self._crispOutputs],
+            inference=self._inferenceCombobox.get(),
+        )
         if not filename.endswith(".json"):
             filename += ".json"
 
-        with open(filename, "w") as file:
-            json.dump(data, file)
+        saveSystem(system, filename)
 
         self.filename = filename
         self._window.title(f"Fuzzy logic toolbox - {self.filename}")
@@ -206,6 +185,14 @@ class Window:
         self._projectDescriptionText.pack(side=tk.TOP, fill=tk.X,
                                           padx=5, pady=5)
 
+        inferenceLabelFrame = ttk.LabelFrame(
+            projectDetailsFrame, text="Inference")
+        inferenceLabelFrame.pack(side=tk.TOP, fill=tk.X, padx=5, pady=5)
+
+        self._inferenceCombobox = ttk.Combobox(
+            inferenceLabelFrame, state="readonly", values=[MAMDANI, SUGENO])
+        self._inferenceCombobox.pack(side=tk.TOP, fill=tk.X, padx=5, pady=5)
+
         variablesFrame = ttk.LabelFrame(simulationFrame, text="Variables")
         variablesFrame.pack(side=tk.TOP, fill=tk.X, padx=5, pady=5)
 
@@ -533,7 +520,7 @@ class Window:
     def addNewFuzzySet(self, event, index):
         fuzzySet = FuzzySet(name=f"Set {len(self._variables[index].fuzzySets)}",
                             values=(0, 0, 0), type=TRI)
-        self._variables[index].fuzzySets.append(fuzzySet)
+        self._variables[index].addFuzzySet(fuzzySet)
         self._selectedVariableFuzzySetsList.insert(
             tk.END, fuzzySet.name)
 
@@ -541,7 +528,7 @@ class Window:
         selection = self._selectedVariableFuzzySetsList.curselection()
         if selection:
             fuzzySetIndex = selection[0]
-            self._variables[index].fuzzySets.pop(fuzzySetIndex)
+            self._variables[index].removeFuzzySet(fuzzySetIndex)
             self._selectedVariableFuzzySetsList.delete(fuzzySetIndex)
             self._selectedVariableFuzzySetsList.selection_set(-1)
             self.selectFuzzySet(None, index)
@@ -553,6 +540,13 @@ class Window:
             if self._selectedFuzzySetIndex != -1:
                 self.updateFuzzySetUi(
                     event, index, self._selectedFuzzySetIndex, select=False)
+
+            # Sugeno consequents don't fit the shape editor, they are edited in the project file
+            if self._variables[index].fuzzySets[fuzzySetIndex].type not in (TRI, TRAP):
+                self._selectedFuzzySetIndex = -1
+                self.setFrameState(
+                    self._selectedVariableFuzzySetDataFrame, tk.DISABLED)
+                return
             self._selectedFuzzySetIndex = fuzzySetIndex
 
             self.setFrameState(
@@ -667,10 +661,7 @@ class Window:
         self._variablesCanvas.configure(scrollregion=self._variablesCanvas.bbox("all"))
 
     def runSimulation(self, event=None):
-        rules = self.getRules().strip().split("\n")
-        rules = [re.sub(r'#.*', '', x) for x in rules]
-        rules = [x.strip() for x in rules]
-        rules = [x for x in rules if x != ""]
+        rules = parseRules(self.getRules())
         if len(rules) == 0:
             messagebox.showerror("Error", "Can't run simulation without rules")
             return
@@ -699,7 +690,7 @@ class Window:
                 return
 
         try:
-            outputs = simulate(self._variables, crispInputs, rules)
+            outputs = simulate(self._variables, crispInputs, rules, self._inferenceCombobox.get())
         except Exception as e:
             messagebox.showerror("Error", str(e))
             return
@@ -1,4 +1,5 @@
-from gui import window
-
 if __name__ == "__main__":
-    window.Window()
\ No newline at end of file
+    # Imported here so the engine and data packages never need tkinter
+    from gui import window
+
+    window.Window()
@@ -0,0 +1,216 @@
+import itertools
+import random
+
+import numpy as np
+import pytest
+
+from data.fuzzy_set import TRAP, TRI, FuzzySet
+from data.rule import Rule
+from data.variable import IN, OUT, Variable
+from engine.codegen import loadModule
+from engine.defuzzification import METHODS, WEIGHTED_AVERAGE
+from engine.engine import CompiledSystem, defuzzify, getIntercept, inference, simulate, simulateBatch
+from engine.operators import IMPLICATIONS, S_NORMS, T_NORMS
+
+# Every fast path has to give exactly what the reference implementation at the top of engine.engine
+# gives, for random systems of n-ary rules
+
+SYSTEMS = 40
+ROWS = 300
+
+
+def _randomSet(rng: random.Random, limits: tuple[int, int], name: str) -> FuzzySet:
+    if rng.random() < 0.5:
+        return FuzzySet(TRI, sorted(rng.randint(*limits) for _ in range(3)), name)
+    return FuzzySet(TRAP, sorted(rng.randint(*limits) for _ in range(4)), name)
+
+
+def _randomCondition(rng: random.Random, inVariables: list[Variable], depth: int = 0) -> str:
+    r = rng.random()
+    if depth > 2 or r < 0.4:
+        variable = rng.choice(inVariables)
+        return f"{variable.name} {rng.choice(variable.fuzzySets).name}"
+    if r < 0.55:
+        return f"not {_randomCondition(rng, inVariables, depth + 1)}"
+    if r < 0.65:
+        return f"({_randomCondition(rng, inVariables, depth + 1)})"
+    operator = rng.choice(["and", "or", "and_not", "or_not"])
+    return f"{_randomCondition(rng, inVariables, depth + 1)} {operator} {_randomCondition(rng, inVariables, depth + 1)}"
+
+
+def randomSystem(seed: int) -> tuple[list[Variable], list[str]]:
+    # Some inputs get enough sets for a SupportIndex, and some rule bases are big enough to be sparse
+    rng = random.Random(seed)
+    variables = []
+    for i in range(rng.randint(1, 4)):
+        variable = Variable(IN, (0, 100), f"in{i}")
+        for j in range(rng.choice([2, 3, 5, 9])):
+            variable.addFuzzySet(_randomSet(rng, variable.limits, f"s{j}"))
+        variables.append(variable)
+    for i in range(rng.randint(1, 2)):
+        variable = Variable(OUT, (0, 100), f"out{i}")
+        for j in range(rng.randint(2, 5)):
+            variable.addFuzzySet(_randomSet(rng, variable.limits, f"s{j}"))
+        variables.append(variable)
+
+    inVariables = [x for x in variables if x.type == IN]
+    outVariables = [x for x in variables if x.type == OUT]
+    rules = []
+    for _ in range(rng.choice([3, 10, 24])):
+        consequents = ", ".join(f"{x.name} {rng.choice(x.fuzzySets).name}"
+                                for x in rng.sample(outVariables, rng.randint(1, len(outVariables))))
+        weight = f" ({rng.choice([0.25, 0.5])})" if rng.random() < 0.3 else ""
+        rules.append(f"{_randomCondition(rng, inVariables)} => {consequents}{weight}")
+    return variables, rules
+
+
+def randomInputs(variables: list[Variable], seed: int, rows: int = ROWS) -> np.ndarray:
+    # Integers hit the breakpoints and corners, the rest lands in between
+    inVariables = [x for x in variables if x.type == IN]
+    rng = np.random.default_rng(seed)
+    inputs = rng.uniform(0, 100, (rows, len(inVariables)))
+    inputs[::3] = np.round(inputs[::3])
+    return inputs
+
+
+def _referenceEvaluate(variables: list[Variable], rules: list[str], input: list[float]):
+    inVariables = [x for x in variables if x.type == IN]
+    outVariables = [x for x in variables if x.type == OUT]
+    fuzzyInputs = [[getIntercept(set.getCorners(), [0, 1, 1, 0], x) if set.getCorners()[0] < x < set.getCorners()[3]
+                    else 0 for set in variable.fuzzySets] for variable, x in zip(inVariables, input)]
+    fuzzyOutputs = inference([Rule(x) for x in rules], fuzzyInputs, inVariables, outVariables)
+    try:
+        return fuzzyOutputs, defuzzify(outVariables, fuzzyOutputs)
+    except ZeroDivisionError:
+        return fuzzyOutputs, None
+
+
+def _assertSameRows(expected: np.ndarray, actual: np.ndarray):
+    # NaN where no rule fired, bit for bit everywhere else
+    assert np.array_equal(expected, actual, equal_nan=True)
+
+
+@pytest.mark.parametrize("seed", range(SYSTEMS))
+def test_compiled_matches_reference(seed: int):
+    variables, rules = randomSystem(seed)
+    system = CompiledSystem(variables, rules)
+    for input in randomInputs(variables, seed).tolist():
+        fuzzyOutputs, expected = _referenceEvaluate(variables, rules, input)
+        assert system.infer(system.fuzzify(input)) == fuzzyOutputs
+        if expected is None:
+            with pytest.raises(ZeroDivisionError):
+                simulate(variables, input, rules)
+        else:
+            assert simulate(variables, input, rules) == expected
+
+
+@pytest.mark.parametrize("seed", range(SYSTEMS))
+def test_batch_matches_scalar(seed: int):
+    variables, rules = randomSystem(seed)
+    inputs = randomInputs(variables, seed)
+    crisp, dominant = simulateBatch(variables, inputs, rules)
+    for sparse in (False, True):
+        system = CompiledSystem(variables, rules, sparse=sparse)
+        sparseCrisp, sparseDominant = system.evaluateBatch(inputs)
+        _assertSameRows(crisp, sparseCrisp)
+        assert np.array_equal(dominant, sparseDominant)
+
+        fuzzyOutputs = system.inferBatch(system.fuzzifyBatch(inputs))
+        for i, input in enumerate(inputs.tolist()):
+            scalar = system.infer(system.fuzzify(input))
+            for outputs, batch in zip(scalar, fuzzyOutputs):
+                assert np.array_equal(np.array(outputs, dtype=float), batch[i])
+            try:
+                expected = [x for x, _ in system.evaluate(input)]
+            except ZeroDivisionError:
+                assert np.isnan(crisp[i]).any()
+            else:
+                assert crisp[i].tolist() == expected
+
+
+@pytest.mark.parametrize("seed", range(SYSTEMS))
+def test_fuzzify_matches_closed_form(seed: int):
+    variables, rules = randomSystem(seed)
+    system = CompiledSystem(variables, rules)
+    inputs = randomInputs(variables, seed)
+    batch = system.fuzzifyBatch(inputs)
+    for i, input in enumerate(inputs.tolist()):
+        dense = system.fuzzify(input)
+        assert [[x for x in row if x] for row in dense] == [[x for _, x in row] for row in system.fuzzifySparse(input)]
+        for variable, memberships, rows, x in zip(system.inVariables, dense, batch, input):
+            assert memberships == [set.getMembership(x) for set in variable.fuzzySets]
+            assert np.array_equal(np.array(memberships, dtype=float), rows[i])
+
+
+@pytest.mark.parametrize("seed", range(0, SYSTEMS, 4))
+def test_generated_module_matches_compiled(seed: int, tmp_path):
+    variables, rules = randomSystem(seed)
+    module = loadModule(variables, rules, directory=str(tmp_path))
+    system = CompiledSystem(variables, rules)
+    inputs = randomInputs(variables, seed)
+    crisp, dominant = system.evaluateBatch(inputs)
+    generatedCrisp, generatedDominant = module.evaluateBatch(inputs)
+    _assertSameRows(crisp, generatedCrisp)
+    assert np.array_equal(dominant, generatedDominant)
+    for i, input in enumerate(inputs.tolist()):
+        try:
+            expected = system.evaluate(input)
+        except ZeroDivisionError:
+            with pytest.raises(ZeroDivisionError):
+                module.evaluate(input)
+        else:
+            assert module.evaluate(input) == expected
+
+
+@pytest.mark.parametrize("andMethod, orMethod, ruleAggregation", list(itertools.product(T_NORMS, S_NORMS, S_NORMS)))
+def test_operators_batch_matches_scalar(andMethod: str, orMethod: str, ruleAggregation: str):
+    variables, rules = randomSystem(7)
+    inputs = randomInputs(variables, 7, 100)
+    system = CompiledSystem(variables, rules, andMethod=andMethod, orMethod=orMethod, ruleAggregation=ruleAggregation)
+    fuzzyOutputs = system.inferBatch(system.fuzzifyBatch(inputs))
+    for i, input in enumerate(inputs.tolist()):
+        scalar = system.infer(system.fuzzify(input))
+        for outputs, batch in zip(scalar, fuzzyOutputs):
+            assert all(0 <= x <= 1 for x in outputs)
+            assert np.array_equal(np.array(outputs, dtype=float), batch[i])
+
+
+@pytest.mark.parametrize("implication", IMPLICATIONS)
+@pytest.mark.parametrize("method", [x for x in METHODS if x != WEIGHTED_AVERAGE])
+@pytest.mark.parametrize("seed", range(0, SYSTEMS, 5))
+def test_defuzzification_batch_matches_scalar(method: str, seed: int, implication: str):
+    variables, rules = randomSystem(seed)
+    system = CompiledSystem(variables, rules, defuzzification=method, implication=implication)
+    inputs = randomInputs(variables, seed, 100)
+    crisp, _ = system.evaluateBatch(inputs)
+    for i, input in enumerate(inputs.tolist()):
+        try:
+            expected = [x for x, _ in system.evaluate(input)]
+        except ZeroDivisionError:
+            assert np.isnan(crisp[i]).any()
+        else:
+            assert crisp[i].tolist() == expected
+
+
+def _assertSimulateMatchesCompiled(variables: list[Variable], rules: list[str], inputs: list[list[float]]):
+    system = CompiledSystem(variables, rules)
+    for input in inputs:
+        try:
+            expected = system.evaluate(input)
+        except ZeroDivisionError:
+            continue
+        assert simulate(variables, input, rules) == expected
+
+
+def test_simulate_follows_edits():
+    # simulate() reuses its compiled systems, which must never outlive an edit
+    variables, rules = randomSystem(3)
+    inputs = randomInputs(variables, 3, 50).tolist()
+    _assertSimulateMatchesCompiled(variables, rules, inputs)
+
+    fuzzySet = next(x for x in variables if x.type == IN).fuzzySets[0]
+    fuzzySet.values = [0, 0, 50, 100] if fuzzySet.type == TRAP else [0, 50, 100]
+    _assertSimulateMatchesCompiled(variables, rules, inputs)
+
+    next(x for x in variables if x.type == IN).setLookupTable(7)
+    _assertSimulateMatchesCompiled(variables, rules, inputs)
@@ -0,0 +1,114 @@
+import argparse
+import sys
+
+from data.system import loadSystem, saveSystem
+from engine.defuzzification import METHODS, WEIGHTED_AVERAGE
+from engine.operators import MAXIMUM, MINIMUM
+from tuning.dataset import DATASET_CHUNK_ROWS, loadDataset
+from tuning.genetic import GeneticTuner
+from tuning.gradient import ADAM, OPTIMIZERS, S_NORM_GRADIENTS, T_NORM_GRADIENTS, GradientTrainer
+
+
+def genetic(args: argparse.Namespace) -> int:
+    project = loadSystem(args.system)
+    inputs, targets = loadDataset(args.data, project.variables)
+
+    def report(generation: int, error: float):
+        if not args.quiet:
+            print(f"Generation {generation}: error {error:.6f}", file=sys.stderr)
+
+    with GeneticTuner(project, inputs, targets, populationSize=args.population, generations=args.generations,
+                      mutationRate=args.mutation_rate, mutationScale=args.mutation_scale,
+                      tuneWeights=args.weights, decimals=args.decimals, workers=args.workers, seed=args.seed,
+                      defuzzification=args.defuzzification) as tuner:
+        tuned = tuner.run(report)
+    saveSystem(tuned, args.output)
+
+    if not args.quiet:
+        print(f"Error {tuner.initialError:.6f} -> {tuner.bestError:.6f} on {len(inputs)} rows, saved to {args.output}",
+              file=sys.stderr)
+    return 0
+
+
+def gradient(args: argparse.Namespace) -> int:
+    project = loadSystem(args.system)
+
+    def report(epoch: int, error: float):
+        if not args.quiet:
+            print(f"Epoch {epoch + 1}: error {error:.6f}", file=sys.stderr)
+
+    # The dataset is read chunk by chunk, so it never has to fit in memory
+    trainer = GradientTrainer(project, optimizer=args.optimizer, learningRate=args.learning_rate,
+                              batchSize=args.batch_size, decimals=args.decimals, seed=args.seed,
+                              andMethod=args.and_method, orMethod=args.or_method, ruleAggregation=args.rule_aggregation)
+    tuned = trainer.fit(args.data, args.epochs, report, args.chunk_rows)
+    saveSystem(tuned, args.output)
+
+    if not args.quiet:
+        print(f"Error {trainer.initialError:.6f} -> {trainer.bestError:.6f}, saved to {args.output}", file=sys.stderr)
+    return 0
+
+
+def main(argv: list[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(prog="python -m tuning", description="Fit fuzzy systems to data")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    geneticParser = commands.add_parser("genetic", help="tune set breakpoints with a genetic algorithm")
+    geneticParser.add_argument("system", help="project file saved from the GUI")
+    geneticParser.add_argument("data", help="CSV file with a header naming every input and output variable, "
+                                            "or NDJSON objects keyed by variable name")
+    geneticParser.add_argument("-o", "--output", required=True, help="project file to write the tuned system to")
+    geneticParser.add_argument("-g", "--generations", type=int, default=50)
+    geneticParser.add_argument("-p", "--population", type=int, default=40, help="candidates per generation")
+    geneticParser.add_argument("--mutation-rate", type=float, default=0.2, help="chance of every point to move")
+    geneticParser.add_argument("--mutation-scale", type=float, default=0.05,
+                               help="how far points move, as a share of their range")
+    geneticParser.add_argument("--weights", action="store_true", help="tune the rule weights too")
+    geneticParser.add_argument("--decimals", type=int, default=3,
+                               help="decimals the points are rounded to, 0 keeps them whole numbers the GUI can edit")
+    geneticParser.add_argument("-w", "--workers", type=int, help="worker processes, one per CPU by default")
+    geneticParser.add_argument("--seed", type=int, help="seed for a reproducible run")
+    geneticParser.add_argument("-d", "--defuzzification", choices=METHODS, default=WEIGHTED_AVERAGE,
+                               help="how crisp outputs are computed")
+    geneticParser.add_argument("-q", "--quiet", action="store_true", help="don't print progress")
+    geneticParser.set_defaults(run=genetic)
+
+    gradientParser = commands.add_parser("gradient", help="train set breakpoints and Sugeno outputs by gradient "
+                                                          "descent on mini-batches")
+    gradientParser.add_argument("system", help="project file saved from the GUI")
+    gradientParser.add_argument("data", help="CSV file with a header naming every input and output variable, "
+                                             "or NDJSON objects keyed by variable name")
+    gradientParser.add_argument("-o", "--output", required=True, help="project file to write the trained system to")
+    gradientParser.add_argument("-e", "--epochs", type=int, default=10, help="passes over the dataset")
+    gradientParser.add_argument("-b", "--batch-size", type=int, default=64, help="rows per step")
+    gradientParser.add_argument("--optimizer", choices=OPTIMIZERS, default=ADAM)
+    gradientParser.add_argument("--learning-rate", type=float,
+                                help="step size, as a share of the width of the variables")
+    gradientParser.add_argument("--chunk-rows", type=int, default=DATASET_CHUNK_ROWS,
+                                help="rows of the dataset read into memory at once, batches are shuffled within them")
+    gradientParser.add_argument("--and", dest="and_method", choices=list(T_NORM_GRADIENTS), default=MINIMUM,
+                                help="t-norm used for and")
+    gradientParser.add_argument("--or", dest="or_method", choices=list(S_NORM_GRADIENTS), default=MAXIMUM,
+                                help="s-norm used for or")
+    gradientParser.add_argument("--rule-aggregation", choices=list(S_NORM_GRADIENTS), default=MAXIMUM,
+                                help="s-norm combining the rules that fire the same output set")
+    gradientParser.add_argument("--decimals", type=int,
+                                help="decimals the points are rounded to when saved, 0 keeps them whole numbers")
+    gradientParser.add_argument("--seed", type=int, help="seed for a reproducible run")
+    gradientParser.add_argument("-q", "--quiet", action="store_true", help="don't print progress")
+    gradientParser.set_defaults(run=gradient)
+
+    args = parser.parse_args(argv)
+    for name in ("generations", "population", "workers", "epochs", "batch_size", "chunk_rows"):
+        if getattr(args, name, None) is not None and getattr(args, name) <= 0:
+            parser.error(f"{name} must be positive")
+
+    try:
+        return args.run(args)
+    except Exception as e:
+        print(f"Error: {e}", file=sys.stderr)
+        return 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
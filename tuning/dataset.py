@@ -0,0 +1,85 @@
+import csv
+import json
+import re
+from typing import Iterator
+
+import numpy as np
+
+from data.variable import IN, OUT, Variable
+from engine.engine import CompiledSystem
+from engine.streaming import batched
+
+# Rows of a dataset read at once
+DATASET_CHUNK_ROWS = 65536
+
+# A weight at the end of a rule, "(0.5)". Conditions are the only other parentheses and come before =>.
+WEIGHT_PATTERN = re.compile(r"\s*\(\s*[^()]*\)\s*$")
+
+
+def iterateDataset(filename: str, variables: list[Variable],
+                   chunkRows: int = DATASET_CHUNK_ROWS) -> Iterator[tuple[np.ndarray, np.ndarray]]:
+    # Inputs and the expected crisp outputs, shaped (N, inputs) and (N, outputs), chunkRows rows at a time,
+    # from a CSV file with a header naming every input and output variable, or an NDJSON file of objects
+    # keyed by variable name. Only one chunk is in memory at a time.
+    if chunkRows <= 0:
+        raise Exception("Chunk size must be positive")
+
+    inNames = [x.name for x in variables if x.type == IN]
+    names = inNames + [x.name for x in variables if x.type == OUT]
+    with open(filename, "r", newline="") as file:
+        if filename.endswith((".ndjson", ".jsonl")):
+            records = (json.loads(line) for line in file if line.strip() != "")
+            rows = ([float(record[name]) for name in names] for record in records)
+        else:
+            reader = csv.reader(file)
+            header = [x.strip() for x in next(reader, [])]
+            missing = [name for name in names if name not in header]
+            if missing:
+                raise Exception(f"The dataset has no column for {', '.join(missing)}")
+            columns = [header.index(name) for name in names]
+            rows = ([float(row[i]) for i in columns] for row in reader if row and not all(x.strip() == "" for x in row))
+
+        for chunk in batched(rows, chunkRows):
+            data = np.array(chunk, dtype=float)
+            yield data[:, :len(inNames)], data[:, len(inNames):]
+
+
+def loadDataset(filename: str, variables: list[Variable]) -> tuple[np.ndarray, np.ndarray]:
+    # The whole of a dataset iterateDataset() reads
+    chunks = list(iterateDataset(filename, variables))
+    if not chunks:
+        raise Exception("The dataset is empty")
+    return np.concatenate([x for x, _ in chunks]), np.concatenate([y for _, y in chunks])
+
+
+def getSquaredErrors(system: CompiledSystem, inputs: np.ndarray, targets: np.ndarray) -> np.ndarray:
+    # Squared errors with every output scaled by the width of its variable, so outputs of different
+    # ranges count the same. Rows where no rule fired count as the whole width off.
+    crisp, _ = system.evaluateBatch(inputs)
+    widths = np.array([max(x.limits[1] - x.limits[0], 1e-12) for x in system.outVariables], dtype=float)
+    errors = np.square((crisp - targets) / widths)
+    errors[np.isnan(errors)] = 1.0
+    return errors
+
+
+def getError(system: CompiledSystem, inputs: np.ndarray, targets: np.ndarray) -> float:
+    # Root mean squared error, scaled like getSquaredErrors()
+    return float(np.sqrt(getSquaredErrors(system, inputs, targets).mean()))
+
+
+def setRuleWeights(text: str, weights: list[float]) -> str:
+    # The rules editor text with the weight of every rule replaced, comments and blank lines kept
+    lines = text.split("\n")
+    weights = iter(weights)
+    for i, line in enumerate(lines):
+        rule, hash, comment = line.partition("#")
+        if rule.strip() == "":
+            continue
+
+        space = rule[len(rule.rstrip()):]
+        rule = WEIGHT_PATTERN.sub("", rule.rstrip())
+        weight = float(next(weights))
+        if weight != 1:
+            rule += f" ({weight!r})"
+        lines[i] = rule + space + hash + comment
+    return "\n".join(lines)
@@ -0,0 +1,217 @@
+import multiprocessing
+
+import numpy as np
+
+from data.rule import Rule
+from data.snapshot import SystemSnapshot
+from data.system import System
+from engine.engine import CompiledSystem
+from tuning.dataset import WEIGHT_PATTERN, getError, setRuleWeights
+from tuning.parameters import FreePoints, copySystem
+
+
+class _Fitness:
+    # Scores candidate genes against the dataset. Each worker process gets one copy when it starts.
+
+    def __init__(self, snapshot: SystemSnapshot, genes: list[tuple[int, int, int]], tuneWeights: bool,
+                 inputs: np.ndarray, targets: np.ndarray, options: dict) -> None:
+        self.snapshot = snapshot
+        self.genes = genes
+        self.tuneWeights = tuneWeights
+        self.inputs = inputs
+        self.targets = targets
+        self.options = options
+        # The rules without their weights, which candidates put back
+        self.rules = [WEIGHT_PATTERN.sub("", x) for x in snapshot.getRules()]
+
+    def apply(self, candidate: np.ndarray) -> tuple[list, list[str]]:
+        # Fresh variables and rules with the candidate's breakpoints and weights
+        variables = self.snapshot.getVariables()
+        breakpoints = candidate[:len(self.genes)].tolist()
+        for (v, s, point), value in zip(self.genes, breakpoints):
+            values = list(variables[v].fuzzySets[s].values)
+            values[point] = value
+            variables[v].fuzzySets[s].values = values
+
+        if not self.tuneWeights:
+            return variables, self.snapshot.getRules()
+        weights = candidate[len(self.genes):].tolist()
+        return variables, [rule if weight == 1 else f"{rule} ({weight!r})" for rule, weight in zip(self.rules, weights)]
+
+    def __call__(self, candidate: np.ndarray) -> float:
+        variables, rules = self.apply(candidate)
+        system = CompiledSystem(variables, rules, inference=self.snapshot.inference, **self.options)
+        return getError(system, self.inputs, self.targets)
+
+
+_fitness: _Fitness = None
+
+
+def _initializeWorker(fitness: _Fitness):
+    global _fitness
+    _fitness = fitness
+
+
+def _score(candidate: np.ndarray) -> float:
+    return _fitness(candidate)
+
+
+class GeneticTuner:
+    # Fits the breakpoints of the triangle and trapezoid sets, and optionally the rule weights, to a
+    # dataset of inputs and expected crisp outputs with a real-coded genetic algorithm. Every
+    # generation keeps the best `elite` candidates and breeds the rest from tournament-selected
+    # parents, by swapping whole sets between them and moving points by gaussian noise. Candidates
+    # are scored with batch evaluation, across worker processes when there is more than one. Which
+    # points move and how far is up to FreePoints.
+
+    def __init__(self, system: System, inputs: np.ndarray, targets: np.ndarray, populationSize: int = 40,
+                 generations: int = 50, mutationRate: float = 0.2, mutationScale: float = 0.05,
+                 crossoverRate: float = 0.9, tournamentSize: int = 3, elite: int = 2, tuneWeights: bool = False,
+                 decimals: int | None = 3, workers: int | None = None, seed: int | None = None, **options) -> None:
+        # options are passed to CompiledSystem, like defuzzification or andMethod
+        if populationSize < 2:
+            raise Exception("The population needs at least 2 candidates")
+        if not 0 <= elite < populationSize:
+            raise Exception("Elite must be smaller than the population")
+        if tournamentSize < 1:
+            raise Exception("Tournament size must be positive")
+
+        self.system = system
+        self.populationSize = populationSize
+        self.generations = generations
+        self.mutationRate = mutationRate
+        self.mutationScale = mutationScale
+        self.crossoverRate = crossoverRate
+        self.tournamentSize = tournamentSize
+        self.elite = elite
+        self.tuneWeights = tuneWeights
+        self.decimals = decimals
+        self.workers = workers or multiprocessing.cpu_count()
+        self._rng = np.random.default_rng(seed)
+
+        inputs = np.asarray(inputs, dtype=float)
+        targets = np.asarray(targets, dtype=float)
+        # Compiling here reports errors in the rules or options before any worker starts
+        compiled = CompiledSystem(system.variables, system.getRules(), inference=system.inference, **options)
+        if inputs.ndim != 2 or inputs.shape[1] != len(compiled.inVariables) or len(inputs) == 0:
+            raise Exception(f"Expected an (N, {len(compiled.inVariables)}) array of inputs")
+        if targets.shape != (len(inputs), len(compiled.outVariables)):
+            raise Exception(f"Expected an ({len(inputs)}, {len(compiled.outVariables)}) array of targets")
+
+        # One gene per free point, followed by the weights
+        self._points = FreePoints(system.variables)
+        initial = self._points.initial.tolist()
+        low = self._points.low.tolist()
+        high = self._points.high.tolist()
+        if tuneWeights:
+            # The weights are genes too, after the breakpoints
+            for rule in system.getRules():
+                initial.append(Rule(rule).weight)
+                low.append(0.0)
+                high.append(1.0)
+        if not initial:
+            raise Exception("The system has no breakpoints to tune")
+
+        genes = self._genes = self._points.points
+        self._initial = np.array(initial, dtype=float)
+        self._low = np.array(low, dtype=float)
+        self._high = np.array(high, dtype=float)
+        # Mutations move every gene by a share of the range it can move in
+        self._scale = (self._high - self._low) * mutationScale
+        # The genes crossover swaps one by one, the lone free point of a set and the weights
+        self._single = np.ones(len(initial), dtype=bool)
+        for set in self._points.sets:
+            self._single[set] = False
+        self._fitness = _Fitness(SystemSnapshot(system), genes, tuneWeights, inputs, targets, options)
+        self._pool = None
+        if self.workers > 1:
+            self._pool = multiprocessing.Pool(self.workers, initializer=_initializeWorker, initargs=(self._fitness,))
+
+        self.bestGenes = self._initial
+        self.bestError = None
+        self.initialError = None
+        # The best error after each generation, the first one is the system as it was
+        self.history = []
+
+    def _repair(self, candidate: np.ndarray) -> np.ndarray:
+        if self.decimals is not None:
+            candidate = np.round(candidate, self.decimals)
+        else:
+            candidate = candidate.copy()
+        self._points.repair(candidate[:len(self._genes)])
+        # The weights after the points stay between 0 and 1
+        np.clip(candidate, self._low, self._high, out=candidate)
+        return candidate
+
+    def _evaluate(self, population: list[np.ndarray]) -> np.ndarray:
+        if self._pool is None:
+            return np.array([self._fitness(x) for x in population])
+        chunkSize = max(len(population) // (self.workers * 4), 1)
+        return np.array(self._pool.map(_score, population, chunkSize))
+
+    def _select(self, population: list[np.ndarray], errors: np.ndarray) -> np.ndarray:
+        contestants = self._rng.integers(len(population), size=self.tournamentSize)
+        return population[contestants[np.argmin(errors[contestants])]]
+
+    def _breed(self, first: np.ndarray, second: np.ndarray) -> np.ndarray:
+        rng = self._rng
+        child = first.copy()
+        if rng.random() < self.crossoverRate:
+            # Whole sets are swapped, so a set is never made of points tuned for different neighbours
+            for genes in self._points.sets:
+                if rng.random() < 0.5:
+                    child[genes] = second[genes]
+            swap = self._single & (rng.random(len(child)) < 0.5)
+            child[swap] = second[swap]
+
+        mutate = rng.random(len(child)) < self.mutationRate
+        child[mutate] += rng.normal(0, self._scale[mutate])
+        return self._repair(child)
+
+    def run(self, callback=None) -> System:
+        # callback(generation, bestError) is called after every generation, returning True stops early
+        rng = self._rng
+        population = [self._repair(self._initial.copy())]
+        while len(population) < self.populationSize:
+            population.append(self._repair(self._initial + rng.normal(0, self._scale)))
+        errors = self._evaluate(population)
+        self.initialError = float(errors[0])
+
+        for generation in range(self.generations + 1):
+            best = int(np.argmin(errors))
+            if self.bestError is None or errors[best] < self.bestError:
+                self.bestError = float(errors[best])
+                self.bestGenes = population[best]
+            self.history.append(self.bestError)
+            if callback is not None and callback(generation, self.bestError):
+                break
+            if generation == self.generations:
+                break
+
+            order = np.argsort(errors, kind="stable")
+            children = [population[i] for i in order[:self.elite]]
+            while len(children) < self.populationSize:
+                children.append(self._breed(self._select(population, errors), self._select(population, errors)))
+            population = children
+            errors = self._evaluate(population)
+
+        return self.getSystem()
+
+    def getSystem(self) -> System:
+        # A copy of the system with the best candidate found so far, ready for saveSystem()
+        rules = None
+        if self.tuneWeights:
+            rules = setRuleWeights(self.system.rules, self.bestGenes[len(self._genes):].tolist())
+        return copySystem(self.system, dict(zip(self._genes, self.bestGenes.tolist())), rules)
+
+    def close(self):
+        if self._pool is not None:
+            self._pool.close()
+            self._pool.join()
+            self._pool = None
+
+    def __enter__(self) -> "GeneticTuner":
+        return self
+
+    def __exit__(self, *args):
+        self.close()
@@ -0,0 +1,447 @@
+import math
+
+import numpy as np
+
+from data.fuzzy_set import CONSTANT, TRI
+from data.system import SUGENO, System
+from data.variable import IN, OUT
+from engine.defuzzification import WEIGHTED_AVERAGE
+from engine.engine import AND, AND_NOT, FIRE, NOT, OR, OR_NOT, CompiledSystem
+from engine.operators import DRASTIC, LUKASIEWICZ, MAXIMUM, MINIMUM, PROBABILISTIC_SUM, PRODUCT
+from tuning.dataset import DATASET_CHUNK_ROWS, getSquaredErrors, iterateDataset
+from tuning.parameters import FreePoints, copySystem
+
+SGD = "SGD"
+ADAM = "ADAM"
+OPTIMIZERS = [SGD, ADAM]
+# Steps are taken in widths of the variable a parameter belongs to, these are the default sizes
+LEARNING_RATES = {SGD: 0.05, ADAM: 0.01}
+ADAM_BETAS = (0.9, 0.999)
+ADAM_EPSILON = 1e-8
+
+
+# The partial derivatives (d/da, d/db) of the operators at (a, b). Where an operator has a kink, like min
+# at a == b, the derivative of the side it returns is taken.
+def _minimumGradient(a: np.ndarray, b: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    first = (a <= b).astype(float)
+    return first, 1 - first
+
+
+def _maximumGradient(a: np.ndarray, b: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    first = (a >= b).astype(float)
+    return first, 1 - first
+
+
+def _lukasiewiczTNormGradient(a: np.ndarray, b: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    active = (a + b - 1 > 0).astype(float)
+    return active, active
+
+
+def _lukasiewiczSNormGradient(a: np.ndarray, b: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    active = (a + b < 1).astype(float)
+    return active, active
+
+
+def _drasticTNormGradient(a: np.ndarray, b: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    return ((a != 1) & (b == 1)).astype(float), (a == 1).astype(float)
+
+
+def _drasticSNormGradient(a: np.ndarray, b: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    return ((a != 0) & (b == 0)).astype(float), (a == 0).astype(float)
+
+
+T_NORM_GRADIENTS = {
+    MINIMUM: _minimumGradient,
+    PRODUCT: lambda a, b: (b, a),
+    LUKASIEWICZ: _lukasiewiczTNormGradient,
+    DRASTIC: _drasticTNormGradient,
+}
+S_NORM_GRADIENTS = {
+    MAXIMUM: _maximumGradient,
+    PROBABILISTIC_SUM: lambda a, b: (1 - b, 1 - a),
+    LUKASIEWICZ: _lukasiewiczSNormGradient,
+    DRASTIC: _drasticSNormGradient,
+}
+
+
+def _sumGradient(a: np.ndarray, b: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    # Sugeno adds its rules up
+    ones = np.ones_like(b)
+    return ones, ones
+
+
+def _getMembership(x: np.ndarray, corners: tuple[float, float, float, float]) -> tuple[np.ndarray, list[np.ndarray]]:
+    # FuzzySet.getMembershipBatch() and its derivatives by the four corners
+    a, b, c, d = corners
+    with np.errstate(divide="ignore", invalid="ignore"):
+        rise = (x - a) / (b - a)
+        fall = 1 - (x - c) / (d - c)
+        inside = (x > a) & (x < d)
+        onRise = inside & (x <= b)
+        onFall = inside & (x > b) & (x > c)
+        membership = np.where(inside, np.where(x <= b, rise, np.where(x <= c, 1.0, fall)), 0.0)
+        gradients = [
+            np.where(onRise, (x - b) / (b - a) ** 2, 0.0),
+            np.where(onRise, -(x - a) / (b - a) ** 2, 0.0),
+            np.where(onFall, (d - x) / (d - c) ** 2, 0.0),
+            np.where(onFall, (x - c) / (d - c) ** 2, 0.0),
+        ]
+    return membership, gradients
+
+
+def _getCentroid(type: str, values: np.ndarray) -> tuple[float, np.ndarray]:
+    # FuzzySet.getCentroid() and its derivatives by the values
+    if type == TRI:
+        return float(values.sum()) / 3, np.full(3, 1 / 3)
+
+    # The centroid of the trapezoid polygon simplifies to n / m
+    a, b, c, d = values.tolist()
+    n = a * a + a * b + b * b - c * c - c * d - d * d
+    m = 3 * (a + b - c - d)
+    if m == 0:
+        return a, np.zeros(4)
+    return n / m, np.array([(2 * a + b) * m - 3 * n, (a + 2 * b) * m - 3 * n,
+                            -(2 * c + d) * m + 3 * n, -(c + 2 * d) * m + 3 * n]) / (m * m)
+
+
+class GradientTrainer:
+    # Trains the sets of a system like an ANFIS network: the system is a differentiable function of its
+    # parameters, the loss is the mean squared error of its crisp outputs scaled by the width of each
+    # output variable, and mini-batches of rows move the parameters by SGD with momentum or Adam.
+    # The premise parameters are the breakpoints of the input sets, the consequent parameters the
+    # breakpoints of Mamdani output sets, through their centroids, or the values of Sugeno output sets.
+    #
+    # Every batch runs the program of a CompiledSystem forward over NumPy arrays, keeping what the
+    # backward pass needs, and then backward in reverse order. Kinks, like min at a tie or a set's
+    # corners, take a one-sided derivative. Only the weighted average defuzzification is smooth enough
+    # for this, which is the default and what Sugeno systems use. Breakpoints move within the bounds
+    # FreePoints gives them after every step.
+
+    def __init__(self, system: System, optimizer: str = ADAM, learningRate: float | None = None,
+                 batchSize: int = 64, momentum: float = 0.9, tuneInputs: bool = True, tuneOutputs: bool = True,
+                 decimals: int | None = None, seed: int | None = None, **options) -> None:
+        # options are passed to CompiledSystem, like andMethod or ruleAggregation
+        if optimizer not in OPTIMIZERS:
+            raise Exception(f"Unknown optimizer '{optimizer}'")
+        if batchSize <= 0:
+            raise Exception("Batch size must be positive")
+        if options.get("defuzzification", WEIGHTED_AVERAGE) != WEIGHTED_AVERAGE:
+            raise Exception("Only the weighted average defuzzification can be trained")
+
+        compiled = CompiledSystem(system.variables, system.getRules(), inference=system.inference, **options)
+        if compiled.andMethod not in T_NORM_GRADIENTS:
+            raise Exception(f"The t-norm '{compiled.andMethod}' can't be trained")
+        for name in (compiled.orMethod, compiled.ruleAggregation):
+            if name not in S_NORM_GRADIENTS:
+                raise Exception(f"The s-norm '{name}' can't be trained")
+
+        self.system = system
+        self.compiled = compiled
+        self.optimizer = optimizer
+        self.learningRate = LEARNING_RATES[optimizer] if learningRate is None else learningRate
+        self.batchSize = batchSize
+        self.momentum = momentum
+        self.decimals = decimals
+        self.options = options
+        self._rng = np.random.default_rng(seed)
+
+        self._tNorm = compiled._and.batch
+        self._sNorm = compiled._or.batch
+        self._aggregate = compiled._aggregate.batch
+        self._tNormGradient = T_NORM_GRADIENTS[compiled.andMethod]
+        self._sNormGradient = S_NORM_GRADIENTS[compiled.orMethod]
+        self._aggregateGradient = _sumGradient if system.inference == SUGENO else S_NORM_GRADIENTS[compiled.ruleAggregation]
+
+        variables = system.variables
+        self._inIndices = [v for v, x in enumerate(variables) if x.type == IN]
+        self._outIndices = [v for v, x in enumerate(variables) if x.type == OUT]
+        self._outWidths = np.array([max(variables[v].limits[1] - variables[v].limits[0], 1e-12)
+                                    for v in self._outIndices], dtype=float)
+        # The current values of every set, which the parameters are written into
+        self._values = [[np.array(x.values, dtype=float) for x in variable.fuzzySets] for variable in variables]
+        # The slots of the rules firing each output set, in the order CompiledSystem aggregates them
+        self._contributors = {(i, j): [] for i, names in enumerate(compiled.outSetNames) for j in range(len(names))}
+        for _, _, _, target, targets in compiled.program:
+            for outSet in targets:
+                self._contributors[outSet].append(target)
+
+        # The parameters: free breakpoints first, then the values of Sugeno output sets, each with the
+        # width its steps are measured in
+        types = (IN,) if not tuneOutputs or system.inference == SUGENO else (IN, OUT)
+        self._points = FreePoints(variables, types if tuneInputs else types[1:])
+        keys = list(self._points.points)
+        initial = self._points.initial.tolist()
+        scales = self._points.widths.tolist()
+        if tuneOutputs and system.inference == SUGENO:
+            inWidths = [max(variables[v].limits[1] - variables[v].limits[0], 1e-12) for v in self._inIndices]
+            for i, v in enumerate(self._outIndices):
+                for s, fuzzySet in enumerate(variables[v].fuzzySets):
+                    for point, value in enumerate(fuzzySet.values):
+                        keys.append((v, s, point))
+                        initial.append(value)
+                        # A coefficient moves the output by its step over the whole width of its input
+                        last = fuzzySet.type == CONSTANT or point == len(fuzzySet.values) - 1
+                        scales.append(self._outWidths[i] / (1 if last else inWidths[point]))
+        if not keys:
+            raise Exception("The system has no parameters to train")
+
+        self._keys = keys
+        self.parameters = np.array(initial, dtype=float)
+        self._scales = np.array(scales, dtype=float)
+        self._moment = np.zeros(len(keys))
+        self._secondMoment = np.zeros(len(keys))
+        self.steps = 0
+        # Set by fit(): the error on the whole dataset before training and after every epoch, and the
+        # parameters with the lowest
+        self.history = []
+        self.initialError = None
+        self.bestError = None
+        self.bestParameters = self.parameters.copy()
+
+    def _apply(self):
+        for (v, s, point), value in zip(self._keys, self.parameters.tolist()):
+            self._values[v][s][point] = value
+
+    def _forward(self, inputs: np.ndarray) -> tuple:
+        compiled = self.compiled
+        n = len(inputs)
+        registers = np.empty((compiled.slotCount, n))
+        memberships = []
+        slot = 0
+        for i, v in enumerate(self._inIndices):
+            for s, fuzzySet in enumerate(self.system.variables[v].fuzzySets):
+                values = self._values[v][s]
+                corners = (values[0], values[1], values[1], values[2]) if fuzzySet.type == TRI else tuple(values)
+                registers[slot], gradients = _getMembership(inputs[:, i], corners)
+                memberships.append((v, s, fuzzySet.type, gradients))
+                slot += 1
+
+        for opcode, a, b, target, _ in compiled.program:
+            value = registers[target]
+            if opcode == AND:
+                self._tNorm(registers[a], registers[b], out=value)
+            elif opcode == OR:
+                self._sNorm(registers[a], registers[b], out=value)
+            elif opcode == AND_NOT:
+                self._tNorm(registers[a], 1 - registers[b], out=value)
+            elif opcode == OR_NOT:
+                self._sNorm(registers[a], 1 - registers[b], out=value)
+            elif opcode == NOT:
+                np.subtract(1, registers[a], out=value)
+            elif opcode != FIRE:
+                np.multiply(registers[a], b, out=value)
+
+        # Every step of every aggregation is kept, the backward pass needs what each rule was added to
+        aggregations = {}
+        for target, slots in self._contributors.items():
+            steps = [np.zeros(n)]
+            for slot in slots:
+                steps.append(self._aggregate(steps[-1], registers[slot], out=np.empty(n)))
+            aggregations[target] = steps
+
+        # Same order of operations as CompiledSystem.defuzzifyBatch()
+        crisp = np.empty((n, len(self._outIndices)))
+        consequents = []
+        for i, v in enumerate(self._outIndices):
+            weighted = np.zeros(n)
+            total = np.zeros(n)
+            outputs = []
+            for j, fuzzySet in enumerate(self.system.variables[v].fuzzySets):
+                values = self._values[v][j]
+                if self.system.inference == SUGENO:
+                    z = np.zeros(n)
+                    if fuzzySet.type != CONSTANT:
+                        for k, coefficient in enumerate(values[:-1].tolist()):
+                            z += coefficient * inputs[:, k]
+                    z += values[-1]
+                    centroidGradient = None
+                else:
+                    centroid, centroidGradient = _getCentroid(fuzzySet.type, values)
+                    z = np.full(n, centroid)
+                output = aggregations[(i, j)][-1]
+                weighted += z * output
+                total += output
+                outputs.append((z, centroidGradient))
+            with np.errstate(divide="ignore", invalid="ignore"):
+                crisp[:, i] = weighted / total
+            consequents.append((outputs, total))
+
+        return registers, memberships, aggregations, crisp, consequents
+
+    def _backward(self, inputs: np.ndarray, targets: np.ndarray) -> tuple[float, int, np.ndarray]:
+        # The mean loss of the batch, the number of outputs it counts and its gradient by every parameter
+        registers, memberships, aggregations, crisp, consequents = self._forward(inputs)
+        valid = ~(np.isnan(crisp) | np.isnan(targets))
+        count = int(valid.sum())
+        if count == 0:
+            return 0.0, 0, np.zeros(len(self._keys))
+        errors = np.where(valid, (crisp - targets) / self._outWidths, 0.0)
+        loss = float(np.square(errors).sum()) / count
+        crispGradient = 2 * errors / self._outWidths / count
+        crisp = np.where(valid, crisp, 0.0)
+
+        slotGradients = np.zeros_like(registers)
+        gradients = [[np.zeros(len(x)) for x in sets] for sets in self._values]
+        for i, v in enumerate(self._outIndices):
+            outputs, total = consequents[i]
+            gradient = crispGradient[:, i]
+            share = gradient / np.where(total > 0, total, 1.0)
+            for j, (z, centroidGradient) in enumerate(outputs):
+                output = aggregations[(i, j)][-1]
+                # The weighted average moves towards a set's output as the set grows, and with the output
+                zGradient = share * output
+                if centroidGradient is None:
+                    values = gradients[v][j]
+                    values[-1] += zGradient.sum()
+                    if self.system.variables[v].fuzzySets[j].type != CONSTANT:
+                        values[:-1] += zGradient @ inputs[:, :len(values) - 1]
+                else:
+                    gradients[v][j] += zGradient.sum() * centroidGradient
+
+                outputGradient = share * (z - crisp[:, i])
+                steps = aggregations[(i, j)]
+                for k in range(len(steps) - 1, 0, -1):
+                    slot = self._contributors[(i, j)][k - 1]
+                    first, second = self._aggregateGradient(steps[k - 1], registers[slot])
+                    slotGradients[slot] += outputGradient * second
+                    outputGradient = outputGradient * first
+
+        for opcode, a, b, target, _ in reversed(self.compiled.program):
+            gradient = slotGradients[target]
+            if opcode == FIRE or not gradient.any():
+                continue
+            if opcode == AND or opcode == AND_NOT:
+                right = registers[b] if opcode == AND else 1 - registers[b]
+                first, second = self._tNormGradient(registers[a], right)
+            elif opcode == OR or opcode == OR_NOT:
+                right = registers[b] if opcode == OR else 1 - registers[b]
+                first, second = self._sNormGradient(registers[a], right)
+            elif opcode == NOT:
+                slotGradients[a] -= gradient
+                continue
+            else:
+                slotGradients[a] += gradient * b
+                continue
+            slotGradients[a] += gradient * first
+            slotGradients[b] += gradient * (second if opcode == AND or opcode == OR else -second)
+
+        for slot, (v, s, type, cornerGradients) in enumerate(memberships):
+            gradient = slotGradients[slot]
+            if not gradient.any():
+                continue
+            corners = [float(gradient @ x) for x in cornerGradients]
+            # A triangle's peak is both middle corners
+            gradients[v][s] += [corners[0], corners[1] + corners[2], corners[3]] if type == TRI else corners
+
+        return loss, count, np.array([gradients[v][s][point] for v, s, point in self._keys])
+
+    def getGradient(self, inputs: np.ndarray, targets: np.ndarray) -> tuple[float, np.ndarray]:
+        # The loss of a batch at the current parameters and its gradient, without a step
+        self._apply()
+        loss, _, gradient = self._backward(*self._clean(inputs, targets))
+        return loss, gradient
+
+    def _clean(self, inputs: np.ndarray, targets: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+        inputs = np.asarray(inputs, dtype=float)
+        targets = np.asarray(targets, dtype=float)
+        if inputs.ndim != 2 or inputs.shape[1] < len(self._inIndices):
+            raise Exception(f"Expected an (N, {len(self._inIndices)}) array of inputs")
+        if targets.shape != (len(inputs), len(self._outIndices)):
+            raise Exception(f"Expected an ({len(inputs)}, {len(self._outIndices)}) array of targets")
+        # Rows with a missing input teach nothing and would spread NaN through the gradient
+        keep = ~np.isnan(inputs).any(axis=1)
+        return inputs[keep], targets[keep]
+
+    def _step(self, inputs: np.ndarray, targets: np.ndarray) -> tuple[float, int]:
+        self._apply()
+        loss, count, gradient = self._backward(inputs, targets)
+        if count == 0:
+            return loss, count
+
+        # Gradients by parameters measured in widths, so one learning rate suits every variable
+        gradient *= self._scales
+        self.steps += 1
+        if self.optimizer == ADAM:
+            first, second = ADAM_BETAS
+            self._moment = first * self._moment + (1 - first) * gradient
+            self._secondMoment = second * self._secondMoment + (1 - second) * gradient * gradient
+            moment = self._moment / (1 - first ** self.steps)
+            secondMoment = self._secondMoment / (1 - second ** self.steps)
+            step = self.learningRate * moment / (np.sqrt(secondMoment) + ADAM_EPSILON)
+        else:
+            self._moment = self.momentum * self._moment + gradient
+            step = self.learningRate * self._moment
+
+        self.parameters -= step * self._scales
+        self._points.repair(self.parameters[:len(self._points)])
+        return loss, count
+
+    def trainBatch(self, inputs: np.ndarray, targets: np.ndarray) -> float:
+        # One step on one batch, returns its loss before the step
+        return self._step(*self._clean(inputs, targets))[0]
+
+    def _getChunks(self, data, chunkRows: int):
+        # data is a dataset file, read chunk by chunk, or (inputs, targets) arrays
+        if isinstance(data, str):
+            yield from iterateDataset(data, self.system.variables, chunkRows)
+            return
+        inputs, targets = data
+        for start in range(0, len(inputs), chunkRows):
+            yield inputs[start:start + chunkRows], targets[start:start + chunkRows]
+
+    def fit(self, data, epochs: int = 10, callback=None, chunkRows: int = DATASET_CHUNK_ROWS) -> System:
+        # Trains on data, a dataset file streamed chunkRows rows at a time or (inputs, targets) arrays.
+        # Rows are shuffled within each chunk. After every epoch the parameters are scored on all of
+        # data, and the best ones are kept: a step can leave a row that no rule covers, which has no
+        # gradient but counts in the error. callback(epoch, error) is called after every epoch,
+        # returning True stops early.
+        if self.bestError is None:
+            self.initialError = self.bestError = self.getError(data, chunkRows)
+            self.bestParameters = self.parameters.copy()
+            self.history.append(self.bestError)
+
+        for epoch in range(epochs):
+            for inputs, targets in self._getChunks(data, chunkRows):
+                inputs, targets = self._clean(inputs, targets)
+                order = self._rng.permutation(len(inputs))
+                for start in range(0, len(order), self.batchSize):
+                    rows = order[start:start + self.batchSize]
+                    self._step(inputs[rows], targets[rows])
+
+            error = self.getError(data, chunkRows)
+            self.history.append(error)
+            if error < self.bestError:
+                self.bestError = error
+                self.bestParameters = self.parameters.copy()
+            if callback is not None and callback(epoch, error):
+                break
+
+        if not np.array_equal(self.parameters, self.bestParameters):
+            # Moving on from the best parameters starts the optimizer afresh
+            self.parameters = self.bestParameters.copy()
+            self._moment[:] = 0
+            self._secondMoment[:] = 0
+            self.steps = 0
+        return self.getSystem()
+
+    def getError(self, data, chunkRows: int = DATASET_CHUNK_ROWS) -> float:
+        # The error of the current parameters on data, like tuning.dataset.getError(), read chunk by chunk
+        system = self.getSystem()
+        compiled = CompiledSystem(system.variables, system.getRules(), inference=system.inference, **self.options)
+        total = 0.0
+        count = 0
+        for inputs, targets in self._getChunks(data, chunkRows):
+            errors = getSquaredErrors(compiled, inputs, targets)
+            total += float(errors.sum())
+            count += errors.size
+        if count == 0:
+            raise Exception("The dataset is empty")
+        return math.sqrt(total / count)
+
+    def getSystem(self) -> System:
+        # A copy of the system with the current parameters, ready for saveSystem()
+        parameters = self.parameters.copy()
+        if self.decimals is not None:
+            parameters = np.round(parameters, self.decimals)
+            self._points.repair(parameters[:len(self._points)])
+        return copySystem(self.system, dict(zip(self._keys, parameters.tolist())))
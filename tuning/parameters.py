@@ -0,0 +1,99 @@
+import numpy as np
+
+from data.fuzzy_set import TRAP, TRI, FuzzySet
+from data.system import System
+from data.variable import IN, OUT, Variable
+
+# The narrowest a set can get, as a share of its variable's width
+MINIMUM_SPAN = 1e-3
+
+
+class FreePoints:
+    # The breakpoints of triangle and trapezoid sets an optimizer may move, as a flat vector. Points on
+    # the limits of their variable stay there, so the shoulders at the edges keep covering them. Every
+    # other point stays between the limits, or the pinned points around it, and the points of a set
+    # stay sorted like the GUI requires, and never all meet. The points of a set are next to each other in the vector, and
+    # sets holds the slice of every set with more than one.
+
+    def __init__(self, variables: list[Variable], types: tuple[str, ...] = (IN, OUT)) -> None:
+        # (variable, set, point) of every free point, indexing into variables
+        self.points: list[tuple[int, int, int]] = []
+        initial = []
+        low = []
+        high = []
+        self.sets: list[slice] = []
+        # (free points, the lowest and highest pinned point or None, smallest width) of every set with free points
+        self._spans = []
+        for v, variable in enumerate(variables):
+            if variable.type not in types:
+                continue
+            for s, fuzzySet in enumerate(variable.fuzzySets):
+                if fuzzySet.type not in (TRI, TRAP):
+                    continue
+                values = fuzzySet.values
+                pinned = [x in variable.limits for x in values]
+                lower = min(variable.limits[0], *values)
+                upper = max(variable.limits[1], *values)
+                start = len(self.points)
+                for point, value in enumerate(values):
+                    if pinned[point]:
+                        continue
+                    self.points.append((v, s, point))
+                    initial.append(value)
+                    low.append(max([lower] + [x for x, p in zip(values[:point], pinned) if p]))
+                    high.append(min([upper] + [x for x, p in zip(values[point + 1:], pinned[point + 1:]) if p]))
+                if len(self.points) - start > 1:
+                    self.sets.append(slice(start, len(self.points)))
+                if len(self.points) > start:
+                    fixed = [x for x, p in zip(values, pinned) if p]
+                    self._spans.append((slice(start, len(self.points)), min(fixed) if fixed else None,
+                                        max(fixed) if fixed else None, (upper - lower) * MINIMUM_SPAN))
+
+        self.initial = np.array(initial, dtype=float)
+        self.low = np.array(low, dtype=float)
+        self.high = np.array(high, dtype=float)
+        # The width of the variable of every point, the scale of its moves
+        self.widths = np.array([variables[v].limits[1] - variables[v].limits[0] for v, _, _ in self.points], dtype=float)
+
+    def __len__(self) -> int:
+        return len(self.points)
+
+    def repair(self, values: np.ndarray) -> np.ndarray:
+        # The closest valid points, in place: within their bounds and sorted within every set
+        np.clip(values, self.low, self.high, out=values)
+        for set in self.sets:
+            values[set] = np.sort(values[set])
+
+        # A set whose points all meet has no shape, and an output set no centroid. The free point on
+        # the open side moves out again.
+        for set, lowest, highest, span in self._spans:
+            first = values[set.start]
+            last = values[set.stop - 1]
+            bottom = first if lowest is None else min(first, lowest)
+            top = last if highest is None else max(last, highest)
+            if top - bottom >= span:
+                continue
+            if highest is None or last >= highest:
+                values[set.stop - 1] = min(bottom + span, self.high[set.stop - 1])
+            else:
+                values[set.start] = max(top - span, self.low[set.start])
+        return values
+
+
+def copySystem(system: System, values: dict[tuple[int, int, int], float], rules: str | None = None) -> System:
+    # A copy of system with the given (variable, set, point) values replaced, and optionally the rules text,
+    # ready for saveSystem()
+    variables = []
+    for v, original in enumerate(system.variables):
+        variable = Variable(original.type, original.limits, original.name)
+        if original.lookupResolution is not None:
+            variable.setLookupTable(original.lookupResolution, original.lookupInterpolate)
+        for s, fuzzySet in enumerate(original.fuzzySets):
+            setValues = [values.get((v, s, point), value) for point, value in enumerate(fuzzySet.values)]
+            # Whole numbers are written without a fraction, which the GUI can edit
+            setValues = [int(x) if isinstance(x, float) and x.is_integer() else x for x in setValues]
+            variable.addFuzzySet(FuzzySet(fuzzySet.type, setValues, fuzzySet.name))
+        variables.append(variable)
+
+    return System(system.title, system.description, variables, system.rules if rules is None else rules,
+                  list(system.inputs), list(system.outputs), system.inference)